@@ -1,2 +1,17 @@
-from .slider import *
-import labext.apps.annotators as annotators
+from typing import TYPE_CHECKING
+
+from labext.helpers import lazy_attrs
+
+if TYPE_CHECKING:
+    from .slider import slider
+    import labext.apps.annotators as annotators
+
+
+# apps are imported on first access to keep `import labext.prelude` cheap
+LAZY_ATTRS = {
+    "slider": (".slider", "slider"),
+    "annotators": (".annotators", None),
+}
+__getattr__, __dir__ = lazy_attrs(__name__, LAZY_ATTRS)
+# star-imports export the lazy attributes (they are imported then)
+__all__ = list(LAZY_ATTRS.keys())
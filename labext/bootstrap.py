@@ -0,0 +1,247 @@
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import List, Type, TYPE_CHECKING, Optional
+
+from labext.cache import AssetCache
+
+if TYPE_CHECKING:
+    from labext.module import Module
+
+
+class Bootstrap:
+    """Compile a set of modules into a single minified JS payload that registers all of them (and their dependencies)
+    in one go.
+
+    The payload configures `requirejs` paths and injects CSS files only once per page: re-executing it is a no-op as it is
+    guarded by a hash of the module set. The code that binds the tunnels of the modules (`Module.init_code`) is always
+    executed, but it guards itself per tunnel so that only new tunnels are bound.
+
+    Compiled payloads are cached on disk under the hash of their inputs: the code that binds the tunnels and the JS/CSS
+    files of the modules, so changing any of them (even without bumping the versions) compiles a new payload.
+
+    Example:
+        >>> bootstrap = Bootstrap([DataTable, Tippy])
+        >>> display(*bootstrap.widgets(), Javascript(bootstrap.compile()))
+    """
+    guard = "__LabExtBootstrap_BV12__"
+
+    def __init__(self, modules: List[Type['Module']], use_local: bool = True):
+        from labext.module import Module
+        self.modules = Module.resolve(modules)
+        self.use_local = use_local
+        self._hash: Optional[str] = None
+
+    def get_hash(self) -> str:
+        if self._hash is None:
+            key = [[m.id(), m.version, m.js(), m.css(), m.init_code()] for m in self.modules]
+            key.append([self.use_local, labext_version()])
+            self._hash = hashlib.sha256(json.dumps(key).encode()).hexdigest()[:16]
+        return self._hash
+
+    def get_cache_file(self) -> Path:
+        return AssetCache.default_root() / "bootstrap" / f"{self.get_hash()}.js"
+
+    def widgets(self) -> list:
+        """Widgets (e.g., tunnels) that the modules need to display along with the payload"""
+        widgets = []
+        for m in self.modules:
+            widgets += m.comm_widgets()
+        return widgets
+
+    def compile(self, force: bool = False) -> str:
+        """Get the payload, which is loaded from the disk cache if it has been compiled before
+
+        Parameters
+        ----------
+        force: bool
+            ignore the disk cache and re-compile the payload
+        """
+        if self.use_local:
+            from labext.module import Module
+            # ensure the files are available, it costs nothing if they are already in the cache
+            Module.download_all(self.modules)
+
+        cache_file = self.get_cache_file()
+        if not force and cache_file.exists():
+            with open(str(cache_file), "r") as f:
+                return f.read()
+
+        jscode = self._compile()
+        cache_file.parent.mkdir(exist_ok=True, parents=True)
+        tmp_file = str(cache_file) + f".{os.getpid()}"
+        with open(tmp_file, "w") as f:
+            f.write(jscode)
+        os.replace(tmp_file, str(cache_file))
+        return jscode
+
+    def _compile(self) -> str:
+        paths = {}
+        preload = []
+        css_files = []
+        init_code = []
+
+        for m in self.modules:
+            if self.use_local:
+                js = {k: m.remap_urls[url] for k, url in m.js().items()}
+                css = [m.remap_urls[url] for url in m.css()]
+            else:
+                js = m.js()
+                css = m.css()
+
+            dup_js = set(paths.keys()).intersection(js.keys())
+            assert len(dup_js) == 0, f"Duplicated js: {dup_js}"
+            paths.update(js)
+            preload += list(js.keys())
+            css_files += [(m.id(), i, file) for i, file in enumerate(css)]
+            code = m.init_code()
+            if code is not None and code != "":
+                init_code.append(code)
+
+        setup = []
+        if len(paths) > 0:
+            setup.append("require.config({ paths: %s });" % json.dumps(paths))
+            # load the modules early so that they are ready when widgets are rendered
+            setup.append("require(%s);" % json.dumps(preload))
+        for module_id, i, file in css_files:
+            css_id = f"{module_id}-css-fds82j1-{i}"
+            setup.append(f"""
+if (document.querySelector("head link#{css_id}") === null) {{
+    var el = document.createElement("link");
+    el.rel = "stylesheet";
+    el.id = "{css_id}";
+    el.type = "text/css";
+    el.href = "{file}";
+    document.head.appendChild(el);
+}}""")
+
+        jscode = """
+(function () {
+    if (window.%(guard)s === undefined) {
+        window.%(guard)s = {};
+    }
+    if (window.%(guard)s["%(hash)s"] === undefined) {
+        window.%(guard)s["%(hash)s"] = true;
+        %(setup)s
+    }
+    %(init_code)s
+})();""" % dict(guard=self.guard, hash=self.get_hash(), setup="\n".join(setup), init_code="\n".join(init_code))
+        return minify(jscode)
+
+
+def minify(jscode: str) -> str:
+    """A conservative minifier: remove comments, indentation and blank lines. Strings, template literals and regular
+    expressions are kept as they are. Lines are kept separated to avoid any issue with automatic semicolon insertion"""
+    out = []
+    # number of open braces in the expressions (`${...}`) of the template literals that contain the current position
+    templates = []
+    # the last character of the code, to tell regular expressions from divisions
+    last = ""
+    i, n = 0, len(jscode)
+
+    def skip_literal(start: int, quote: str) -> int:
+        """Get the position after the end of a string or a regular expression"""
+        pos, in_class = start + 1, False
+        while pos < n:
+            char = jscode[pos]
+            if char == "\\":
+                pos += 2
+                continue
+            if quote == "/" and char in "[]":
+                in_class = char == "["
+            elif char == quote and not in_class:
+                return pos + 1
+            elif char == "\n" and quote != "`":
+                break
+            pos += 1
+        return pos
+
+    def skip_template(start: int) -> int:
+        """Get the position of the end (after the backtick) or the next expression (after `${`) of a template literal"""
+        pos = start
+        while pos < n:
+            if jscode[pos] == "\\":
+                pos += 2
+            elif jscode[pos] == "`":
+                return pos + 1
+            elif jscode.startswith("${", pos):
+                templates.append(0)
+                return pos + 2
+            else:
+                pos += 1
+        return pos
+
+    def newline():
+        while len(out) > 0 and out[-1] in " \t\r":
+            out.pop()
+        if len(out) > 0 and out[-1] != "\n":
+            out.append("\n")
+
+    while i < n:
+        c = jscode[i]
+        if c == "\n":
+            newline()
+            i += 1
+            while i < n and jscode[i] in " \t\r":
+                i += 1
+            continue
+        if jscode.startswith("//", i):
+            end = jscode.find("\n", i)
+            i = n if end == -1 else end
+            continue
+        if jscode.startswith("/*", i):
+            end = jscode.find("*/", i + 2)
+            end = n if end == -1 else end + 2
+            # keep the line break of a multi-line comment, which may terminate a statement
+            if "\n" in jscode[i:end]:
+                newline()
+            elif len(out) > 0 and out[-1] not in " \n":
+                out.append(" ")
+            i = end
+            if len(out) == 0 or out[-1] == "\n":
+                while i < n and jscode[i] in " \t\r":
+                    i += 1
+            continue
+
+        if c in "'\"" or (c == "/" and (last == "" or last in "(,=:[!&|?{};+-*%<>~^"
+                                         or re.search(r"\b(return|typeof|case|do|else|in|of)$", "".join(out[-8:])))):
+            end = skip_literal(i, c)
+        elif c == "`" or (c == "}" and len(templates) > 0 and templates[-1] == 0):
+            if c == "}":
+                templates.pop()
+            end = skip_template(i + 1)
+        else:
+            if c == "{" and len(templates) > 0:
+                templates[-1] += 1
+            elif c == "}" and len(templates) > 0:
+                templates[-1] -= 1
+            out.append(c)
+            if c not in " \t\r":
+                last = c
+            i += 1
+            continue
+
+        out.append(jscode[i:end])
+        # a literal is a value, so a slash after it is a division
+        last = ")" if end > i + 1 and not jscode[i:end].endswith("${") else "{"
+        i = end
+
+    newline()
+    return "".join(out).strip("\n")
+
+
+_labext_version: Optional[str] = None
+
+
+def labext_version() -> str:
+    global _labext_version
+    if _labext_version is None:
+        try:
+            from importlib.metadata import version
+            _labext_version = version("labext")
+        except Exception:
+            # the package is not installed (e.g., running from the source)
+            _labext_version = "dev"
+    return _labext_version
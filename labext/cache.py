@@ -0,0 +1,221 @@
+import hashlib
+import os
+import tempfile
+import threading
+import zipfile
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+import ujson
+from jupyter_core.paths import jupyter_config_dir
+
+
+class AssetCache:
+    """A local cache of downloaded assets (JS/CSS/images).
+
+    Each asset is keyed by its url and the version of the module that owns it. The manifest (`manifest.json` in the
+    cache directory) stores the sha256 hash, size and etag of every asset, so that we can detect corrupted or partially
+    written files without going to the network.
+
+    A cache directory (or a zip file of it) can be used as an offline bundle to seed the cache of another machine, see
+    `AssetCache.seed` and `AssetCache.export`.
+    """
+    instance: Optional['AssetCache'] = None
+    manifest_file = "manifest.json"
+
+    def __init__(self, root: Union[str, Path]):
+        self.root = Path(root)
+        # guards every read and write of the manifest, which is shared by the threads of the downloader
+        self.lock = threading.RLock()
+        self._manifest: Optional[Dict[str, dict]] = None
+
+    @staticmethod
+    def get_instance() -> 'AssetCache':
+        if AssetCache.instance is None or AssetCache.instance.root != AssetCache.default_root():
+            AssetCache.instance = AssetCache(AssetCache.default_root())
+        return AssetCache.instance
+
+    @staticmethod
+    def default_root() -> Path:
+        return Path(os.path.join(jupyter_config_dir(), "custom", "labext"))
+
+    @staticmethod
+    def get_key(url: str, version: str) -> str:
+        return f"{url}@{version}"
+
+    @property
+    def manifest(self) -> Dict[str, dict]:
+        with self.lock:
+            if self._manifest is None:
+                manifest_file = self.root / self.manifest_file
+                try:
+                    with open(str(manifest_file), "r") as f:
+                        self._manifest = ujson.load(f)
+                except (FileNotFoundError, ValueError):
+                    # a broken manifest is treated as an empty cache, the files are re-validated when they are
+                    # downloaded
+                    self._manifest = {}
+            return self._manifest
+
+    def save(self):
+        """Persist the manifest to disk"""
+        with self.lock:
+            self.root.mkdir(exist_ok=True, parents=True)
+            fd, tmp_file = tempfile.mkstemp(dir=str(self.root), prefix=".manifest")
+            with os.fdopen(fd, "w") as f:
+                ujson.dump(self.manifest, f, indent=2)
+            os.replace(tmp_file, str(self.root / self.manifest_file))
+
+    def is_valid(self, key: str, filepath: Union[str, Path]) -> bool:
+        """Test if the cached file of the key is the same as the file when it is downloaded. The file is only hashed
+        when its size or modification time differ from the manifest"""
+        with self.lock:
+            entry = self.manifest.get(key)
+            entry = dict(entry) if entry is not None else None
+        if entry is None or entry['path'] != self.relpath(filepath):
+            return False
+
+        try:
+            stat = os.stat(str(filepath))
+        except FileNotFoundError:
+            return False
+
+        if stat.st_size != entry['size']:
+            return False
+        if stat.st_mtime_ns == entry.get('mtime_ns'):
+            return True
+
+        if file_sha256(filepath) != entry['sha256']:
+            return False
+        with self.lock:
+            current = self.manifest.get(key)
+            # the entry may have been replaced while the file is hashed
+            if current is not None and current['sha256'] == entry['sha256']:
+                current['mtime_ns'] = stat.st_mtime_ns
+        return True
+
+    def find_by_url(self, url: str) -> Optional[dict]:
+        """Find an entry of the url that belongs to any version"""
+        with self.lock:
+            for entry in self.manifest.values():
+                if entry['url'] == url:
+                    return dict(entry)
+        return None
+
+    def put(self, key: str, url: str, version: str, filepath: Union[str, Path], sha256: str,
+            etag: Optional[str] = None):
+        """Add a file that has been written to the cache"""
+        stat = os.stat(str(filepath))
+        with self.lock:
+            self.manifest[key] = {
+                "url": url,
+                "version": version,
+                "path": self.relpath(filepath),
+                "sha256": sha256,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "etag": etag,
+            }
+
+    def relpath(self, filepath: Union[str, Path]) -> str:
+        return Path(filepath).relative_to(self.root).as_posix()
+
+    def seed(self, bundle: Union[str, Path]) -> int:
+        """Pre-populate the cache from an offline bundle, which is either a cache directory or a zip file of it
+        (created by `AssetCache.export`). Only files that match their hashes are copied.
+
+        Returns
+        -------
+        int
+            number of assets that are added to the cache
+        """
+        bundle = Path(bundle)
+        if bundle.is_dir():
+            return self._seed(lambda relpath: open(str(bundle / relpath), "rb"),
+                              bundle / self.manifest_file)
+
+        with zipfile.ZipFile(str(bundle)) as zf:
+            with zf.open(self.manifest_file) as f:
+                manifest = ujson.loads(f.read())
+            return self._seed(lambda relpath: zf.open(relpath), manifest)
+
+    def _seed(self, open_file, manifest: Union[Path, dict]) -> int:
+        if isinstance(manifest, Path):
+            with open(str(manifest), "r") as f:
+                manifest = ujson.load(f)
+
+        root = self.root.resolve()
+        n_assets = 0
+        for key, entry in manifest.items():
+            filepath = (root / entry['path']).resolve()
+            if filepath == root or root not in filepath.parents:
+                # the path (e.g., `../x` or an absolute path) is outside of the cache
+                continue
+            if self.is_valid(key, self.root / entry['path']):
+                continue
+
+            filepath.parent.mkdir(exist_ok=True, parents=True)
+            with open_file(entry['path']) as src:
+                sha256 = write_file_atomic(filepath, src, sha256=entry['sha256'])
+            if sha256 != entry['sha256']:
+                continue
+            filepath = self.root / filepath.relative_to(root)
+
+            self.put(key, entry['url'], entry['version'], filepath, sha256, entry.get('etag'))
+            n_assets += 1
+        self.save()
+        return n_assets
+
+    def export(self, outfile: Union[str, Path]):
+        """Export valid assets in the cache to a zip file that can be used to seed caches of other machines"""
+        with zipfile.ZipFile(str(outfile), "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            manifest = {}
+            with self.lock:
+                entries = [(key, dict(entry)) for key, entry in self.manifest.items()]
+            for key, entry in entries:
+                if self.is_valid(key, self.root / entry['path']):
+                    zf.write(str(self.root / entry['path']), entry['path'])
+                    manifest[key] = entry
+            zf.writestr(self.manifest_file, ujson.dumps(manifest, indent=2))
+
+
+def file_sha256(filepath: Union[str, Path]) -> str:
+    hasher = hashlib.sha256()
+    with open(str(filepath), "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def write_file_atomic(filepath: Union[str, Path], src, sha256: Optional[str] = None) -> str:
+    """Copy a file-like object to the filepath via a temporary file, so readers never see a partial file. If the
+    sha256 is given, the file is only replaced when the content matches it.
+
+    Returns
+    -------
+    str
+        sha256 of the content
+    """
+    filepath = Path(filepath)
+    hasher = hashlib.sha256()
+    fd, tmp_file = tempfile.mkstemp(dir=str(filepath.parent), prefix=f".{filepath.name}")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if isinstance(src, bytes):
+                hasher.update(src)
+                f.write(src)
+            else:
+                for chunk in iter(lambda: src.read(1 << 16), b""):
+                    hasher.update(chunk)
+                    f.write(chunk)
+        if sha256 is not None and hasher.hexdigest() != sha256:
+            os.remove(tmp_file)
+            return hasher.hexdigest()
+        # mkstemp creates files that only the owner can read
+        os.chmod(tmp_file, 0o644)
+        os.replace(tmp_file, str(filepath))
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    return hasher.hexdigest()
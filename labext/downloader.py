@@ -0,0 +1,102 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Tuple, Union, Optional
+
+from labext.cache import AssetCache, write_file_atomic
+
+# url, local file path, and version of the module that the file belongs to
+DownloadTask = Tuple[str, Union[str, Path], str]
+
+
+class Downloader:
+    """Fetch static assets (JS/CSS/images) concurrently over a single pooled HTTP session.
+
+    Example:
+        >>> Downloader(max_workers=8, timeout=30).fetch([("https://code.jquery.com/jquery-3.3.1.min.js", jquery_file, "1.0")])
+
+    Downloaded files are recorded in the `AssetCache`, files that are in the cache and are not corrupted are not
+    downloaded again.
+    """
+    instance: Optional['Downloader'] = None
+
+    def __init__(self, max_workers: int = 8, timeout: float = 30):
+        """
+        Parameters
+        ----------
+        max_workers: int
+            maximum number of files that are downloaded at the same time
+        timeout: float
+            timeout (in seconds) of each file
+        """
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._session = None
+
+    @staticmethod
+    def get_instance() -> 'Downloader':
+        """Get the shared downloader so that all modules reuse the same connection pool"""
+        if Downloader.instance is None:
+            Downloader.instance = Downloader()
+        return Downloader.instance
+
+    @property
+    def session(self):
+        if self._session is None:
+            # import here to avoid paying the cost of importing requests when everything is downloaded
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._session = session
+        return self._session
+
+    def fetch(self, tasks: List[DownloadTask]):
+        """Download the list of (url, filepath, version) in parallel. Files that are already in the cache are skipped.
+        The files must be inside the cache directory"""
+        cache = AssetCache.get_instance()
+        # the same file can be requested by multiple modules
+        tasks = list({(url, str(filepath), version) for url, filepath, version in tasks})
+        tasks = [task for task in tasks if not cache.is_valid(AssetCache.get_key(task[0], task[2]), task[1])]
+        if len(tasks) == 0:
+            return
+
+        if len(tasks) == 1:
+            self.fetch_file(cache, *tasks[0])
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(tasks))) as executor:
+                futures = [executor.submit(self.fetch_file, cache, *task) for task in tasks]
+                for future in futures:
+                    # re-raise the error if there is any
+                    future.result()
+        cache.save()
+
+    def fetch_file(self, cache: AssetCache, url: str, filepath: str, version: str):
+        """Download a single file to the cache, the file is written only when the download is complete"""
+        key = AssetCache.get_key(url, version)
+        headers = {}
+        # the file may be downloaded by a previous version of the module, we can reuse it if it doesn't change
+        prev_entry = cache.find_by_url(url)
+        if prev_entry is not None and prev_entry['etag'] is not None \
+                and cache.is_valid(AssetCache.get_key(url, prev_entry['version']), filepath):
+            headers['If-None-Match'] = prev_entry['etag']
+
+        resp = self.session.get(url, timeout=self.timeout, headers=headers)
+        if resp.status_code == 304:
+            if 'If-None-Match' not in headers:
+                # e.g., a misbehaving proxy, there is no cached file that the response refers to
+                raise IOError(f"Unexpected response of {url}: 304 Not Modified to an unconditional request")
+            cache.put(key, url, version, filepath, prev_entry['sha256'], prev_entry['etag'])
+            return
+        resp.raise_for_status()
+
+        content_length = resp.headers.get('Content-Length')
+        if content_length is not None and 'Content-Encoding' not in resp.headers \
+                and int(content_length) != len(resp.content):
+            raise IOError(f"Incomplete download of {url}: receive {len(resp.content)} of {content_length} bytes")
+
+        Path(filepath).parent.mkdir(exist_ok=True, parents=True)
+        sha256 = write_file_atomic(filepath, resp.content)
+        cache.put(key, url, version, filepath, sha256, resp.headers.get('ETag'))
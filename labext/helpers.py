@@ -1,5 +1,7 @@
+import importlib
+import sys
 from pathlib import Path
-from typing import Union
+from typing import Union, Dict, Tuple, Optional, Callable
 
 
 def read_file(infile: Union[str, Path]):
@@ -13,3 +15,44 @@ def identity_func(x):
 
 def noarg_func():
     pass
+
+
+def lazy_attrs(package: str, attrs: Dict[str, Tuple[str, Optional[str]]]):
+    """Create `__getattr__` and `__dir__` functions (PEP 562) for a package, so that its submodules are only imported
+    when their attributes are accessed for the first time.
+
+    Parameters
+    ----------
+    package: str
+        name of the package
+    attrs: Dict[str, Tuple[str, Optional[str]]]
+        mapping from an attribute to (relative submodule, name of the attribute in the submodule). When the attribute
+        name is None, the attribute is the submodule itself.
+    """
+    def __getattr__(name: str):
+        if name not in attrs:
+            raise AttributeError(f"module '{package}' has no attribute '{name}'")
+
+        submodule, attr = attrs[name]
+        value = importlib.import_module(submodule, package)
+        if attr is not None:
+            value = getattr(value, attr)
+        # cache it so that `__getattr__` is not called again
+        setattr(sys.modules[package], name, value)
+        return value
+
+    def __dir__():
+        return sorted(set(sys.modules[package].__dict__.keys()).union(attrs.keys()))
+
+    return __getattr__, __dir__
+
+
+def on_widget_close(widget, callback: Callable[[], None]):
+    """Call the callback when the ipywidget is closed. The widget keeps a reference to the callback (and its owner, e.g.,
+    the widget wrapper) until it is closed"""
+    def handler(change):
+        if change['new'] is None:
+            widget.unobserve(handler, names='comm')
+            callback()
+
+    widget.observe(handler, names='comm')
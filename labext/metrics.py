@@ -0,0 +1,230 @@
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from collections import deque
+from typing import Dict, List, Optional
+
+# upper bounds (in milliseconds) of the buckets of the histograms
+BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, float("inf")]
+
+
+class Histogram:
+    """A histogram of durations (in milliseconds) with fixed buckets, percentiles are estimated by the upper bounds of
+    the buckets"""
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms: float):
+        self.counts[bisect_left(BUCKETS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, p: float) -> float:
+        if self.count == 0:
+            return 0.0
+        threshold = p * self.count
+        cumulative = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            cumulative += count
+            if cumulative >= threshold:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count > 0 else 0.0,
+            "max": self.max,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "buckets": {str(bound): count for bound, count in zip(BUCKETS, self.counts) if count > 0}
+        }
+
+
+class Rate:
+    """Number of events per second over a sliding window"""
+
+    def __init__(self, window: int = 60):
+        self.window = window
+        # list of [second, number of events]
+        self.buckets = deque()
+
+    def add(self, n: int = 1):
+        now = int(time.monotonic())
+        if len(self.buckets) > 0 and self.buckets[-1][0] == now:
+            self.buckets[-1][1] += n
+        else:
+            self.buckets.append([now, n])
+        self._trim(now)
+
+    def per_second(self) -> float:
+        now = int(time.monotonic())
+        self._trim(now)
+        if len(self.buckets) == 0:
+            return 0.0
+        return sum(n for _, n in self.buckets) / (now - self.buckets[0][0] + 1)
+
+    def _trim(self, now: int):
+        while len(self.buckets) > 0 and self.buckets[0][0] <= now - self.window:
+            self.buckets.popleft()
+
+
+class RouteMetrics:
+    """Statistics of messages and requests of a route (`labext.modules.lab_ext.Route`).
+
+    Latency is the time from when the server receives a request to when it sends the response, round trip and render
+    time are measured by the client: from when the request is sent to when the response is received, and from then to
+    when the response is handled (e.g., the page of a DataTable is drawn).
+    """
+
+    def __init__(self, route_id: str):
+        self.route_id = route_id
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.messages_in = 0
+        self.messages_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.requests = 0
+        self.responses = 0
+        self.superseded = 0
+        self.errors = 0
+        self.inflight = 0
+        self.latency = Histogram()
+        self.handler_time = Histogram()
+        self.round_trip = Histogram()
+        self.render_time = Histogram()
+        self.rate_in = Rate()
+        self.rate_out = Rate()
+
+    def received(self, nbytes: int):
+        with self.lock:
+            self.messages_in += 1
+            self.bytes_in += nbytes
+            self.rate_in.add()
+
+    def sent(self, nbytes: int):
+        with self.lock:
+            self.messages_out += 1
+            self.bytes_out += nbytes
+            self.rate_out.add()
+
+    def request_started(self):
+        with self.lock:
+            self.requests += 1
+            self.inflight += 1
+
+    def request_finished(self, latency_ms: Optional[float] = None, superseded: bool = False, error: bool = False):
+        with self.lock:
+            self.inflight -= 1
+            if latency_ms is not None:
+                self.responses += 1
+                self.latency.add(latency_ms)
+            if superseded:
+                self.superseded += 1
+            if error:
+                self.errors += 1
+
+    def handler_finished(self, ms: float):
+        with self.lock:
+            self.handler_time.add(ms)
+
+    def add_client_timings(self, timings: List[dict]):
+        with self.lock:
+            for timing in timings:
+                self.round_trip.add(timing['rtt'])
+                self.render_time.add(timing['render'])
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "messages_in": self.messages_in,
+                "messages_out": self.messages_out,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "messages_in_per_second": self.rate_in.per_second(),
+                "messages_out_per_second": self.rate_out.per_second(),
+                "requests": self.requests,
+                "responses": self.responses,
+                "superseded": self.superseded,
+                "errors": self.errors,
+                "inflight": self.inflight,
+                "latency_ms": self.latency.to_dict(),
+                "handler_ms": self.handler_time.to_dict(),
+                "round_trip_ms": self.round_trip.to_dict(),
+                "render_ms": self.render_time.to_dict(),
+            }
+
+
+# the metrics are owned by their routes, so they are released along with the routes
+routes: 'weakref.WeakValueDictionary[str, RouteMetrics]' = weakref.WeakValueDictionary()
+routes_lock = threading.Lock()
+# log the timing of every request in the browser console, see `echo`
+console = False
+
+
+def get(route_id: str) -> RouteMetrics:
+    """Get the metrics of a route, it is created if it doesn't exist. The metrics are kept as long as the returned
+    object is referenced (e.g., by the route)"""
+    metrics = routes.get(route_id)
+    if metrics is None:
+        with routes_lock:
+            metrics = routes.get(route_id)
+            if metrics is None:
+                metrics = RouteMetrics(route_id)
+                routes[route_id] = metrics
+    return metrics
+
+
+def remove(route_id: str, metrics: Optional[RouteMetrics] = None):
+    """Remove the metrics of a route (e.g., the route is closed), only if they are the given metrics when it is set"""
+    with routes_lock:
+        if metrics is None or routes.get(route_id) is metrics:
+            routes.pop(route_id, None)
+
+
+def snapshot(route_id: Optional[str] = None) -> dict:
+    """Get the metrics of all routes (or a route) and the depth of the queues of LabExt.
+
+    Example:
+        >>> labext.metrics.snapshot()['routes'][table.table_id]['round_trip_ms']['p90']
+    """
+    from labext.modules.lab_ext import LabExt
+
+    items = list(routes.items()) if route_id is None else [(route_id, routes.get(route_id))]
+    return {
+        "routes": {rid: metrics.to_dict() for rid, metrics in items if metrics is not None},
+        "queues": {
+            # messages that are waiting to be sent (see `LabExt.batch`)
+            "batched": len(LabExt.queue),
+            # jobs (e.g., handlers of requests) that are waiting for a thread and that are running (see `LabExt.submit`)
+            "executor": LabExt.jobs_queued,
+            "executor_running": LabExt.jobs_running,
+        }
+    }
+
+
+def reset():
+    """Clear the metrics of all routes"""
+    for metrics in list(routes.values()):
+        with metrics.lock:
+            metrics.reset()
+
+
+def echo(enable: bool = True):
+    """Log the timing of every request (handler time and latency from the server, round trip and render time from
+    the client) in the browser console"""
+    global console
+    from labext.modules.lab_ext import LabExt
+
+    console = enable
+    LabExt.call("metrics.echo", enable)
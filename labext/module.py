@@ -1,22 +1,59 @@
-import json
 import shutil
 import os
 from abc import ABC
-from operator import itemgetter
 from pathlib import Path
-from typing import List, Dict, Type
+from typing import List, Dict, Type, Union, Optional, Tuple
 from urllib.parse import urlparse
 
-import requests
 from IPython.core.display import display, Javascript
 from jupyter_core.paths import jupyter_config_dir
 
+from labext.bootstrap import Bootstrap
+from labext.cache import AssetCache
+from labext.downloader import Downloader, DownloadTask
+
 
 LabExtModuleId = "misc_func"
 
 
+class ModuleTunnel:
+    """A tunnel (`SlowTunnelWidget`) of a module. It is a class attribute that creates the tunnel when it is accessed
+    for the first time (i.e., when the module is registered or used) instead of when the module is imported.
+
+    Example:
+        >>> class Tippy(Module):
+        >>>     tunnel_id = "labext.tippy"
+        >>>     tunnel = ModuleTunnel(tunnel_id)
+    """
+
+    def __init__(self, tunnel_id: str, on_receive: Optional[str] = None):
+        """
+        Parameters
+        ----------
+        tunnel_id: str
+            id of the tunnel
+        on_receive: Optional[str]
+            name of the module's class method that handles messages sent from the client
+        """
+        self.tunnel_id = tunnel_id
+        self.on_receive = on_receive
+        self.tunnel = None
+
+    def __get__(self, instance, owner):
+        if self.tunnel is None:
+            from ipycallback import SlowTunnelWidget
+            self.tunnel = SlowTunnelWidget(tunnel_id=self.tunnel_id)
+            if self.on_receive is not None:
+                self.tunnel.on_receive(getattr(owner, self.on_receive))
+        return self.tunnel
+
+
 class Module(ABC):
     registered_modules: Dict[str, bool] = {}
+    # memoized results of `Module.resolve`
+    resolved_modules: Dict[Tuple[Type['Module'], ...], Tuple[Type['Module'], ...]] = {}
+    # version of the module's assets, bump it to invalidate the downloaded files in the local cache
+    version = "1.0"
 
     @classmethod
     def id(cls) -> str:
@@ -36,12 +73,49 @@ class Module(ABC):
 
     @classmethod
     def flatten_dependencies(cls) -> List[Type['Module']]:
-        deps = {}
-        for m in cls.dependencies():
-            deps[m.id()] = m
-            for pm in m.flatten_dependencies():
-                deps[pm.id()] = pm
-        return [v for k, v in sorted(deps.items(), key=itemgetter(0))]
+        """Get all dependencies (direct and indirect) of the module, ordered so that a module comes after its
+        dependencies"""
+        return Module.resolve([cls])[:-1]
+
+    @staticmethod
+    def resolve(modules: List[Type['Module']]) -> List[Type['Module']]:
+        """Get the modules and all of their dependencies, de-duplicated and ordered so that a module comes after its
+        dependencies. The result is memoized, and each module is visited only once (linear in the size of the
+        dependency graph)"""
+        key = tuple(modules)
+        if key not in Module.resolved_modules:
+            Module.resolved_modules[key] = Module._topological_sort(key)
+        return list(Module.resolved_modules[key])
+
+    @staticmethod
+    def _topological_sort(modules: Tuple[Type['Module'], ...]) -> Tuple[Type['Module'], ...]:
+        # iterative DFS to get the post-order of the dependency graph, `visiting` contains modules in the current
+        # path to detect cycles
+        ordered = {}
+        visiting = {}
+        for module in modules:
+            if module in ordered:
+                continue
+
+            stack = [(module, iter(module.dependencies()))]
+            visiting[module] = True
+            while len(stack) > 0:
+                m, deps = stack[-1]
+                for dep in deps:
+                    if dep in ordered:
+                        continue
+                    if dep in visiting:
+                        path = [x for x, _ in stack]
+                        cycle = [x.id() for x in path[path.index(dep):]] + [dep.id()]
+                        raise ValueError(f"Circular dependency between modules: {' -> '.join(cycle)}")
+                    visiting[dep] = True
+                    stack.append((dep, iter(dep.dependencies())))
+                    break
+                else:
+                    stack.pop()
+                    visiting.pop(m)
+                    ordered[m] = True
+        return tuple(ordered.keys())
 
     @classmethod
     def expose(cls, varname: str):
@@ -52,55 +126,28 @@ class Module(ABC):
     @classmethod
     def register(cls, use_local: bool = True, suppress_display: bool = False):
         """Register a module to the current notebook. This function is safed to call repeatedly"""
-        if use_local:
-            cls.download()
-            js = {k: cls.remap_urls[url] for k, url in cls.js().items()}
-            css_files = [cls.remap_urls[url] for url in cls.css()]
-        else:
-            js = cls.js()
-            css_files = cls.css()
-
-        modules = [cls.id()]
-        if len(js) > 0:
-            jscode = "require.config({ paths: %s });\n" % json.dumps(js)
-        else:
-            jscode = ""
-
-        for m in cls.flatten_dependencies():
-            modules.append(m.id())
-            if m.id() in Module.registered_modules:
-                continue
+        bootstrap = Bootstrap([cls], use_local)
+        jscode = bootstrap.compile()
+        display(*bootstrap.widgets())
 
-            dup_js = set(js.keys()).intersection(m.js().keys())
-            assert len(dup_js) == 0, f"Duplicated js: {dup_js}"
-
-            register_code = m.register(use_local, suppress_display)
-            if register_code is not None:
-                jscode += register_code + "\n"
-
-        if len(css_files) > 0:
-            setup_css = [f"""    if (document.querySelector("head link#{cls.id()}-css-fds82j1") === null) {{"""]
-            for file in css_files:
-                setup_css.append(f"""
-        var el = document.createElement("link");
-        el.rel = "stylesheet";
-        el.id = "{cls.id()}";
-        el.type = "text/css";
-        el.href = "{file}";
-        document.head.appendChild(el);""".strip("\n"))
-            setup_css.append("    }")
-
-            jscode += "require([{str_modules}], function ({modules}) {{\n{setup_css}\n}});\n".format(
-                str_modules=json.dumps([m for m in modules if m != LabExtModuleId])[1:-1],
-                modules=", ".join([m for m in modules if m != LabExtModuleId]),
-                setup_css="\n".join(setup_css))
-
-        Module.registered_modules[cls.id()] = True
+        for m in bootstrap.modules:
+            Module.registered_modules[m.id()] = True
         if not suppress_display:
             display(Javascript(jscode))
             return
         return jscode
 
+    @classmethod
+    def init_code(cls) -> str:
+        """JS code that is executed every time the module is registered (e.g., to bind the module's tunnels). It must
+        be safe to run repeatedly"""
+        return ""
+
+    @classmethod
+    def comm_widgets(cls) -> list:
+        """Widgets (e.g., tunnels) that need to be displayed when the module is registered"""
+        return []
+
     @classmethod
     def is_registered(cls):
         """Test if the model has been registered"""
@@ -109,10 +156,27 @@ class Module(ABC):
     @classmethod
     def download(cls):
         """Download the component in order to make it offline"""
+        Downloader.get_instance().fetch(cls.download_plan())
+        return cls.get_local_dir()
+
+    @staticmethod
+    def download_all(modules: List[Type['Module']]):
+        """Download the modules and all of their dependencies at once. Files are fetched concurrently"""
+        tasks = []
+        for m in Module.resolve(modules):
+            tasks += m.download_plan()
+        Downloader.get_instance().fetch(tasks)
+
+    @classmethod
+    def download_plan(cls) -> List[DownloadTask]:
+        """Get list of files (url, local file path, version) that need to be downloaded to make the component offline.
+        This function also updates the `remap_urls` that map the urls to local urls.
+        """
         localdir = cls.get_local_dir()
         (localdir / "js").mkdir(exist_ok=True, parents=True)
         (localdir / "css").mkdir(exist_ok=True, parents=True)
 
+        tasks = []
         cls.remap_urls = {}
         for fileid, url in cls.js().items():
             norm_url = url
@@ -122,11 +186,7 @@ class Module(ABC):
                 norm_url += ".js"
 
             filename = urlparse(norm_url).path.rsplit("/", 1)[1]
-            filepath = str(localdir / "js" / filename)
-            if not os.path.exists(filepath):
-                with open(filepath, "wb") as f:
-                    f.write(requests.get(norm_url).content)
-
+            tasks.append((norm_url, localdir / "js" / filename, cls.version))
             cls.remap_urls[url] = f"/custom/labext/{cls.id()}/js/{filename[:-3]}"
 
         for url in cls.css():
@@ -134,13 +194,22 @@ class Module(ABC):
             if norm_url.startswith("//"):
                 norm_url = "https:" + norm_url
             filename = urlparse(norm_url).path.rsplit("/", 1)[1]
-            filepath = str(localdir / "css" / filename)
-            if not os.path.exists(filepath):
-                with open(filepath, "wb") as f:
-                    f.write(requests.get(norm_url).content)
-
+            tasks.append((norm_url, localdir / "css" / filename, cls.version))
             cls.remap_urls[url] = f"/custom/labext/{cls.id()}/css/{filename}"
-        return localdir
+        return tasks
+
+    @staticmethod
+    def seed_cache(bundle: Union[str, Path]) -> int:
+        """Pre-populate the local cache from an offline bundle (a zip file created by `Module.export_cache`) so that
+        modules can be registered without network access. Returns the number of added assets"""
+        return AssetCache.get_instance().seed(bundle)
+
+    @staticmethod
+    def export_cache(modules: List[Type['Module']], outfile: Union[str, Path]):
+        """Download the modules and export the local cache to a zip file, which can be used to seed the cache of
+        machines that do not have network access"""
+        Module.download_all(modules)
+        AssetCache.get_instance().export(outfile)
 
     @classmethod
     def clear_download(cls):
@@ -0,0 +1,714 @@
+/**
+ * Keep track of tunnels and DOM elements that widget wrappers are waiting for, so that they can be initialized as soon
+ * as they are available instead of polling.
+ *
+ * Tunnels are detected by hooking into `window.IPyCallback` (the map that `ipycallback` uses to store its tunnels), and
+ * elements are detected by a single MutationObserver that is only active when there are pending elements.
+ */
+class LabExtReadiness {
+    constructor() {
+        // tunnel id => list of callbacks that are invoked every time a tunnel of the id is created
+        this.tunnelListeners = new Map();
+        // list of {selector, resolve} of elements that are not in the DOM yet
+        this.pendingElements = [];
+        this.observer = undefined;
+
+        if (window.IPyCallback === undefined) {
+            window.IPyCallback = new Map();
+        }
+        this.hook(window.IPyCallback);
+    }
+
+    hook(tunnels) {
+        if (tunnels.__labext_hooked === true) {
+            return;
+        }
+        tunnels.__labext_hooked = true;
+
+        for (let tunnel of tunnels.values()) {
+            LabExtReceiveBinary(tunnel);
+        }
+
+        let set = tunnels.set;
+        let self = this;
+        tunnels.set = function (tunnelId, tunnel) {
+            LabExtReceiveBinary(tunnel);
+            let result = set.call(this, tunnelId, tunnel);
+            let listeners = self.tunnelListeners.get(tunnelId);
+            if (listeners !== undefined) {
+                for (let callback of listeners.slice()) {
+                    callback(tunnel);
+                }
+            }
+            return result;
+        };
+    }
+
+    /**
+     * Invoke the callback with the current tunnel of the id (if it exists) and every tunnel of the id that is created
+     * later (a tunnel is re-created when its cell is re-executed). Return a function to stop listening.
+     */
+    onTunnel(tunnelId, callback) {
+        if (!this.tunnelListeners.has(tunnelId)) {
+            this.tunnelListeners.set(tunnelId, []);
+        }
+        let listeners = this.tunnelListeners.get(tunnelId);
+        listeners.push(callback);
+
+        let tunnel = window.IPyCallback.get(tunnelId);
+        if (tunnel !== undefined) {
+            callback(tunnel);
+        }
+
+        return () => {
+            let idx = listeners.indexOf(callback);
+            if (idx !== -1) {
+                listeners.splice(idx, 1);
+            }
+            if (listeners.length === 0 && this.tunnelListeners.get(tunnelId) === listeners) {
+                this.tunnelListeners.delete(tunnelId);
+            }
+        };
+    }
+
+    /**
+     * Get a promise that resolves when the tunnel is available
+     */
+    tunnel(tunnelId) {
+        return new Promise((resolve) => {
+            let resolved = false;
+            let stop = this.onTunnel(tunnelId, (tunnel) => {
+                if (resolved) return;
+                resolved = true;
+                resolve(tunnel);
+                // the callback may be called before onTunnel returns
+                Promise.resolve().then(() => stop());
+            });
+        });
+    }
+
+    /**
+     * Get a promise that resolves when an element matching the CSS selector is in the DOM
+     */
+    element(selector) {
+        let el = document.querySelector(selector);
+        if (el !== null) {
+            return Promise.resolve(el);
+        }
+
+        return new Promise((resolve) => {
+            this.pendingElements.push({selector: selector, resolve: resolve});
+            if (this.observer === undefined) {
+                this.observer = new MutationObserver(() => this.checkPendingElements());
+                this.observer.observe(document.body, {childList: true, subtree: true});
+            }
+        });
+    }
+
+    checkPendingElements() {
+        let pending = [];
+        for (let item of this.pendingElements) {
+            let el = document.querySelector(item.selector);
+            if (el !== null) {
+                item.resolve(el);
+            } else {
+                pending.push(item);
+            }
+        }
+        this.pendingElements = pending;
+
+        if (pending.length === 0 && this.observer !== undefined) {
+            this.observer.disconnect();
+            this.observer = undefined;
+        }
+    }
+}
+
+/**
+ * Listen to binary messages (sent by `labext.transport.send`) of a tunnel and pass the decoded payload to the handler
+ * of the tunnel, so handlers receive either a string (JSON text) or an object (binary) as the payload.
+ */
+function LabExtReceiveBinary(tunnel) {
+    // custom messages are sent to the model, which is shared between views of the tunnel
+    if (tunnel.model === undefined || tunnel.model.__labext_binary === true) {
+        return;
+    }
+    tunnel.model.__labext_binary = true;
+    tunnel.model.on("msg:custom", (content, buffers) => {
+        if (content.labext !== "binary") {
+            return;
+        }
+        // deliver to the latest view of the tunnel
+        let view = window.IPyCallback.get(tunnel.model.get("tunnel_id"));
+        view.onReceiveHandler(content.version, LabExtDecodeBuffers(content.header, buffers || []));
+    });
+}
+
+/**
+ * Replace references to binary buffers in the payload by typed arrays, the typed arrays share the memory of the buffers
+ * when they are aligned.
+ */
+function LabExtDecodeBuffers(value, buffers) {
+    if (Array.isArray(value)) {
+        return value.map((x) => LabExtDecodeBuffers(x, buffers));
+    }
+    if (value === null || typeof value !== "object") {
+        return value;
+    }
+    if (value.__labext_buffer__ === undefined) {
+        let result = {};
+        for (let [key, item] of Object.entries(value)) {
+            result[key] = LabExtDecodeBuffers(item, buffers);
+        }
+        return result;
+    }
+
+    let TypedArray = {
+        bool: Uint8Array, int8: Int8Array, uint8: Uint8Array, int16: Int16Array, uint16: Uint16Array,
+        int32: Int32Array, uint32: Uint32Array, float32: Float32Array, float64: Float64Array
+    }[value.dtype];
+    let buffer = buffers[value.__labext_buffer__];
+    if (buffer instanceof ArrayBuffer) {
+        buffer = new DataView(buffer);
+    }
+    let array;
+    if (buffer.byteOffset % TypedArray.BYTES_PER_ELEMENT === 0) {
+        array = new TypedArray(buffer.buffer, buffer.byteOffset, buffer.byteLength / TypedArray.BYTES_PER_ELEMENT);
+    } else {
+        array = new TypedArray(buffer.buffer.slice(buffer.byteOffset, buffer.byteOffset + buffer.byteLength));
+    }
+    if (value.dtype === "bool") {
+        array = Array.from(array, (x) => x !== 0);
+    }
+    if (value.shape.length <= 1) {
+        return array;
+    }
+
+    // split the array by the first dimension (only 2D arrays are supported)
+    let rows = [];
+    let ncols = value.shape[1];
+    for (let i = 0; i < value.shape[0]; i++) {
+        let start = i * ncols;
+        // subarray shares the memory, boolean arrays are normal arrays
+        rows.push(value.dtype === "bool" ? array.slice(start, start + ncols) : array.subarray(start, start + ncols));
+    }
+    return rows;
+}
+
+// prefix of the messages of routes, see `labext.modules.lab_ext.ROUTE_PREFIX`
+const LabExtRoutePrefix = "@labext.route";
+
+/**
+ * Multiplex routes (virtual tunnels) over the LabExt tunnel, see `labext.modules.lab_ext.Route`
+ */
+class LabExtChannel {
+    constructor(ready, tunnelId) {
+        this.ready = ready;
+        this.tunnelId = tunnelId;
+        this.routes = new Map();
+        // log the timings of requests to the console, see `labext.metrics.echo`
+        this.echo = false;
+    }
+
+    /**
+     * Get a promise of the route, which is resolved when the LabExt tunnel is available. Opening a route again (e.g.,
+     * the widget is re-rendered) replaces the previous one.
+     */
+    open(routeId) {
+        return this.ready.tunnel(this.tunnelId).then(() => {
+            let route = new LabExtRoute(this, routeId);
+            this.routes.set(routeId, route);
+            return route;
+        });
+    }
+
+    send(msg) {
+        // always use the latest view of the tunnel
+        window.IPyCallback.get(this.tunnelId).send_msg(JSON.stringify(msg));
+    }
+
+    deliver(msg) {
+        let route = this.routes.get(msg.route);
+        if (route !== undefined) {
+            route.receive(msg.version, msg.response === true, msg.payload);
+        }
+    }
+
+    close(routeId, route = undefined) {
+        // the route may have been replaced by a newer one
+        if (route === undefined || this.routes.get(routeId) === route) {
+            this.routes.delete(routeId);
+        }
+    }
+}
+
+/**
+ * A route in the client, it has the same interface as the tunnel
+ */
+class LabExtRoute {
+    constructor(channel, routeId) {
+        this.channel = channel;
+        this.routeId = routeId;
+        // version of the last message that is sent to the server
+        this.version = 0;
+        this.handler = (version, payload) => {};
+        // requests that are waiting for their responses: version => {resolve, sentAt}
+        this.pending = new Map();
+        // timings of the requests that haven't been reported to the server (see `labext.metrics`)
+        this.timings = [];
+        this.timingsTimer = undefined;
+    }
+
+    send_msg(msg) {
+        this.version += 1;
+        this.send({receiver: this.routeId, version: this.version, content: msg});
+        return this.version;
+    }
+
+    send_msg_with_version(version, msg) {
+        if (version > this.version) {
+            this.version = version;
+            this.send({receiver: this.routeId, version: version, content: msg});
+        }
+    }
+
+    send(msg) {
+        // report the timings along with the message to avoid sending extra messages
+        if (this.timings.length > 0) {
+            msg.timings = this.timings;
+            this.timings = [];
+            clearTimeout(this.timingsTimer);
+            this.timingsTimer = undefined;
+        }
+        this.channel.send(msg);
+    }
+
+    on_receive(handler) {
+        this.handler = handler;
+    }
+
+    /**
+     * Send a message and get a promise of its response. Requests that are sent before it and haven't received their
+     * responses are dropped (their promises are never resolved) as the server only sends the response of the newest
+     * request.
+     */
+    request(msg) {
+        // a response is only accepted if its request is pending, so stale responses are discarded
+        this.pending.clear();
+        this.version += 1;
+        let version = this.version;
+        // the server cancels the handlers of previous requests
+        this.send({receiver: this.routeId, version: version, content: msg, request: true});
+        return new Promise((resolve) => {
+            this.pending.set(version, {resolve: resolve, sentAt: performance.now()});
+        });
+    }
+
+    /**
+     * Drop the pending requests and tell the server to stop working on them (e.g., the response is not needed anymore
+     * because the data is found in a cache)
+     */
+    cancel() {
+        if (this.pending.size === 0) {
+            return;
+        }
+        this.pending.clear();
+        this.send({receiver: this.routeId, version: this.version, cancel: true});
+    }
+
+    receive(version, isResponse, payload) {
+        if (isResponse && this.pending.has(version)) {
+            let request = this.pending.get(version);
+            for (let v of Array.from(this.pending.keys())) {
+                if (v <= version) {
+                    this.pending.delete(v);
+                }
+            }
+            let receivedAt = performance.now();
+            request.resolve(payload);
+            // this runs after the handlers of the response (e.g., drawing the page) as they are queued before it
+            Promise.resolve().then(() => this.addTiming(version, receivedAt - request.sentAt,
+                performance.now() - receivedAt));
+            return;
+        }
+        this.handler(version, payload);
+    }
+
+    addTiming(version, rtt, render) {
+        if (this.channel.echo) {
+            console.debug(`[labext] route ${this.routeId} #${version}: round trip ${rtt.toFixed(1)}ms, render ${render.toFixed(1)}ms`);
+        }
+        this.timings.push({version: version, rtt: rtt, render: render});
+        if (this.timings.length >= 32) {
+            this.send({receiver: this.routeId});
+        } else if (this.timingsTimer === undefined) {
+            this.timingsTimer = setTimeout(() => {
+                this.timingsTimer = undefined;
+                if (this.timings.length > 0) {
+                    this.send({receiver: this.routeId});
+                }
+            }, 1000);
+        }
+    }
+
+    /**
+     * Stop receiving messages without closing the route in the server (e.g., the widget is removed from the page, but
+     * it can be displayed again)
+     */
+    detach() {
+        this.channel.close(this.routeId, this);
+        this.pending.clear();
+        clearTimeout(this.timingsTimer);
+        this.timingsTimer = undefined;
+    }
+
+    close() {
+        this.detach();
+        this.channel.send({receiver: this.routeId, close: true});
+    }
+}
+
+/**
+ * Run tasks (e.g., applying messages from the server) in the next animation frame, so that a burst of messages only
+ * causes a single layout/paint.
+ */
+class LabExtFrameQueue {
+    constructor() {
+        this.tasks = [];
+        this.scheduled = false;
+    }
+
+    push(task) {
+        this.tasks.push(task);
+        if (!this.scheduled) {
+            this.scheduled = true;
+            requestAnimationFrame(() => this.run());
+        }
+    }
+
+    run() {
+        let tasks = this.tasks;
+        this.tasks = [];
+        this.scheduled = false;
+        for (let task of tasks) {
+            try {
+                task();
+            } catch (e) {
+                console.error(e);
+            }
+        }
+    }
+}
+
+/**
+ * Keep track of objects (e.g., DataTable models) that belong to DOM elements and dispose them once their elements are
+ * removed from the page (e.g., the output of the cell is cleared or the cell is re-executed), so that they can be
+ * garbage collected.
+ *
+ * Elements are checked by a single MutationObserver that is only active when there are tracked elements. An element has
+ * to stay detached for a grace period before its object is disposed, as notebooks may detach and re-attach outputs
+ * (e.g., when cells are moved).
+ */
+class LabExtRegistry {
+    constructor(gracePeriod = 30000) {
+        this.gracePeriod = gracePeriod;
+        // list of {element, dispose, detachedAt}
+        this.items = [];
+        this.observer = undefined;
+        this.sweepTimer = undefined;
+    }
+
+    /**
+     * Call dispose when the element is removed from the page. Return a function that disposes the object immediately
+     */
+    track(element, dispose) {
+        let item = {element: element, dispose: dispose, detachedAt: undefined};
+        this.items.push(item);
+        if (this.observer === undefined) {
+            this.observer = new MutationObserver(() => this.scheduleSweep(1000));
+            this.observer.observe(document.body, {childList: true, subtree: true});
+        }
+        return () => this.dispose(item);
+    }
+
+    scheduleSweep(delay) {
+        // the DOM changes very often, so the elements are checked at most once per delay
+        if (this.sweepTimer === undefined) {
+            this.sweepTimer = setTimeout(() => {
+                this.sweepTimer = undefined;
+                this.sweep();
+            }, delay);
+        }
+    }
+
+    sweep() {
+        let now = performance.now();
+        let detached = false;
+        for (let item of this.items.slice()) {
+            if (item.element.isConnected) {
+                item.detachedAt = undefined;
+            } else if (item.detachedAt === undefined) {
+                item.detachedAt = now;
+                detached = true;
+            } else if (now - item.detachedAt >= this.gracePeriod) {
+                this.dispose(item);
+            } else {
+                detached = true;
+            }
+        }
+        if (detached) {
+            // check the detached elements again after the grace period even if the DOM doesn't change
+            this.scheduleSweep(this.gracePeriod);
+        }
+    }
+
+    dispose(item) {
+        let idx = this.items.indexOf(item);
+        if (idx === -1) {
+            return;
+        }
+        this.items.splice(idx, 1);
+        try {
+            item.dispose();
+        } catch (e) {
+            console.error(e);
+        }
+        if (this.items.length === 0 && this.observer !== undefined) {
+            this.observer.disconnect();
+            this.observer = undefined;
+        }
+    }
+}
+
+/**
+ * Apply patches produced by `Tag.diff` to every element matching the CSS selector. Each patch targets the element at
+ * `path` (indices of element children from the matched element) and may contain `attrs`, `style`, `classes`, `text` or
+ * `html`. Attributes or styles that are null are removed.
+ */
+function LabExtPatchDOM(selector, patches) {
+    // attributes that the browser does not reflect to the state of the element once it is changed
+    let properties = {checked: "checked", value: "value", disabled: "disabled", selected: "selected"};
+
+    for (let root of document.querySelectorAll(selector)) {
+        for (let patch of patches) {
+            let el = root;
+            for (let i of patch.path) {
+                el = el === undefined ? undefined : el.children[i];
+            }
+            if (el === undefined) {
+                continue;
+            }
+
+            if (patch.attrs !== undefined) {
+                for (let [name, value] of Object.entries(patch.attrs)) {
+                    if (value === null) {
+                        el.removeAttribute(name);
+                    } else {
+                        el.setAttribute(name, value);
+                    }
+                    if (properties[name] !== undefined) {
+                        el[properties[name]] = name === "value" ? (value === null ? "" : value) : value !== null;
+                    }
+                }
+            }
+            if (patch.style !== undefined) {
+                for (let [name, value] of Object.entries(patch.style)) {
+                    if (value === null) {
+                        el.style.removeProperty(name);
+                    } else {
+                        el.style.setProperty(name, value);
+                    }
+                }
+            }
+            if (patch.classes !== undefined) {
+                el.classList.remove(...patch.classes.remove);
+                el.classList.add(...patch.classes.add);
+            }
+            if (patch.text !== undefined) {
+                el.textContent = patch.text;
+            } else if (patch.html !== undefined) {
+                el.innerHTML = patch.html;
+            }
+        }
+    }
+}
+
+/**
+ * Register handlers (ops) that the server can call with `LabExt.call`
+ */
+function LabExtRegisterBuiltinOps(container) {
+    container.ops.set("dom.patch", LabExtPatchDOM);
+    container.ops.set("datatable.draw", (tableId) => {
+        let table = container.DataTable === undefined ? undefined : container.DataTable.get(tableId);
+        if (table !== undefined) {
+            table.draw();
+        }
+    });
+    // changes of the records of a table (see `DataTable.append_rows`)
+    container.ops.set("datatable.delta", (tableId, delta) => {
+        let table = container.DataTable === undefined ? undefined : container.DataTable.get(tableId);
+        if (table !== undefined) {
+            table.applyDelta(delta);
+        }
+    });
+    container.ops.set("datatable.destroy", (tableId) => {
+        let table = container.DataTable === undefined ? undefined : container.DataTable.get(tableId);
+        if (table !== undefined) {
+            table.dispose();
+        }
+    });
+    container.ops.set("channel.close", (routeId) => {
+        container.channel.close(routeId);
+    });
+    container.ops.set("metrics.echo", (enable) => {
+        container.channel.echo = enable;
+    });
+    container.ops.set("log", (...args) => {
+        console.debug(...args);
+    });
+    // report the number of live objects to the receiver (see `LabExt.diagnostics`)
+    container.ops.set("diagnostics", (receiver) => {
+        let report = {
+            routes: container.channel.routes.size,
+            pending_requests: Array.from(container.channel.routes.values())
+                .reduce((total, route) => total + route.pending.size, 0),
+            datatables: container.DataTable === undefined ? 0 : container.DataTable.size,
+            tracked_elements: container.registry.items.length,
+            ops: container.ops.size,
+            compiled_fns: container.compiledFns.size,
+            queued_tasks: container.frame.tasks.length,
+            pending_elements: container.ready.pendingElements.length,
+        };
+        window.IPyCallback.get(container.channel.tunnelId).send_msg(JSON.stringify({
+            receiver: receiver, content: JSON.stringify(report)
+        }));
+    });
+    // register an user-defined op, the source is a function expression that is compiled once
+    container.ops.set("op.register", (name, source) => {
+        container.ops.set(name, new Function("return (" + source + ");")());
+    });
+}
+
+/**
+ * Handle a message from the server: call an op ({op, args}) or execute the javascript code ({fn}, deprecated)
+ */
+function LabExtDispatch(container, msg) {
+    if (msg.op !== undefined) {
+        let op = container.ops.get(msg.op);
+        if (op === undefined) {
+            throw new Error(`LabExt: unknown op ${msg.op}`);
+        }
+        op(...msg.args);
+        return;
+    }
+
+    let fn = container.compiledFns.get(msg.fn);
+    if (fn === undefined) {
+        if (container.compiledFns.size >= 256) {
+            container.compiledFns.clear();
+        }
+        fn = new Function(msg.fn);
+        container.compiledFns.set(msg.fn, fn);
+    }
+    fn();
+}
+
+/**
+ * Setup the LabExt container and bind the LabExt tunnel. It is executed every time the module is registered, so it
+ * must be idempotent.
+ */
+function LabExtSetup(config) {
+    // create a container so that widget wrappers can use to store some information
+    if (window[config.container] === undefined) {
+        window[config.container] = {};
+    }
+    let container = window[config.container];
+
+    // define call until return true function (deprecated, use `container.ready` instead)
+    if (window[config.callUntilTrue] === undefined) {
+        window[config.callUntilTrue] = function (fn, timeout) {
+            setTimeout(function () {
+                if (!fn()) {
+                    window[config.callUntilTrue](fn, timeout);
+                }
+            }, timeout);
+        };
+    }
+
+    if (container.ready === undefined) {
+        container.ready = new LabExtReadiness();
+    }
+    if (container.frame === undefined) {
+        container.frame = new LabExtFrameQueue();
+    }
+    if (container.channel === undefined) {
+        container.channel = new LabExtChannel(container.ready, config.tunnelId);
+    }
+    if (container.registry === undefined) {
+        container.registry = new LabExtRegistry();
+    }
+    if (container.ops === undefined) {
+        container.ops = new Map();
+        // compiled functions of the deprecated `fn` messages
+        container.compiledFns = new Map();
+    }
+    LabExtRegisterBuiltinOps(container);
+    // user-defined ops (see `LabExt.register_op`) that are registered before the module is registered
+    for (let [name, source] of Object.entries(config.ops || {})) {
+        container.ops.get("op.register")(name, source);
+    }
+
+    // listen to the messages from the tunnel to call the ops that the server requests
+    if (container.unbindTunnel !== undefined) {
+        container.unbindTunnel();
+    }
+    container.unbindTunnel = container.ready.onTunnel(config.tunnelId, (tunnel) => {
+        // the tunnel may be re-displayed when its cell is re-executed, only bind it once
+        if (tunnel.__labext_bound === true) {
+            return;
+        }
+        tunnel.__labext_bound = true;
+        tunnel.on_receive((version, payload) => {
+            if (typeof payload === "string") {
+                // every view of the tunnel receives the message, but it must be handled only once
+                if (tunnel.model.__labext_version !== undefined && version <= tunnel.model.__labext_version) {
+                    return;
+                }
+                tunnel.model.__labext_version = version;
+                if (payload.startsWith(LabExtRoutePrefix)) {
+                    // a message of a route: the header is followed by the payload, which is delivered as it is
+                    let headerEnd = payload.indexOf("\n");
+                    let msg = JSON.parse(payload.slice(LabExtRoutePrefix.length, headerEnd));
+                    msg.payload = payload.slice(headerEnd + 1);
+                    container.channel.deliver(msg);
+                    return;
+                }
+                payload = JSON.parse(payload);
+            }
+            if (payload.route !== undefined) {
+                // a message of a route is delivered immediately as the route may be waiting for it
+                container.channel.deliver(payload);
+                return;
+            }
+
+            // a payload is either a single message or a batch of messages (see `LabExt.batch`)
+            let msgs = Array.isArray(payload) ? payload : [payload];
+            container.frame.push(() => {
+                for (let msg of msgs) {
+                    try {
+                        LabExtDispatch(container, msg);
+                    } catch (e) {
+                        console.error(e);
+                    }
+                }
+            });
+        });
+        // ask the server for the user-defined ops that are registered after the module is registered
+        tunnel.send_msg(JSON.stringify({receiver: config.tunnelId, connect: true}));
+    });
+
+    // expose jquery to global scope to make it easier to use
+    require([config.jquery], function (jquery) {
+        container.jquery = jquery;
+    });
+}
@@ -1,17 +1,51 @@
-from .jquery import *
-from .data_table import *
-from .lab_ext import *
-from .selectize import *
-from .tippy import *
+from typing import List, Type, TYPE_CHECKING
 
+from labext.helpers import lazy_attrs
+
+if TYPE_CHECKING:
+    from labext.module import Module
+    from .jquery import JQuery
+    from .data_table import DataTable
+    from .lab_ext import LabExt, Route
+    from .selectize import Selectize
+    from .tippy import Tippy
+
+
+# modules are imported on first access to keep `import labext.prelude` cheap
+LAZY_ATTRS = {
+    "Module": ("labext.module", "Module"),
+    "JQuery": (".jquery", "JQuery"),
+    "DataTable": (".data_table", "DataTable"),
+    "LabExt": (".lab_ext", "LabExt"),
+    "Route": (".lab_ext", "Route"),
+    "Selectize": (".selectize", "Selectize"),
+    "Tippy": (".tippy", "Tippy"),
+}
+__getattr__, __dir__ = lazy_attrs(__name__, LAZY_ATTRS)
+# star-imports export the lazy attributes (they are imported then)
+__all__ = list(LAZY_ATTRS.keys()) + ["register"]
+
+
+def register(modules: List[Type['Module']], reset: bool = False):
+    """Register multiple modules at once using a single (cached) payload
+
+    Parameters
+    ----------
+    modules: List[Type[Module]]
+        list of modules, their dependencies are registered automatically
+    reset: bool
+        forget the registered modules and re-compile the payload instead of using the cached one
+    """
+    from IPython.core.display import display, Javascript
+    from labext.bootstrap import Bootstrap
+    from labext.module import Module
 
-def register(modules: List[Type[Module]], reset: bool = False):
     if reset:
         Module.registered_modules = {}
 
-    jscodes = []
-    for m in modules:
-        jscode = m.register(suppress_display=True)
-        jscodes.append(jscode)
+    bootstrap = Bootstrap(modules)
+    jscode = bootstrap.compile(force=reset)
+    for m in bootstrap.modules:
+        Module.registered_modules[m.id()] = True
 
-    display(Javascript("\n".join(jscodes)))
\ No newline at end of file
+    display(*bootstrap.widgets(), Javascript(jscode))
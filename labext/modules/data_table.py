@@ -1,15 +1,16 @@
-import os, json
-from pathlib import Path
-from typing import List, Dict, Type
+from typing import List, Dict, Type, TYPE_CHECKING
 
-import requests
 from IPython.core.display import display
-from pandas import DataFrame
 
+from labext.downloader import DownloadTask
 from labext.module import Module
 from labext.modules.lab_ext import LabExt
 from labext.modules.jquery import JQuery
 
+if TYPE_CHECKING:
+    # do this because pandas is optional
+    from pandas import DataFrame
+
 
 class DataTable(Module):
     @classmethod
@@ -29,17 +30,19 @@ class DataTable(Module):
         return [JQuery, LabExt]
 
     @classmethod
-    def render(cls, df: DataFrame, *args, **kwargs):
+    def render(cls, df: 'DataFrame', *args, **kwargs):
         """Rendering a data frame"""
         from labext.widgets.data_table import DataTable
         dt = DataTable(df, *args, **kwargs)
         display(dt.widget, *dt.get_auxiliary_components())
 
     @classmethod
-    def download(cls):
-        localdir = super().download()
+    def download_plan(cls) -> List[DownloadTask]:
+        tasks = super().download_plan()
+        localdir = cls.get_local_dir()
         (localdir / "images").mkdir(exist_ok=True)
 
         for static_file in ["sort_asc.png", "sort_desc.png", "sort_both.png"]:
-            with open(str(localdir / "images" / static_file), "wb") as f:
-                f.write(requests.get(f"https://cdn.datatables.net/1.10.19/images/{static_file}").content)
+            tasks.append((f"https://cdn.datatables.net/1.10.19/images/{static_file}",
+                          localdir / "images" / static_file, cls.version))
+        return tasks
@@ -1,14 +1,27 @@
-from typing import List, Dict, Type, Callable
+import asyncio
+import inspect
+import logging
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, Future
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Dict, Type, Callable, Optional, Tuple, Any, Union
+from uuid import uuid4
 
 import ujson
-from IPython.core.display import display, Javascript
-from ipycallback import SlowTunnelWidget
 
-from labext.module import Module, LabExtModuleId
-from string import Template
+from labext import metrics
+from labext.helpers import read_file, on_widget_close
+from labext.module import Module, LabExtModuleId, ModuleTunnel
 
 from labext.modules import JQuery
 
+# prefix of the messages of routes: the prefix, the JSON header (route, version, response), a line break and the payload
+ROUTE_PREFIX = "@labext.route"
+
 
 class LabExt(Module):
     """Module that provides basic functions and containers to widget wrappers in the `labext.widgets` packages.
@@ -17,8 +30,33 @@ class LabExt(Module):
     container = "LabExtContainer1292931"
     call_until_true = "__CallUntilReturnTrue_BV12__"
     # a global tunnel that one can use to dispatch event from JS to the server
-    tunnel = SlowTunnelWidget(tunnel_id="LabExtTunnel1292931")
-    tunnel_listeners = {}
+    tunnel_id = "LabExtTunnel1292931"
+    tunnel = ModuleTunnel(tunnel_id, on_receive="on_receive_tunnel_msg")
+    # receiver id => listener, listeners that are methods are weak references so they do not keep their objects alive
+    tunnel_listeners: Dict[str, Union[Callable, weakref.WeakMethod]] = {}
+    # routes that are multiplexed over the tunnel (owned by widget wrappers), see `Route`
+    routes: 'weakref.WeakValueDictionary[str, Route]' = weakref.WeakValueDictionary()
+    # the last report of the client, see `LabExt.diagnostics`
+    client_diagnostics: Optional[dict] = None
+    # thread pool that runs handlers of requests of routes, see `LabExt.set_executor`
+    executor: Optional[ThreadPoolExecutor] = None
+    # number of jobs that are waiting for a thread and that are running in the thread pool, see `LabExt.submit`
+    jobs_queued = 0
+    jobs_running = 0
+    jobs_lock = threading.Lock()
+    # lock to send messages from handlers that run in the thread pool
+    send_lock = threading.RLock()
+    # user-defined ops (name => javascript function expression), see `LabExt.register_op`
+    ops: Dict[str, str] = {}
+
+    # messages (tunnel, msg) that are waiting to be sent when batching is enabled, see `LabExt.batch`
+    queue: List[Tuple[Any, dict]] = []
+    queue_lock = threading.Lock()
+    batch_depth = 0
+    auto_batch_enabled = False
+    # maximum seconds a message waits in the queue when auto batching is enabled, None to wait until the cell finishes
+    auto_batch_window: Optional[float] = None
+    flush_timer: Optional[threading.Timer] = None
 
     @classmethod
     def id(cls) -> str:
@@ -38,65 +76,512 @@ class LabExt(Module):
         return [JQuery]
 
     @classmethod
-    def register(cls, use_local: bool = True, suppress_display: bool = False):
-        jscode = Template("""
-    // create a container so that widget wrappers can use to store some information
-    if (window.$container === undefined) {
-        window.$container = {};
-    }
-
-    // define call until return true function
-    if (window.$CallUntilTrue === undefined) {
-        function $CallUntilTrue(fn, timeout) {
-            setTimeout(function () {
-                if (!fn()) {
-                    $CallUntilTrue(fn, timeout);
-                }
-            }, timeout);
-        }
-        window.$CallUntilTrue = $CallUntilTrue;
-    }
-    
-    // listen to the message from tunnel to execute the javascript from the server
-    $CallUntilTrue(function () {
-        if (window.IPyCallback === undefined || window.IPyCallback.get("$tunnelId") === undefined) {
-            return false;
-        }
-        
-        window.IPyCallback.get("$tunnelId").on_receive((version, payload) => {
-            let msg = JSON.parse(payload);
-            let fn = new Function(msg.fn);
-            fn();
-        });
-        return true;
-    }, 100);
-    
-    // expose jquery to global scope to make it easier to use
-    require(["$jquery"], function (jquery) {
-        window.$container.jquery = jquery;
-    });
-            """.strip()).substitute(
-            container=cls.container,
-            jquery=JQuery.id(),
-            CallUntilTrue=cls.call_until_true,
-            tunnelId=cls.tunnel.tunnel_id)
-
-        Module.registered_modules[cls.id()] = True
-        display(cls.tunnel)
-
-        if not suppress_display:
-            display(Javascript(jscode))
-            return
+    def init_code(cls) -> str:
+        jscode = read_file(Path(os.path.abspath(__file__)).parent / "LabExt.js")
+        jscode += "\nLabExtSetup(%s);" % ujson.dumps({
+            "container": cls.container,
+            "callUntilTrue": cls.call_until_true,
+            "tunnelId": cls.tunnel_id,
+            "jquery": JQuery.id(),
+            "ops": dict(cls.ops),
+        })
         return jscode
 
+    @classmethod
+    def comm_widgets(cls) -> list:
+        return [cls.tunnel]
+
     @classmethod
     def on_receive_tunnel_msg(cls, version: int, msg: str):
         msg = ujson.loads(msg)
-        cls.tunnel_listeners[msg['receiver']](version, msg['content'])
+        if msg.get('connect', False):
+            # a view of the tunnel is rendered (e.g., the page is reloaded), its client doesn't have the user-defined ops
+            cls.replay_ops()
+            return
+        route = cls.routes.get(msg['receiver'])
+        if route is not None:
+            if 'timings' in msg:
+                # the client reports timings of the previous requests
+                route.metrics.add_client_timings(msg['timings'])
+            if msg.get('close', False):
+                # the client closes the route
+                route.close(notify_client=False)
+            elif msg.get('cancel', False):
+                route._on_cancel(msg['version'])
+            elif 'content' not in msg:
+                pass
+            elif msg.get('request', False):
+                route._on_request(msg['version'], msg['content'])
+            else:
+                route._on_receive(msg['version'], msg['content'])
+            return
+
+        listener = cls.tunnel_listeners.get(msg['receiver'])
+        if isinstance(listener, weakref.WeakMethod):
+            listener = listener()
+        if listener is not None:
+            listener(version, msg['content'])
+
+    @classmethod
+    def add_listener(cls, id: str, cb: Callable[[int, any], None], owner=None):
+        """Listen to messages sent to the receiver id via the tunnel.
+
+        Parameters
+        ----------
+        id: str
+            id of the receiver
+        cb: Callable[[int, any], None]
+            the listener. If it is a method and there is no owner, only a weak reference of it is kept, and it is
+            removed when its object is garbage collected
+        owner: Optional[Widget]
+            the ipywidget that the listener belongs to. The listener is kept while the widget is open (as the widget
+            can still fire events), and is removed when the widget is closed
+        """
+        if owner is not None:
+            cls.tunnel_listeners[id] = cb
+            on_widget_close(owner, lambda: cls.remove_listener(id))
+        elif inspect.ismethod(cb):
+            cls.tunnel_listeners[id] = weakref.WeakMethod(cb, lambda ref: cls._remove_dead_listener(id, ref))
+        else:
+            cls.tunnel_listeners[id] = cb
+
+    @classmethod
+    def remove_listener(cls, id: str):
+        cls.tunnel_listeners.pop(id, None)
+
+    @classmethod
+    def _remove_dead_listener(cls, id: str, ref: weakref.WeakMethod):
+        # the listener may have been replaced by a new one
+        if cls.tunnel_listeners.get(id) is ref:
+            cls.tunnel_listeners.pop(id)
+
+    @classmethod
+    def diagnostics(cls) -> dict:
+        """Count the live objects (listeners, routes, etc.) in the server and the client. The client reports its counts
+        asynchronously, so the counts of the client are from the previous call (None for the first call)"""
+        cls.add_listener("labext.diagnostics", cls.on_receive_diagnostics)
+        cls.call("diagnostics", "labext.diagnostics")
+        return {
+            "server": {
+                "listeners": len(cls.tunnel_listeners),
+                "routes": len(cls.routes),
+                "inflight_requests": sum(1 for route in list(cls.routes.values()) if route.inflight is not None),
+                "ops": len(cls.ops),
+                "batched_messages": len(cls.queue),
+            },
+            "client": cls.client_diagnostics
+        }
+
+    @classmethod
+    def on_receive_diagnostics(cls, _version: int, msg: str):
+        cls.client_diagnostics = ujson.loads(msg)
+
+    @classmethod
+    def set_executor(cls, max_workers: Optional[int] = 4):
+        """Run handlers of requests of routes (e.g., fetching pages of `DataTable`, searching options of `Selection`)
+        in a thread pool, so that slow handlers do not block the kernel and other widgets. Handlers that are coroutine
+        functions always run in the kernel's event loop.
+
+        Parameters
+        ----------
+        max_workers: Optional[int]
+            number of threads, None to run the handlers in the kernel's thread (the default)
+        """
+        if cls.executor is not None:
+            cls.executor.shutdown(wait=False)
+        cls.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="labext") \
+            if max_workers is not None else None
+
+    @classmethod
+    def submit(cls, fn: Callable, *args) -> Future:
+        """Run a function in the thread pool (it is created with the default size if it hasn't been set), the jobs that
+        are waiting and running are counted (see `labext.metrics.snapshot`)"""
+        if cls.executor is None:
+            cls.set_executor()
+
+        def run():
+            with cls.jobs_lock:
+                cls.jobs_queued -= 1
+                cls.jobs_running += 1
+            try:
+                return fn(*args)
+            finally:
+                with cls.jobs_lock:
+                    cls.jobs_running -= 1
+
+        def on_done(future: Future):
+            if future.cancelled():
+                # cancelled before it started
+                with cls.jobs_lock:
+                    cls.jobs_queued -= 1
+
+        with cls.jobs_lock:
+            cls.jobs_queued += 1
+        try:
+            future = cls.executor.submit(run)
+        except Exception:
+            with cls.jobs_lock:
+                cls.jobs_queued -= 1
+            raise
+        future.add_done_callback(on_done)
+        return future
+
+    @classmethod
+    def patch(cls, selector: str, patches: List[dict]):
+        """Apply patches (produced by `Tag.diff`) to elements matching the CSS selector in the browser"""
+        if len(patches) == 0:
+            return
+        cls.call("dom.patch", selector, patches)
+
+    @classmethod
+    def call(cls, op: str, *args):
+        """Call a handler (op) in the browser with the arguments (must be JSON serializable). Builtin ops are
+        `dom.patch` and `datatable.draw`, other ops can be defined using `LabExt.register_op`
+
+        Example:
+            >>> LabExt.call("datatable.draw", table_id)
+        """
+        cls.send_msg({"op": op, "args": list(args)})
+
+    @classmethod
+    def register_op(cls, name: str, jscode: str):
+        """Define an op that can be called with `LabExt.call`. The code is sent and compiled only once, subsequent
+        calls send only the name of the op and its arguments. The op is sent again when the page is reloaded (or the
+        module is registered again).
+
+        Example:
+            >>> LabExt.register_op("text.set", "(id, text) => { document.getElementById(id).textContent = text; }")
+            >>> LabExt.call("text.set", "status", "done")
+
+        Parameters
+        ----------
+        name: str
+            name of the op
+        jscode: str
+            a javascript function expression, the arguments of the function are the arguments of `LabExt.call`
+        """
+        cls.ops[name] = jscode
+        cls.call("op.register", name, jscode)
+
+    @classmethod
+    def replay_ops(cls):
+        """Send the user-defined ops to the client again, they are lost when the page is reloaded"""
+        if len(cls.ops) == 0:
+            return
+        with cls.batch():
+            for name, jscode in list(cls.ops.items()):
+                cls.call("op.register", name, jscode)
+
+    @classmethod
+    def send_msg(cls, msg: dict, tunnel=None):
+        """Send a message to the browser via a tunnel (default is the LabExt tunnel). The message is queued instead if
+        batching is enabled.
+
+        Parameters
+        ----------
+        msg: dict
+            the message
+        tunnel: SlowTunnelWidget
+            the tunnel to send the message, its client must accept both a message and a list of messages
+        """
+        tunnel = tunnel or cls.tunnel
+        if cls.batch_depth == 0 and not cls.auto_batch_enabled:
+            with cls.send_lock:
+                tunnel.send_msg(ujson.dumps(msg))
+            return
+
+        with cls.queue_lock:
+            cls.queue.append((tunnel, msg))
+            if cls.batch_depth == 0 and cls.auto_batch_window is not None and cls.flush_timer is None:
+                cls.flush_timer = threading.Timer(cls.auto_batch_window, cls.flush)
+                cls.flush_timer.daemon = True
+                cls.flush_timer.start()
 
     @classmethod
-    def add_listener(cls, id: str, cb: Callable[[int, any], None]):
-        cls.tunnel_listeners[id] = cb
+    def flush(cls):
+        """Send the queued messages, messages of the same tunnel are sent in one frame"""
+        with cls.queue_lock:
+            queue, cls.queue = cls.queue, []
+            if cls.flush_timer is not None:
+                cls.flush_timer.cancel()
+                cls.flush_timer = None
+
+        frames = {}
+        for tunnel, msg in queue:
+            if id(tunnel) not in frames:
+                frames[id(tunnel)] = (tunnel, [])
+            frames[id(tunnel)][1].append(msg)
+        with cls.send_lock:
+            for tunnel, msgs in frames.values():
+                tunnel.send_msg(ujson.dumps(msgs))
+
+    @classmethod
+    @contextmanager
+    def batch(cls):
+        """Queue messages sent inside the block and send them at the end of the block, the browser applies them in a
+        single animation frame.
+
+        Example:
+            >>> with LabExt.batch():
+            >>>     for checkbox in checkboxes:
+            >>>         checkbox.check()
+        """
+        cls.batch_depth += 1
+        try:
+            yield
+        finally:
+            cls.batch_depth -= 1
+            if cls.batch_depth == 0:
+                cls.flush()
+
+    @classmethod
+    def auto_batch(cls, enable: bool = True, window: Optional[float] = None):
+        """Enable or disable batching messages outside of `LabExt.batch` blocks. Queued messages are sent when the
+        current cell finishes, or after `window` seconds if it is set (useful for long running cells or callbacks)
+
+        Parameters
+        ----------
+        enable: bool
+            enable or disable auto batching
+        window: Optional[float]
+            maximum seconds a message waits in the queue
+        """
+        from IPython import get_ipython
+        ipython = get_ipython()
+        if enable:
+            if ipython is None and window is None:
+                raise ValueError("Batching messages by cells requires IPython, please set the time window")
+            if ipython is not None and not cls.auto_batch_enabled:
+                ipython.events.register('post_execute', cls.flush)
+            cls.auto_batch_window = window
+            cls.auto_batch_enabled = True
+        elif cls.auto_batch_enabled:
+            if ipython is not None:
+                ipython.events.unregister('post_execute', cls.flush)
+            cls.auto_batch_enabled = False
+            cls.auto_batch_window = None
+            cls.flush()
+
+
+
+class Route:
+    """A virtual tunnel that is multiplexed over `LabExt.tunnel`, so that widget wrappers do not need to create their
+    own comms. It has the same interface as `SlowTunnelWidget` (`send_msg`, `send_msg_with_version`, `on_receive`),
+    messages have their own versions per route, and it does not need to be displayed.
+
+    In the client, a route is obtained by `window[LabExt.container].channel.open(routeId)`, which returns a promise
+    of an object that has the same interface as the tunnel in the client. It also has `request(msg)` that returns a
+    promise of the response of the message, which is produced by the handler registered with `Route.on_request`.
+
+    Example:
+        >>> route = Route()
+        >>> route.on_request(lambda version, msg: {"echo": msg})
+        >>> route.close()
+    """
+    logger = logging.getLogger("labext.modules.lab_ext.Route")
+
+    def __init__(self, route_id: Optional[str] = None):
+        self.tunnel_id = route_id or str(uuid4())
+        # version of the last message that is sent to the client
+        self.version = 0
+        self.lock = threading.Lock()
+        self.on_receive_handler = default_route_handler
+        self.on_request_handler = default_route_handler
+        self.threaded: Optional[bool] = None
+        # version of the newest request and the handler (future or task) of the request if it is running
+        self.latest_request = 0
+        self.inflight = None
+        # time (time.perf_counter) when the requests are received
+        self.request_times: Dict[int, float] = {}
+        self.metrics = metrics.get(self.tunnel_id)
+        LabExt.routes[self.tunnel_id] = self
+
+    @property
+    def js_endpoint(self) -> Tuple[int, str]:
+        """Same as `SlowTunnelWidget.js_endpoint` but only the version is available"""
+        return self.version, ""
+
+    def send_msg(self, msg: str):
+        """Send a message to the client"""
+        with self.lock:
+            self.version += 1
+            self._send(self.version, msg)
+
+    def send_msg_with_version(self, version: int, msg: str):
+        """Send a response of the request of the version to the client. Only send newer version"""
+        with self.lock:
+            if version > self.version:
+                self.version = version
+                self._send(version, msg, response=True)
+
+    def send(self, content: dict, buffers: list):
+        """Send a binary message created by `labext.transport.send`. A response is dropped if a newer message has been
+        sent, a new message gets the next version of the route"""
+        with self.lock:
+            if content.get('response', False):
+                if content['version'] <= self.version:
+                    return
+                self.version = content['version']
+            else:
+                self.version += 1
+            version = self.version
+            self.metrics.sent(sum(buf.nbytes for buf in buffers))
+            with LabExt.send_lock:
+                LabExt.tunnel.send({
+                    "labext": "binary",
+                    "version": version,
+                    "header": {
+                        "route": self.tunnel_id,
+                        "version": version,
+                        "response": content.get('response', False),
+                        "payload": content['header']
+                    }
+                }, buffers=buffers)
+
+    def on_receive(self, callback: Callable[[int, str], None]):
+        """Register a handler of messages (sent by `send_msg` in the client)"""
+        self.on_receive_handler = callback
+
+    def on_request(self, callback: Callable[[int, str], Any], threaded: Optional[bool] = None):
+        """Register a handler of requests (sent by `request` in the client). The value that the handler returns is the
+        response: a string is sent as it is, other values are sent using `labext.transport.send`, and None is not sent.
+
+        When a newer request arrives (or the client cancels its requests), the handler of the previous request is
+        cancelled if it hasn't started (or it is a coroutine), and the response of the previous request is dropped. Long
+        running handlers can stop early by checking `Route.is_superseded`.
+
+        Parameters
+        ----------
+        callback: Callable[[int, str], Any]
+            the handler, which receives the version and the message of the request. It can be a coroutine function,
+            which runs in the kernel's event loop
+        threaded: Optional[bool]
+            run the handler in the thread pool of LabExt (`LabExt.set_executor`), default is to use the thread pool if
+            it has been set
+        """
+        self.on_request_handler = callback
+        self.threaded = threaded
+
+    def is_superseded(self, version: int) -> bool:
+        """Test if there is a newer request than the request of the version"""
+        return version < self.latest_request
+
+    def close(self, notify_client: bool = True):
+        """Stop receiving messages, drop the request that is being handled and remove the route in the client
+
+        Parameters
+        ----------
+        notify_client: bool
+            remove the route in the client, it is False when the client closes the route
+        """
+        if LabExt.routes.get(self.tunnel_id) is self:
+            LabExt.routes.pop(self.tunnel_id, None)
+        metrics.remove(self.tunnel_id, self.metrics)
+        # responses of the pending requests are dropped
+        self._on_cancel(self.latest_request)
+        if notify_client:
+            LabExt.call("channel.close", self.tunnel_id)
+
+    def _send(self, version: int, payload: str, response: bool = False):
+        # the payload is sent after the header as it is, so it is not encoded (and parsed in the client) twice
+        header = ujson.dumps({"route": self.tunnel_id, "version": version, "response": response})
+        msg = ROUTE_PREFIX + header + "\n" + payload
+        self.metrics.sent(len(msg))
+        # responses are not batched as the client is waiting for them
+        with LabExt.send_lock:
+            LabExt.tunnel.send_msg(msg)
+
+    def _on_receive(self, version: int, msg: str):
+        self.metrics.received(len(msg))
+        self.on_receive_handler(version, msg)
+
+    def _on_request(self, version: int, msg: str):
+        self.metrics.received(len(msg))
+        self.metrics.request_started()
+        self.request_times[version] = time.perf_counter()
+        self.latest_request = version
+        if self.inflight is not None:
+            self.inflight.cancel()
+            self.inflight = None
+
+        if asyncio.iscoroutinefunction(self.on_request_handler):
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # not running in an event loop (e.g., the kernel doesn't use asyncio)
+                self._respond(version, asyncio.run(self._run_async_handler(version, msg)))
+                return
+            self.inflight = loop.create_task(self._run_async_handler(version, msg))
+        elif self.threaded or (self.threaded is None and LabExt.executor is not None):
+            self.inflight = LabExt.submit(self._run_handler, version, msg)
+        else:
+            try:
+                resp = self._run_handler(version, msg)
+            except Exception:
+                self._finish_request(version, error=True)
+                raise
+            self._respond(version, resp)
+            return
+        self.inflight.add_done_callback(lambda future: self._on_request_done(version, future))
+
+    def _on_cancel(self, version: int):
+        """The client doesn't wait for the responses of the requests up to the version anymore"""
+        self.latest_request = max(self.latest_request, version + 1)
+        if self.inflight is not None:
+            self.inflight.cancel()
+            self.inflight = None
+
+    def _run_handler(self, version: int, msg: str):
+        start = time.perf_counter()
+        try:
+            return self.on_request_handler(version, msg)
+        finally:
+            self.metrics.handler_finished((time.perf_counter() - start) * 1000)
+
+    async def _run_async_handler(self, version: int, msg: str):
+        start = time.perf_counter()
+        try:
+            return await self.on_request_handler(version, msg)
+        finally:
+            self.metrics.handler_finished((time.perf_counter() - start) * 1000)
+
+    def _on_request_done(self, version: int, future):
+        if self.inflight is future:
+            self.inflight = None
+        if future.cancelled():
+            self._finish_request(version, superseded=True)
+            return
+        if future.exception() is not None:
+            self._finish_request(version, error=True)
+            self.logger.error("Error while handling request %s of route %s", version, self.tunnel_id,
+                              exc_info=future.exception())
+            return
+        self._respond(version, future.result())
+
+    def _respond(self, version: int, resp: Any):
+        if resp is None or self.is_superseded(version):
+            self._finish_request(version, superseded=resp is not None)
+            return
+        try:
+            if isinstance(resp, str):
+                self.send_msg_with_version(version, resp)
+            else:
+                from labext import transport
+                transport.send(self, resp, version)
+        except Exception:
+            self._finish_request(version, error=True)
+            self.logger.exception("Error while sending the response of request %s of route %s", version,
+                                  self.tunnel_id)
+            return
+        self._finish_request(version, responded=True)
+
+    def _finish_request(self, version: int, responded: bool = False, superseded: bool = False, error: bool = False):
+        start = self.request_times.pop(version, None)
+        latency = (time.perf_counter() - start) * 1000 if responded and start is not None else None
+        self.metrics.request_finished(latency, superseded=superseded, error=error)
+        if metrics.console and latency is not None:
+            LabExt.call("log", f"[labext] route {self.tunnel_id} #{version}: latency {latency:.1f}ms")
 
 
-LabExt.tunnel.on_receive(LabExt.on_receive_tunnel_msg)
+def default_route_handler(_version: int, _msg: str):
+    pass
@@ -1,12 +1,8 @@
-import json
 from labext.modules.lab_ext import LabExt
 from string import Template
 from typing import List, Dict, Tuple, Callable, Any, Optional, Type
 
-from IPython.core.display import display, Javascript
-from ipycallback.slow_tunnel import SlowTunnelWidget
-
-from labext.module import Module
+from labext.module import Module, ModuleTunnel
 
 
 class Tippy(Module):
@@ -21,7 +17,8 @@ class Tippy(Module):
         >>> Tippy.render()
     """
     # Properties that can be set: https://atomiks.github.io/tippyjs/v6/all-props/#interactive
-    tunnel = SlowTunnelWidget(tunnel_id="labext.tippy")
+    tunnel_id = "labext.tippy"
+    tunnel = ModuleTunnel(tunnel_id)
 
     @classmethod
     def id(cls) -> str:
@@ -41,42 +38,55 @@ class Tippy(Module):
         return [LabExt]
 
     @classmethod
-    def register(cls, use_local: bool = True, suppress_display: bool = False):
-        result = super().register(use_local, suppress_display)
-        jscode = Javascript(Template("""
+    def init_code(cls) -> str:
+        return Template("""
         require(["@popperjs/core", "tippy"], function (popper, tippy) {
-            $CallUntilTrue(function () {
-                if (window.IPyCallback === undefined || window.IPyCallback.get("$tunnelId") === undefined) {
-                    return false;
+            let container = window.$container;
+            if (container.unbindTippyTunnel !== undefined) {
+                container.unbindTippyTunnel();
+            }
+            container.unbindTippyTunnel = container.ready.onTunnel("$tunnelId", (tunnel) => {
+                // the tunnel may be re-displayed when its cell is re-executed, only bind it once
+                if (tunnel.__labext_bound === true) {
+                    return;
                 }
-
-                window.IPyCallback.get("$tunnelId").on_receive((version, payload) => {
-                    let msg = JSON.parse(payload);
-                    if (msg.params.appendTo !== undefined) {
-                        msg.params.appendTo = document.querySelector(msg.params.appendTo);  
-                    }
-                    if (msg.params.debug !== undefined) {
-                        window.tippy = tippy;
-                        console.log("Tippy args:", `$${msg.selector} [data-tippy-content]`, msg.params);
-                    }
-                    if (msg.params.delayms !== undefined) {
-                        setTimeout(() => {
-                            tippy(`$${msg.selector} [data-tippy-content]`, msg.params);
-                        }, msg.params.delayms);
-                    } else {
-                        tippy(`$${msg.selector} [data-tippy-content]`, msg.params);
+                tunnel.__labext_bound = true;
+                tunnel.on_receive((version, payload) => {
+                    // a payload is either a single message or a batch of messages (see `LabExt.batch`)
+                    let msgs = JSON.parse(payload);
+                    if (!Array.isArray(msgs)) {
+                        msgs = [msgs];
                     }
+                    container.frame.push(() => {
+                        for (let msg of msgs) {
+                            if (msg.params.appendTo !== undefined) {
+                                msg.params.appendTo = document.querySelector(msg.params.appendTo);  
+                            }
+                            if (msg.params.debug !== undefined) {
+                                window.tippy = tippy;
+                                console.log("Tippy args:", `$${msg.selector} [data-tippy-content]`, msg.params);
+                            }
+                            if (msg.params.delayms !== undefined) {
+                                setTimeout(() => {
+                                    tippy(`$${msg.selector} [data-tippy-content]`, msg.params);
+                                }, msg.params.delayms);
+                            } else {
+                                tippy(`$${msg.selector} [data-tippy-content]`, msg.params);
+                            }
+                        }
+                    });
                 });
-                return true;
-            }, 100);
+            });
         });
-                """).substitute(tunnelId=cls.tunnel.tunnel_id, CallUntilTrue=LabExt.call_until_true))
-        display(cls.tunnel, jscode)
-        return result
+                """).substitute(tunnelId=cls.tunnel_id, container=LabExt.container)
+
+    @classmethod
+    def comm_widgets(cls) -> list:
+        return [cls.tunnel]
 
     @classmethod
     def render(cls, css_selector: str = "", params: dict = None):
-        cls.tunnel.send_msg(json.dumps({
+        LabExt.send_msg({
             "selector": css_selector,
             "params": params or {}
-        }))
+        }, cls.tunnel)
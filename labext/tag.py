@@ -1,9 +1,35 @@
+import html
 import re
+from functools import lru_cache
+from itertools import repeat
 from typing import *
 
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+
+camel_reg = re.compile('.+?(?:(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z0-9])|$)')
+
+
+@lru_cache(maxsize=None)
+def to_kebab_case(prop: str) -> str:
+    """Convert a camel case property (e.g., `backgroundColor`) to kebab case (e.g., `background-color`)"""
+    return "-".join(match.group(0) for match in camel_reg.finditer(prop)).lower()
+
+
+class RawHTML(str):
+    """A string of HTML that is inserted into a tag as it is (without escaping)"""
+    __slots__ = ()
+
+
+# elements that cannot have children and must not have a closing tag
+VOID_ELEMENTS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track",
+                 "wbr"}
+
 
 class Tag:
-    camel_reg = re.compile('.+?(?:(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z0-9])|$)')
+    __slots__ = ("tag", "children", "_styles", "_attrs", "_data")
+    camel_reg = camel_reg
 
     def __init__(self, tag: str, children: Union[str, 'Tag', List[Union[str, 'Tag']]]):
         self.tag = tag
@@ -14,6 +40,17 @@ class Tag:
         self._attrs = {}
         self._data = {}
 
+    @staticmethod
+    def raw(content: str) -> RawHTML:
+        """Mark a string as HTML so that it is not escaped when it is a child of a tag"""
+        return RawHTML(content)
+
+    @staticmethod
+    def slot(name: str) -> 'Slot':
+        """Create a named placeholder, which can be used as a child, or as a value of styles, attributes and data of
+        tags in a template (see `Tag.compile`)"""
+        return Slot(name)
+
     @staticmethod
     def span(children: Union[str, 'Tag', List[Union[str, 'Tag']]]=None):
         return Tag('span', children or [])
@@ -100,10 +137,7 @@ class Tag:
 
     def css(self, **kwargs):
         for prop, value in kwargs.items():
-            result = []
-            for match in self.camel_reg.finditer(prop):
-                result.append(match.group(0))
-            prop = "-".join(result).lower()
+            prop = to_kebab_case(prop)
             if value is None:
                 if prop in self._styles:
                     self._styles.pop(prop)
@@ -118,10 +152,7 @@ class Tag:
             elif prop == 'htmlFor':
                 prop = 'for'
             else:
-                result = []
-                for match in self.camel_reg.finditer(prop):
-                    result.append(match.group(0))
-                prop = "-".join(result).lower()
+                prop = to_kebab_case(prop)
             if value is None:
                 if prop in self._attrs:
                     self._attrs.pop(prop)
@@ -131,11 +162,7 @@ class Tag:
 
     def data(self, **kwargs):
         for prop, value in kwargs.items():
-            result = []
-            for match in self.camel_reg.finditer(prop):
-                result.append(match.group(0))
-            prop = "-".join(result).lower()
-
+            prop = to_kebab_case(prop)
             if value is None:
                 if prop in self._data:
                     self._data.pop(prop)
@@ -152,27 +179,300 @@ class Tag:
     def get_attr(self, key, default=None):
         return self._attrs.get(key, default)
 
+    def copy(self) -> 'Tag':
+        """Deep copy the tree"""
+        tag = Tag(self.tag, [x.copy() if isinstance(x, Tag) else x for x in self.children])
+        tag._styles = self._styles.copy()
+        tag._attrs = self._attrs.copy()
+        tag._data = self._data.copy()
+        return tag
+
+    def diff(self, new: 'Tag') -> Optional[List[dict]]:
+        """Compute patches that turn the DOM of this tree into the DOM of the new tree. Return None if the structure
+        of the trees are different (the new tree needs to be rendered from scratch).
+
+        Each patch is a dictionary that has a `path` (indices of the element in its ancestors' element children,
+        starting from the root) and any of the following changes:
+            - attrs: {name: value or None (removed)}, including data attributes
+            - style: {property: value or None (removed)}
+            - classes: {add: [classes], remove: [classes]}
+            - text: the new text content, or html: the new inner HTML (when the content has raw HTML)
+        """
+        patches = []
+        stack = [(self, new, [])]
+        while stack:
+            old_node, new_node, path = stack.pop()
+            if old_node.tag != new_node.tag:
+                return None
+
+            patch = {}
+            old_attrs = old_node._get_dom_attrs()
+            new_attrs = new_node._get_dom_attrs()
+            attrs = {k: v for k, v in new_attrs.items() if old_attrs.get(k) != v}
+            attrs.update({k: None for k in old_attrs.keys() if k not in new_attrs})
+            if len(attrs) > 0:
+                patch['attrs'] = attrs
+
+            style = {k: str(v) for k, v in new_node._styles.items() if old_node._styles.get(k) != v}
+            style.update({k: None for k in old_node._styles.keys() if k not in new_node._styles})
+            if len(style) > 0:
+                patch['style'] = style
+
+            old_classes = old_node._attrs.get("class", "").split()
+            new_classes = new_node._attrs.get("class", "").split()
+            if old_classes != new_classes:
+                patch['classes'] = {
+                    "add": [x for x in new_classes if x not in old_classes],
+                    "remove": [x for x in old_classes if x not in new_classes]
+                }
+
+            old_elements = [x for x in old_node.children if isinstance(x, Tag)]
+            new_elements = [x for x in new_node.children if isinstance(x, Tag)]
+            if len(old_elements) == 0 and len(new_elements) == 0:
+                if old_node.children != new_node.children:
+                    if any(isinstance(x, RawHTML) for x in new_node.children):
+                        patch['html'] = "".join(x if isinstance(x, RawHTML) else escape_text(x)
+                                                for x in new_node.children)
+                    else:
+                        patch['text'] = "".join(str(x) for x in new_node.children)
+            else:
+                # we only patch text of elements that do not have children elements, so the text nodes of other
+                # elements must be the same
+                if [isinstance(x, Tag) for x in old_node.children] != [isinstance(x, Tag) for x in new_node.children]:
+                    return None
+                if [x for x in old_node.children if not isinstance(x, Tag)] != \
+                        [x for x in new_node.children if not isinstance(x, Tag)]:
+                    return None
+                for i in range(len(new_elements) - 1, -1, -1):
+                    stack.append((old_elements[i], new_elements[i], path + [i]))
+
+            if len(patch) > 0:
+                patch['path'] = path
+                patches.append(patch)
+        return patches
+
+    def _get_dom_attrs(self) -> Dict[str, str]:
+        """Get attributes of the element in the DOM except class and style"""
+        attrs = {k: str(v) for k, v in self._attrs.items() if k != "class" and k != "style"}
+        for k, v in self._data.items():
+            attrs[f"data-{k}"] = str(v)
+        return attrs
+
     def value(self):
         return str(self)
 
+    def compile(self) -> 'TagTemplate':
+        """Compile this tree, which contains placeholders created by `Tag.slot`, into a template that can be rendered
+        repeatedly with different values"""
+        return TagTemplate(self)
+
+    def open_tag(self) -> str:
+        """Get the opening tag (with styles, attributes and data) of this element"""
+        attrs = ""
+        if self._styles:
+            style = ";".join([f'{k}: {v}' for k, v in self._styles.items()])
+            attrs = f' style="{escape_attr(style)}"'
+        if self._attrs:
+            attrs += "".join([f' {k}="{escape_attr(v)}"' for k, v in self._attrs.items()])
+        if self._data:
+            attrs += "".join([f' data-{k}="{escape_attr(v)}"' for k, v in self._data.items()])
+        return f"<{self.tag}{attrs}>"
+
+    def serialize(self, append: Callable[[str], Any]):
+        """Serialize the tree to HTML by passing its fragments (in order) to the `append` function. The tree is
+        traversed iteratively so deep trees do not hit the recursion limit"""
+        # stack of iterators over children of the open tags, and the corresponding closing tags
+        stack = [iter((self,))]
+        closing_tags = []
+        while stack:
+            for node in stack[-1]:
+                node_type = type(node)
+                if node_type is str:
+                    if "&" in node or "<" in node or ">" in node:
+                        node = escape_text(node)
+                    append(node)
+                elif node_type is Tag or isinstance(node, Tag):
+                    children = node.children
+                    if not children:
+                        if node.tag in VOID_ELEMENTS:
+                            append(node.open_tag())
+                        else:
+                            append(f"{node.open_tag()}</{node.tag}>")
+                    elif len(children) == 1 and type(children[0]) is str:
+                        # fast path for the common case of a tag that only has text
+                        append(f"{node.open_tag()}{escape_text(children[0])}</{node.tag}>")
+                    else:
+                        append(node.open_tag())
+                        closing_tags.append(f"</{node.tag}>")
+                        stack.append(iter(children))
+                        break
+                elif node_type is RawHTML:
+                    append(node)
+                else:
+                    append(escape_text(node))
+            else:
+                stack.pop()
+                if closing_tags:
+                    append(closing_tags.pop())
+
+    def write(self, writer: IO[str], buffer_size: int = 4096):
+        """Write the HTML to a file-like object, fragments are buffered to reduce the number of writes"""
+        buffer = []
+
+        def append(fragment: str):
+            buffer.append(fragment)
+            if len(buffer) >= buffer_size:
+                writer.write("".join(buffer))
+                buffer.clear()
+
+        self.serialize(append)
+        if len(buffer) > 0:
+            writer.write("".join(buffer))
+
     def __str__(self):
-        style = ''
-        if len(self._styles) > 0:
-            style = ";".join(f'{k}: {v}' for k, v in self._styles.items())
-            style = f'style="{style}"'
-        attrs = ''
-        if len(self._attrs) > 0:
-            attrs = " ".join([f'{k}="{v}"' for k, v in self._attrs.items()])
-        data = ''
-        if len(self._data) > 0:
-            lst = []
-            for k, v in self._data.items():
-                v = v.replace('"', '&quot;')
-                lst.append(f'data-{k}="{v}"')
-            data = " ".join(lst)
-
-        content = "".join([str(x) for x in self.children])
-        return f"<{self.tag} {style} {attrs} {data}>{content}</{self.tag}>"
+        buffer = []
+        self.serialize(buffer.append)
+        return "".join(buffer)
 
     def __repr__(self):
-        return str(self)
\ No newline at end of file
+        return str(self)
+
+
+class Slot:
+    """A named placeholder in a tag template"""
+    __slots__ = ("name",)
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __str__(self):
+        # characters in the private use area, so they are not touched by escaping
+        return f"\ue000{self.name}\ue001"
+
+    def __format__(self, format_spec):
+        return str(self)
+
+
+class TagTemplate:
+    """A tag tree that is precompiled into static HTML segments and placeholders, so that rendering a record is just
+    escaping its values and joining the strings.
+
+    Example:
+        >>> tpl = Tag.tr([
+        >>>     Tag.td(Tag.slot("name")).data(tippyContent=Tag.slot("description")),
+        >>>     Tag.td(Tag.a(Tag.slot("name")).attr(href=Tag.slot("url"))),
+        >>> ]).compile()
+        >>> tpl.render(name="labext", description="<b>Extra widgets</b>", url="https://github.com/binh-vu/labext")
+        >>> tpl.render_many(records)
+        >>> tpl.render_frame(df)
+    """
+    slot_reg = re.compile("\ue000(.*?)\ue001")
+
+    def __init__(self, tree: Tag):
+        html = str(tree)
+        # segments at even positions are static strings, segments at odd positions are placeholders
+        segments = self.slot_reg.split(html)
+        self.parts: List[str] = []
+        # list of (position in parts, name of the slot, escape function)
+        self.slots: List[Tuple[int, str, Callable[[Any], str]]] = []
+
+        offset = 0
+        for i, segment in enumerate(segments):
+            if i % 2 == 0:
+                self.parts.append(segment)
+            else:
+                # a placeholder is in an attribute if it is inside an open tag; it's safe to check this way because
+                # static text is escaped
+                in_attr = html.rfind("<", 0, offset) > html.rfind(">", 0, offset)
+                self.slots.append((len(self.parts), segment, escape_attr if in_attr else escape_html))
+                self.parts.append("")
+                segment = str(Slot(segment))
+            offset += len(segment)
+
+    @property
+    def names(self) -> List[str]:
+        """Names of the placeholders"""
+        return list(dict.fromkeys(name for _, name, _ in self.slots))
+
+    def render(self, record: Optional[Mapping[str, Any]] = None, **kwargs) -> str:
+        """Render the template with values from the record (or keyword arguments)"""
+        values = record if record is not None else kwargs
+        parts = self.parts.copy()
+        for i, name, escape in self.slots:
+            parts[i] = escape(values[name])
+        return "".join(parts)
+
+    def render_many(self, records: Iterable[Mapping[str, Any]]) -> List[str]:
+        """Render the template for each record"""
+        parts = self.parts
+        slots = self.slots
+        results = []
+        for record in records:
+            row = parts.copy()
+            for i, name, escape in slots:
+                row[i] = escape(record[name])
+            results.append("".join(row))
+        return results
+
+    def render_columns(self, columns: Mapping[str, Sequence]) -> List[str]:
+        """Render the template for each row of the columns (mapping from a placeholder's name to its values). Values
+        of numeric pandas series are converted to strings in a vectorized way"""
+        size = None
+        escaped_columns = {}
+        for _, name, escape in self.slots:
+            key = (name, escape)
+            if key not in escaped_columns:
+                escaped_columns[key] = escape_column(columns[name], escape)
+                if size is None:
+                    size = len(escaped_columns[key])
+                assert size == len(escaped_columns[key]), "All columns must have the same length"
+
+        if size is None:
+            # no placeholder
+            return []
+
+        cols = [repeat(part) for part in self.parts]
+        for i, name, escape in self.slots:
+            cols[i] = escaped_columns[name, escape]
+        return ["".join(row) for row in zip(*cols)]
+
+    def render_frame(self, df: 'DataFrame') -> List[str]:
+        """Render the template for each row of the data frame, the placeholders are filled by columns of the same
+        names"""
+        return self.render_columns({name: df[name] for name in self.names})
+
+
+def escape_column(values: Sequence, escape: Callable[[Any], str]) -> List[str]:
+    dtype = getattr(values, "dtype", None)
+    if dtype is not None:
+        if dtype.kind in "biuf":
+            # string representation of numbers do not need escaping
+            return values.astype(str).tolist()
+        values = values.tolist()
+
+    if escape is escape_html:
+        # inline the check of the common case: strings that do not need escaping
+        return [value if type(value) is str and "&" not in value and "<" not in value and ">" not in value
+                else escape(value) for value in values]
+    return [escape(value) for value in values]
+
+
+def escape_html(value: Any) -> str:
+    """Escape a value that is a child of a tag. Tags and raw HTML are inserted as it is"""
+    if isinstance(value, (Tag, RawHTML)):
+        return str(value)
+    return escape_text(value)
+
+
+def escape_text(value: Any) -> str:
+    value = str(value)
+    if "&" in value or "<" in value or ">" in value:
+        return value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    return value
+
+
+def escape_attr(value: Any) -> str:
+    value = str(value)
+    if "&" in value or "<" in value or ">" in value or '"' in value or "'" in value:
+        return html.escape(value, quote=True)
+    return value
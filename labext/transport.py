@@ -0,0 +1,124 @@
+import sys
+from typing import Any, List, Tuple, Optional, Union, TYPE_CHECKING
+
+import ujson
+
+if TYPE_CHECKING:
+    from ipycallback import SlowTunnelWidget
+    from labext.modules.lab_ext import Route
+
+# numeric payloads smaller than this (in bytes) are sent as JSON text, as binary messages are not worth it
+BINARY_THRESHOLD = 4096
+# dtypes that have an equivalent typed array in javascript
+TYPED_ARRAYS = {"int8", "uint8", "int16", "uint16", "int32", "uint32", "float32", "float64"}
+
+
+def send(tunnel, payload: Any, version: Optional[int] = None, threshold: int = BINARY_THRESHOLD):
+    """Send a payload to the client via a tunnel (`SlowTunnelWidget` or `Route`). Numeric numpy arrays in the payload
+    are sent as binary buffers (decoded to typed arrays in the client without parsing) when they are large enough,
+    otherwise the payload is sent as JSON text.
+
+    The client receives the payload in the handler of `tunnel.on_receive`: it is a string if it is sent as text, and
+    the decoded object if it is sent as binary. This works for tunnels that are created after the `LabExt` module is
+    registered.
+
+    Parameters
+    ----------
+    tunnel: Union[SlowTunnelWidget, Route]
+        the tunnel
+    payload: Any
+        a JSON serializable object, which can contain numpy arrays
+    version: Optional[int]
+        the version of the message, same as `SlowTunnelWidget.send_msg_with_version`, the message is dropped if it is
+        older than the last message
+    threshold: int
+        minimum size (in bytes) of the numeric arrays to send the payload as binary
+    """
+    header, buffers = encode(payload)
+    last_version = max(tunnel.js_endpoint[0], getattr(tunnel, "_labext_binary_version", 0))
+
+    if len(buffers) == 0 or sum(buf.nbytes for buf in buffers) < threshold:
+        # arrays that are not sent as binary (e.g., objects or large integers) are still in the payload
+        msg = ujson.dumps(to_json(payload))
+        if version is None:
+            tunnel.send_msg(msg)
+        elif version > last_version:
+            # binary messages may have a larger version than the tunnel
+            tunnel.send_msg_with_version(version, msg)
+        return
+
+    # a response of a request (`send_msg_with_version`) or a new message (`send_msg`)
+    response = version is not None
+    if version is None:
+        version = last_version + 1
+    elif version <= last_version:
+        return
+    tunnel._labext_binary_version = version
+    tunnel.send({"labext": "binary", "version": version, "response": response, "header": header}, buffers=buffers)
+
+
+def encode(payload: Any) -> Tuple[Any, List[memoryview]]:
+    """Replace numeric numpy arrays in the payload by references to binary buffers. Returns the new payload and the
+    buffers"""
+    np = sys.modules.get("numpy")
+    if np is None:
+        # numpy is not imported, so the payload can't contain any numpy array
+        return payload, []
+
+    buffers = []
+
+    def replace(value):
+        if isinstance(value, dict):
+            return {k: replace(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [replace(v) for v in value]
+        if isinstance(value, np.ndarray):
+            array = as_typed_array(np, value)
+            if array is None:
+                return value.tolist()
+            buffers.append(memoryview(array).cast("B"))
+            return {
+                "__labext_buffer__": len(buffers) - 1,
+                "dtype": "bool" if value.dtype == np.bool_ else str(array.dtype),
+                "shape": list(array.shape)
+            }
+        return value
+
+    return replace(payload), buffers
+
+
+def as_typed_array(np, array):
+    """Convert a numpy array to a contiguous little-endian array that has an equivalent typed array in javascript.
+    Returns None if the array is not numeric"""
+    if array.dtype == np.bool_:
+        array = array.astype(np.uint8)
+    elif array.dtype.kind in "iu" and array.dtype.name not in TYPED_ARRAYS:
+        # 64 bits integers are sent as doubles if there is no loss of precision
+        if array.size > 0 and (array.max() > 2 ** 53 or array.min() < -2 ** 53):
+            return None
+        array = array.astype(np.float64)
+    elif array.dtype.kind == "f" and array.dtype.name not in TYPED_ARRAYS:
+        array = array.astype(np.float64)
+    elif array.dtype.kind not in "iuf":
+        return None
+
+    if array.dtype.byteorder == ">" or (array.dtype.byteorder == "=" and sys.byteorder == "big"):
+        array = array.astype(array.dtype.newbyteorder("<"))
+    return np.ascontiguousarray(array)
+
+
+def to_json(payload: Any) -> Any:
+    """Convert numpy arrays in the payload to lists"""
+    np = sys.modules.get("numpy")
+    if np is None:
+        return payload
+    if isinstance(payload, dict):
+        return {k: to_json(v) for k, v in payload.items()}
+    if isinstance(payload, (list, tuple)):
+        return [to_json(v) for v in payload]
+    if isinstance(payload, np.ndarray):
+        if payload.dtype.kind == "f" and not np.isfinite(payload).all():
+            # NaN and infinity are not valid JSON
+            return np.where(np.isfinite(payload), payload, None).tolist()
+        return payload.tolist()
+    return payload
@@ -19,3 +19,8 @@ class WidgetWrapper(ABC):
 
     def get_auxiliary_components(self, *args) -> list:
         return []
+
+    def close(self):
+        """Close the widget, which releases the resources (listeners, routes, etc.) of the wrapper in the kernel and
+        the browser"""
+        self.widget.close()
@@ -1,6 +1,34 @@
+// a route of the LabExt channel (see `labext.modules.lab_ext.Route`)
 interface Tunnel {
   send_msg: (msg: string) => number;
-  on_receive: (handler: (version: number, msg: string) => void) => void;
+  // msg is an object if it is sent as binary (see `labext.transport`)
+  on_receive: (handler: (version: number, msg: string | object) => void) => void;
+  // send a message and get its response, responses of older requests are dropped
+  request: (msg: string) => Promise<string | object>;
+  // drop the pending requests, the server stops working on them
+  cancel: () => void;
+}
+
+// changes of the records that are sent by the server (see `DataTable.send_update`)
+interface Delta {
+  // the query (order and search) that the rows are of
+  query: object;
+  // position of the first row and number of rows of the query that the server has
+  start: number;
+  length: number;
+  recordsTotal: number;
+  recordsFiltered: number;
+  // list of [position from start, row] of the changed rows
+  rows: [number, any[]][];
+}
+
+// a block of consecutive rows of a query that is cached in the client
+interface Block {
+  start: number;
+  end: number;
+  recordsTotal: number;
+  recordsFiltered: number;
+  data: any[];
 }
 
 class LabExtDataTable {
@@ -20,17 +48,38 @@ class LabExtDataTable {
   // the data table instance. use it for re-drawing the table
   dataTable?: any;
   isInitComplete: boolean;
+  // release the table and the references to it, it is replaced by the code that registers the table
+  dispose: () => void;
+
+  // number of pages that are fetched per request and maximum number of blocks (of those pages) that are cached
+  cache: { pages: number, size: number };
+  // LRU of the fetched blocks: query + start of the block => block
+  blocks: Map<string, Block>;
+  // start of the last requested page, to know which direction users are paging
+  lastStart: number;
+  // the query (see `queryKey`) of the rows that are shown
+  shownQuery?: string;
+  // the virtual scrolling mode, which replaces the DataTable plugin
+  scroller?: LabExtDataTableScroller;
 
   constructor(jquery: JQueryStatic,
               container: JQuery<HTMLElement>,
               tunnel: Tunnel,
               columns: object[],
               table_style: string,
-              options: { [key: string]: any } = {}) {
+              options: { [key: string]: any } = {},
+              cache: { pages: number, size: number } = {pages: 1, size: 0},
+              scroller: { height: number, rowHeight: number } | null = null) {
     this.$ = jquery;
     this.$container = container;
     this.tunnel = tunnel;
     this.columns = columns;
+    this.cache = cache;
+    this.blocks = new Map();
+    this.lastStart = 0;
+    if (scroller !== null) {
+      this.scroller = new LabExtDataTableScroller(this, scroller);
+    }
 
     this.table_style = table_style;
     if (options.caption !== undefined) {
@@ -44,6 +93,7 @@ class LabExtDataTable {
       ...options
     };
     this.isInitComplete = false;
+    this.dispose = () => this.destroy();
 
     this.tunnel.send_msg(JSON.stringify({"type": "status", "msg": "init_start"}));
 
@@ -58,6 +108,10 @@ class LabExtDataTable {
         eval("fn = " + (col as any).createdCell);
         (col as any).createdCell = fn;
       }
+      // formats that are applied by the client (see `ColumnFormat`)
+      if ((col as any).labextFormat !== undefined) {
+        (col as any).render = LabExtDataTable.renderer((col as any).labextFormat);
+      }
     }
 
     if ((this.options as any).createdRow !== undefined) {
@@ -67,6 +121,11 @@ class LabExtDataTable {
   }
 
   render() {
+    if (this.scroller !== undefined) {
+      this.scroller.render();
+      return;
+    }
+
     // now render the content
     let $tbl = this.$(`<table>${this.caption || ""}</table>`)
       .attr({"class": this.table_style})
@@ -77,26 +136,7 @@ class LabExtDataTable {
       columns: this.columns,
       ajax: (data: any, callback: any, settings: any) => {
         // documentation in here: https://datatables.net/manual/server-side
-        let version = this.tunnel.send_msg(JSON.stringify({
-          type: "query",
-          msg: {
-            start: data.start || 0,
-            length: data.length || 10,
-          }
-        }));
-
-        this.tunnel.on_receive((returned_version, msg) => {
-          if (returned_version !== version) {
-            return;
-          }
-
-          let resp = JSON.parse(msg);
-          callback({
-            recordsTotal: resp.recordsTotal,
-            recordsFiltered: resp.recordsFiltered,
-            data: resp.data
-          });
-        });
+        this.query(data, callback);
       },
       initComplete: () => {
         this.isInitComplete = true;
@@ -111,9 +151,447 @@ class LabExtDataTable {
     });
   }
 
+  /**
+   * Get the rows of a page from the cached blocks or fetch a block of `cache.pages` pages that contains the page
+   * (the "pipeline" example of DataTables)
+   */
+  query(data: any, callback: any) {
+    let start = data.start || 0;
+    let length = data.length || 10;
+    let params = {
+      // list of [column, "asc" | "desc"], sorting is done by the server
+      order: (data.order || []).map((o: any) => [o.column, o.dir]),
+      // searching is done by the server as well
+      search: data.search === undefined ? "" : data.search.value,
+      searchable: (data.columns || []).map((c: any, i: number) => c.searchable ? i : -1)
+        .filter((i: number) => i !== -1),
+      column_search: (data.columns || []).map((c: any, i: number) => [i, c.search.value])
+        .filter((s: any) => s[1] !== ""),
+    };
+    let query = LabExtDataTable.queryKey(params);
+
+    let backward = start < this.lastStart;
+    this.lastStart = start;
+    if (length > 0) {
+      for (let [key, block] of this.blocks) {
+        if (key.startsWith(query + "@") && block.start <= start
+          && (start + length <= block.end || block.end >= block.recordsFiltered)) {
+          // move it to the end of the LRU
+          this.blocks.delete(key);
+          this.blocks.set(key, block);
+          this.tunnel.cancel();
+          this.shownQuery = query;
+          callback({
+            draw: data.draw,
+            recordsTotal: block.recordsTotal,
+            recordsFiltered: block.recordsFiltered,
+            data: block.data.slice(start - block.start, start - block.start + length)
+          });
+          return;
+        }
+      }
+    }
+
+    // when users go backward, the requested page is the last page of the block
+    let blockLength = length > 0 ? length * this.cache.pages : length;
+    let blockStart = backward && length > 0 ? Math.max(0, start + length - blockLength) : start;
+    this.tunnel.request(JSON.stringify({
+      type: "query",
+      msg: {start: blockStart, length: blockLength, ...params}
+    })).then((msg) => {
+      let resp = typeof msg === "string" ? JSON.parse(msg) : msg as any;
+      let rows = LabExtDataTable.toRows(resp);
+      if (length > 0 && this.cache.size > 0) {
+        this.blocks.set(query + "@" + blockStart, {
+          start: blockStart,
+          end: blockStart + blockLength,
+          recordsTotal: resp.recordsTotal,
+          recordsFiltered: resp.recordsFiltered,
+          data: rows
+        });
+        if (this.blocks.size > this.cache.size) {
+          this.blocks.delete(this.blocks.keys().next().value);
+        }
+      }
+      this.shownQuery = query;
+      // DataTables ignores responses of the previous draws
+      callback({
+        draw: data.draw,
+        recordsTotal: resp.recordsTotal,
+        recordsFiltered: resp.recordsFiltered,
+        data: length > 0 ? rows.slice(start - blockStart, start - blockStart + length) : rows
+      });
+    });
+  }
+
+  /**
+   * Create a render function (https://datatables.net/reference/option/columns.render) of a format of a column (see
+   * `ColumnFormat`). Values are only formatted for display as they are sorted and searched by the server
+   */
+  static renderer(spec: any): (value: any, type: string) => any {
+    let escape = (value: any) => String(value).replace(/[&<>"']/g, (c) => `&#${c.charCodeAt(0)};`);
+    let format: (value: any) => string = (value) => String(value);
+    if (spec.type === "number" || spec.type === "bar") {
+      let decimals = spec.decimals === null || spec.decimals === undefined ? undefined : spec.decimals;
+      let numberFormat = new Intl.NumberFormat(spec.locale || undefined, {
+        minimumFractionDigits: decimals,
+        maximumFractionDigits: decimals === undefined ? 20 : decimals,
+        useGrouping: spec.grouping !== false
+      });
+      let text = (value: any) => typeof value === "number" ? numberFormat.format(value) : escape(value);
+      if (spec.type === "number") {
+        let prefix = escape(spec.prefix || "");
+        let suffix = escape(spec.suffix || "");
+        format = (value) => prefix + text(value) + suffix;
+      } else {
+        let range = spec.max - spec.min;
+        format = (value) => {
+          let width = typeof value !== "number" || range <= 0 ? 0
+            : Math.min(100, Math.max(0, (value - spec.min) / range * 100));
+          return `<div style="position: relative"><div style="position: absolute; left: 0; top: 0; bottom: 0; `
+            + `width: ${width.toFixed(1)}%; background: ${escape(spec.color)}"></div>`
+            + `<span style="position: relative">${text(value)}</span></div>`;
+        };
+      }
+    } else if (spec.type === "date") {
+      let pad = (n: number) => String(n).padStart(2, "0");
+      format = (value) => {
+        if (typeof value === "string") {
+          // datetimes are sent as "YYYY-MM-DD HH:mm:ss.fffffffff" (see `serialize_column`), dates without time are
+          // parsed as UTC and fractions of more than 3 digits are not supported by all browsers
+          value = /^\d{4}-\d{2}-\d{2}$/.test(value) ? value + "T00:00:00"
+            : value.replace(" ", "T").replace(/(\.\d{3})\d+/, "$1");
+        }
+        let date = new Date(value);
+        if (isNaN(date.getTime())) return escape(value);
+        let tokens: { [token: string]: string } = {
+          YYYY: String(date.getFullYear()), MM: pad(date.getMonth() + 1), DD: pad(date.getDate()),
+          HH: pad(date.getHours()), mm: pad(date.getMinutes()), ss: pad(date.getSeconds())
+        };
+        return escape(spec.format.replace(/YYYY|MM|DD|HH|mm|ss/g, (token: string) => tokens[token]));
+      };
+    } else if (spec.type === "link") {
+      format = (value) => {
+        let href = spec.href === "{}" ? String(value)
+          : spec.href.replace(/\{\}/g, () => encodeURIComponent(String(value)));
+        let text = escape(spec.text.replace(/\{\}/g, () => String(value)));
+        if (/^\s*javascript:/i.test(href)) return text;
+        return `<a href="${escape(href)}"${spec.newTab ? ' target="_blank" rel="noopener"' : ""}>${text}</a>`;
+      };
+    }
+    return (value: any, type: string) => {
+      if (type !== "display") return value;
+      return value === null || value === undefined ? "" : format(value);
+    };
+  }
+
+  static queryKey(params: any): string {
+    return JSON.stringify([params.order, params.search, params.searchable, params.column_search]);
+  }
+
+  /**
+   * Get the rows of a response, which are sent either as rows (`data`) or column by column (`columns`, see
+   * `ITable.get_columns`). Numeric columns may be typed arrays, their NaN are missing values.
+   */
+  static toRows(resp: any): any[] {
+    if (resp.columns === undefined) {
+      return resp.data;
+    }
+    let columns: any[] = resp.columns;
+    let nrows = columns.length === 0 ? 0 : columns[0].length;
+    let rows = new Array(nrows);
+    for (let i = 0; i < nrows; i++) {
+      let row = new Array(columns.length);
+      for (let j = 0; j < columns.length; j++) {
+        let value = columns[j][i];
+        row[j] = typeof value === "number" && isNaN(value) ? null : value;
+      }
+      rows[i] = row;
+    }
+    return rows;
+  }
+
   draw() {
-    // redraw the table: https://datatables.net/reference/api/draw()
+    // redraw the table after the data is changed: https://datatables.net/reference/api/draw()
+    this.blocks.clear();
+    if (this.scroller !== undefined) {
+      this.scroller.draw();
+      return;
+    }
     if (this.dataTable === undefined) return;
     this.dataTable.draw();
   }
-}
\ No newline at end of file
+
+  /**
+   * Apply the changes of the records to the shown rows without redrawing the table. The page is requested again if
+   * the changes don't cover it (e.g., it is served from the cache) or the number of records changes, as the info
+   * and the paging buttons are only updated when the table is drawn
+   */
+  applyDelta(delta: Delta) {
+    // the cached blocks are outdated
+    this.blocks.clear();
+    if (this.scroller !== undefined) {
+      this.scroller.applyDelta(delta, LabExtDataTable.queryKey(delta.query) === this.shownQuery);
+      return;
+    }
+    if (this.dataTable === undefined || !this.isInitComplete) return;
+
+    // https://datatables.net/reference/api/page.info()
+    let info = this.dataTable.page.info();
+    let nrows = this.dataTable.rows().count();
+    if (LabExtDataTable.queryKey(delta.query) !== this.shownQuery
+      || delta.recordsTotal !== info.recordsTotal || delta.recordsFiltered !== info.recordsDisplay
+      || delta.start > info.start || delta.start + delta.length < info.start + nrows) {
+      // keep the current page: https://datatables.net/reference/api/draw()
+      this.dataTable.draw(false);
+      return;
+    }
+
+    for (let [i, row] of delta.rows) {
+      let index = delta.start + i - info.start;
+      if (index >= 0 && index < nrows) {
+        // the cells of the row are rendered again: https://datatables.net/reference/api/row().data()
+        this.dataTable.row(index).data(row);
+      }
+    }
+  }
+
+  destroy() {
+    // remove the DataTable plugin (its event handlers and cached rows): https://datatables.net/reference/api/destroy()
+    if (this.dataTable !== undefined) {
+      this.dataTable.destroy();
+      this.dataTable = undefined;
+    }
+    this.$container.empty();
+  }
+}
+
+/**
+ * Virtual scrolling mode of LabExtDataTable: only the rows around the viewport are in the DOM (their elements are
+ * reused when the viewport moves), and the rows are requested from the server by windows as users scroll. Scroll events
+ * are coalesced into one update per animation frame.
+ */
+class LabExtDataTableScroller {
+  table: LabExtDataTable;
+  // height of the viewport and of every row (in pixels)
+  height: number;
+  rowHeight: number;
+  // number of rows that are rendered above and below the viewport
+  buffer: number;
+
+  $viewport?: JQuery<HTMLElement>;
+  tbody?: HTMLElement;
+  // cells of the rows above and below the rendered rows, whose heights are the heights of the rows that are not rendered
+  topSpacer?: HTMLElement;
+  bottomSpacer?: HTMLElement;
+  // rows that are rendered, they are reused when the window moves
+  pool: HTMLElement[];
+  // the window of rows that is received from the server
+  window: { start: number, rows: any[] };
+  total: number;
+  order: { column: number, dir: string }[];
+  frameScheduled: boolean;
+  // the table is redrawn (see `draw`) and waiting for the rows
+  redrawing: boolean;
+  // version of the data, responses of the previous versions (before redrawing) are ignored
+  dataVersion: number;
+
+  constructor(table: LabExtDataTable, config: { height: number, rowHeight: number }) {
+    this.table = table;
+    this.height = config.height;
+    this.rowHeight = config.rowHeight;
+    this.buffer = Math.ceil(this.height / this.rowHeight);
+    this.pool = [];
+    this.window = {start: 0, rows: []};
+    this.total = 0;
+    this.order = [];
+    this.frameScheduled = false;
+    this.redrawing = false;
+    this.dataVersion = 0;
+  }
+
+  render() {
+    let $ = this.table.$;
+    this.$viewport = $("<div></div>")
+      .css({"height": `${this.height}px`, "overflow-y": "auto", "position": "relative"})
+      .appendTo(this.table.$container.empty());
+    let $tbl = $(`<table>${this.table.caption || ""}</table>`)
+      .attr({"class": `${this.table.table_style} dataTable`})
+      .css({"width": "100%"})
+      .appendTo(this.$viewport);
+
+    let $tr = $("<tr></tr>").appendTo($("<thead></thead>").appendTo($tbl));
+    this.table.columns.forEach((col: any, i: number) => {
+      let $th = $("<th></th>").text(col.title)
+        .css({"position": "sticky", "top": "0", "background": "white", "z-index": "1"})
+        .appendTo($tr);
+      if ((this.table.options as any).ordering !== false && col.orderable !== false) {
+        $th.css("cursor", "pointer").on("click", () => this.sortBy(i, $th));
+      }
+    });
+
+    this.tbody = $("<tbody></tbody>").appendTo($tbl)[0];
+    let spacer = `<tr><td colspan="${this.table.columns.length}" style="padding: 0; border: none"></td></tr>`;
+    this.topSpacer = $(spacer).appendTo(this.tbody).children()[0];
+    this.bottomSpacer = $(spacer).appendTo(this.tbody).children()[0];
+    this.$viewport.on("scroll", () => this.schedule());
+    this.update();
+  }
+
+  schedule() {
+    if (this.frameScheduled) return;
+    this.frameScheduled = true;
+    requestAnimationFrame(() => {
+      this.frameScheduled = false;
+      this.update();
+    });
+  }
+
+  /**
+   * Get the first visible row and its offset (in pixels) from the top of the viewport. Rows are scaled down when the
+   * table is taller than what the browser can render, so that millions of rows can be scrolled through
+   */
+  position(): { first: number, offset: number, scale: number } {
+    let scrollTop = this.$viewport![0].scrollTop;
+    let height = this.total * this.rowHeight;
+    let scale = height > LabExtDataTableScroller.maxHeight
+      ? (height - this.height) / (LabExtDataTableScroller.maxHeight - this.height) : 1;
+    let top = scrollTop * scale;
+    return {first: Math.floor(top / this.rowHeight), offset: top % this.rowHeight, scale: scale};
+  }
+
+  update() {
+    if (this.$viewport === undefined) return;
+    let {first} = this.position();
+    let visible = Math.ceil(this.height / this.rowHeight);
+    let start = Math.max(0, first - this.buffer);
+    let end = first + visible + this.buffer;
+    if (start >= this.window.start && (end <= this.window.start + this.window.rows.length
+      || this.window.start + this.window.rows.length >= this.total) && this.total > 0) {
+      this.layout();
+      return;
+    }
+
+    // request a window that is aligned to the buffer, so that small moves are served from the cached windows
+    let alignedStart = Math.floor(start / this.buffer) * this.buffer;
+    let length = (visible + 3 * this.buffer);
+    let dataVersion = this.dataVersion;
+    this.table.query({
+      start: alignedStart,
+      length: length,
+      order: this.order,
+      search: {value: ""},
+      columns: this.table.columns.map(() => ({searchable: false, search: {value: ""}}))
+    }, (resp: any) => {
+      if (dataVersion !== this.dataVersion) return;
+      this.window = {start: alignedStart, rows: resp.data};
+      this.total = resp.recordsFiltered;
+      this.layout();
+      if (!this.table.isInitComplete) {
+        this.table.isInitComplete = true;
+        this.table.tunnel.send_msg(JSON.stringify({"type": "status", "msg": "init_done"}));
+      } else if (this.redrawing) {
+        this.redrawing = false;
+        this.table.tunnel.send_msg(JSON.stringify({"type": "status", "msg": "redraw_done"}));
+      }
+    });
+  }
+
+  /**
+   * Render the rows of the window that are around the viewport, reusing the rendered rows
+   */
+  layout() {
+    let {first, offset, scale} = this.position();
+    let scrollTop = this.$viewport![0].scrollTop;
+    let visible = Math.ceil(this.height / this.rowHeight);
+    let start = Math.max(this.window.start, first - this.buffer);
+    if (scale !== 1) {
+        // there is no room above the first visible row for more rows than the scrolled pixels
+        start = Math.max(start, first - Math.floor(scrollTop / this.rowHeight));
+    }
+    let end = Math.min(this.window.start + this.window.rows.length, first + visible + this.buffer);
+    let nrows = Math.max(0, end - start);
+
+    while (this.pool.length < nrows) {
+      let tr = document.createElement("tr");
+      tr.style.height = `${this.rowHeight}px`;
+      tr.style.whiteSpace = "nowrap";
+      for (let i = 0; i < this.table.columns.length; i++) {
+        tr.appendChild(document.createElement("td"));
+      }
+      this.tbody!.insertBefore(tr, this.bottomSpacer!.parentElement);
+      this.pool.push(tr);
+    }
+    while (this.pool.length > nrows) {
+      this.tbody!.removeChild(this.pool.pop()!);
+    }
+    for (let i = 0; i < nrows; i++) {
+      // classes of DataTables' styles
+      this.pool[i].className = (start + i) % 2 === 0 ? "odd" : "even";
+    }
+
+    let renders = this.table.columns.map((col: any) => typeof col.render === "function" ? col.render : undefined);
+    for (let i = 0; i < nrows; i++) {
+      let row = this.window.rows[start + i - this.window.start];
+      let cells = this.pool[i].children;
+      for (let j = 0; j < cells.length; j++) {
+        let value = renders[j] === undefined ? row[j] : renders[j](row[j], "display", row);
+        (cells[j] as HTMLElement).innerHTML = value === null || value === undefined ? "" : String(value);
+      }
+    }
+
+    // rows above the rendered rows have their natural height when the table is not scaled
+    let top = scale === 1 ? start * this.rowHeight : Math.max(0, scrollTop - offset - (first - start) * this.rowHeight);
+    let height = scale === 1 ? this.total * this.rowHeight : LabExtDataTableScroller.maxHeight;
+    this.topSpacer!.style.height = `${top}px`;
+    this.bottomSpacer!.style.height = `${Math.max(0, height - top - nrows * this.rowHeight)}px`;
+  }
+
+  sortBy(column: number, $th: JQuery<HTMLElement>) {
+    let dir = this.order.length > 0 && this.order[0].column === column && this.order[0].dir === "asc" ? "desc" : "asc";
+    this.order = [{column: column, dir: dir}];
+    $th.siblings().removeClass("sorting_asc sorting_desc");
+    $th.removeClass("sorting_asc sorting_desc").addClass(`sorting_${dir}`);
+    this.reload();
+  }
+
+  draw() {
+    this.redrawing = true;
+    this.reload();
+  }
+
+  /**
+   * Apply the changes of the records (see `LabExtDataTable.applyDelta`) to the window. The window is requested again if
+   * the changes are not of the window
+   */
+  applyDelta(delta: Delta, sameQuery: boolean) {
+    if (this.$viewport === undefined) return;
+    this.total = delta.recordsFiltered;
+    if (!sameQuery || delta.start !== this.window.start || this.window.rows.length === 0) {
+      // the window is requested again, the rendered rows are shown until it arrives
+      this.dataVersion += 1;
+      this.window = {start: 0, rows: []};
+      this.update();
+      return;
+    }
+
+    let rows = this.window.rows.slice(0, delta.length);
+    for (let [i, row] of delta.rows) {
+      rows[i] = row;
+    }
+    this.window = {start: this.window.start, rows: rows};
+    this.update();
+  }
+
+  /**
+   * Drop the received rows and request the rows of the current viewport again
+   */
+  reload() {
+    this.dataVersion += 1;
+    this.window = {start: 0, rows: []};
+    this.update();
+  }
+
+  // browsers can't render elements that are taller than around 30M pixels
+  static maxHeight = 10000000;
+}
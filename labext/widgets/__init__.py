@@ -1,7 +1,38 @@
-from .selection import *
-from .hideable_button import *
-from .button import *
-from .icon import *
-from .html import *
-from .data_table import *
-from .checkbox import *
+from typing import TYPE_CHECKING
+
+from labext.helpers import lazy_attrs
+
+if TYPE_CHECKING:
+    from .selection import Selection
+    from .hideable_button import HideableButton
+    from .button import Button, HTMLButton
+    from .icon import Icon
+    from .html import HTML
+    from .data_table import DataTable, ColumnFormat, ITable, IAppendableTable, ITableDataFrame, ITableDataFrameView
+    from .checkbox import Checkbox
+    from .table_adapters import ITableArrow, ITableParquet, ITableSQLite, ITableCSV
+
+
+# widgets are imported on first access to keep `import labext.prelude` cheap
+LAZY_ATTRS = {
+    "Selection": (".selection", "Selection"),
+    "HideableButton": (".hideable_button", "HideableButton"),
+    "Button": (".button", "Button"),
+    "HTMLButton": (".button", "HTMLButton"),
+    "Icon": (".icon", "Icon"),
+    "HTML": (".html", "HTML"),
+    "DataTable": (".data_table", "DataTable"),
+    "ColumnFormat": (".data_table", "ColumnFormat"),
+    "ITable": (".data_table", "ITable"),
+    "IAppendableTable": (".data_table", "IAppendableTable"),
+    "ITableDataFrame": (".data_table", "ITableDataFrame"),
+    "ITableDataFrameView": (".data_table", "ITableDataFrameView"),
+    "Checkbox": (".checkbox", "Checkbox"),
+    "ITableArrow": (".table_adapters", "ITableArrow"),
+    "ITableParquet": (".table_adapters", "ITableParquet"),
+    "ITableSQLite": (".table_adapters", "ITableSQLite"),
+    "ITableCSV": (".table_adapters", "ITableCSV"),
+}
+__getattr__, __dir__ = lazy_attrs(__name__, LAZY_ATTRS)
+# star-imports export the lazy attributes (they are imported then)
+__all__ = list(LAZY_ATTRS.keys())
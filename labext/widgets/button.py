@@ -60,21 +60,35 @@ class HTMLButton(WidgetWrapper):
         self.btn_id = "btn-" + str(uuid4())
         self.btn_cls = btn.get_attr("class", "")
         btn.attr(htmlClass=self.btn_cls + f" {self.btn_id}",
-                 onclick=f"window.IPyCallback.get('{LabExt.tunnel.tunnel_id}').send_msg(JSON.stringify({{ receiver: '{self.btn_id}', content: {{ type: 'click' }} }}));")
+                 onclick=f"window.IPyCallback.get('{LabExt.tunnel_id}').send_msg(JSON.stringify({{ receiver: '{self.btn_id}', content: {{ type: 'click' }} }}));")
 
         self.btn = btn
+        # the tree that is currently rendered in the browser, used to send only the changes when the button is refreshed
+        self.rendered = btn.copy()
         self.el_btn = widgets.HTML(btn.value())
         self.metadata = metadata or {}
         self.on_click_callback = None
 
-        LabExt.add_listener(self.btn_id, self.on_js_event)
+        LabExt.add_listener(self.btn_id, self.on_js_event, owner=self.el_btn)
 
     @property
     def widget(self):
         return self.el_btn
 
     def refresh_button(self):
-        self.el_btn.value = self.btn.value()
+        """Update the button in the browser after `self.btn` is modified. Only the attributes, classes, styles and text
+        that change are sent, so that the element (and its focus, tooltips, etc.) is kept. The whole HTML is sent when
+        the structure of the button changes"""
+        patches = self.rendered.diff(self.btn)
+        html = self.btn.value()
+        if patches is None:
+            self.el_btn.value = html
+        elif len(patches) > 0:
+            LabExt.patch("." + self.btn_id, patches)
+            # keep the value of the widget in sync without sending it to the browser, which would re-render the button
+            with self.el_btn._lock_property(value=html):
+                self.el_btn.value = html
+        self.rendered = self.btn.copy()
 
     def on_click(self, callback: Callable[['HTMLButton'], None]):
         """Register for on click event"""
@@ -1,8 +1,6 @@
 from typing import Callable
 from uuid import uuid4
 
-import ujson
-
 from labext.modules import LabExt
 from labext.tag import Tag
 from labext.widget import WidgetWrapper
@@ -17,16 +15,18 @@ class Checkbox(WidgetWrapper):
             id=self.el_id,
             type="checkbox",
             **(attrs or {}),
-            onchange=f"window.IPyCallback.get('{LabExt.tunnel.tunnel_id}').send_msg(JSON.stringify({{ receiver: '{self.el_id}', content: {{ value: event.target.checked }} }}));")
+            onchange=f"window.IPyCallback.get('{LabExt.tunnel_id}').send_msg(JSON.stringify({{ receiver: '{self.el_id}', content: {{ value: event.target.checked }} }}));")
         self.value = value
         if value:
             self.checkbox.attr(checked="1")
 
+        # the tree that is currently rendered in the browser
+        self.rendered = self.checkbox.copy()
         self.el = widgets.HTML(self.checkbox.value())
         self.metadata = metadata or {}
         self.on_change_callback = None
 
-        LabExt.add_listener(self.el_id, self.on_js_event)
+        LabExt.add_listener(self.el_id, self.on_js_event, owner=self.el)
 
     @property
     def widget(self):
@@ -34,15 +34,26 @@ class Checkbox(WidgetWrapper):
 
     def check(self):
         self.value = True
-        LabExt.tunnel.send_msg(ujson.dumps({
-            "fn": f"document.getElementById('{self.el_id}').checked = true;"
-        }))
+        self.checkbox.attr(checked="1")
+        self.refresh()
 
     def uncheck(self):
         self.value = False
-        LabExt.tunnel.send_msg(ujson.dumps({
-            "fn": f"document.getElementById('{self.el_id}').checked = false;"
-        }))
+        self.checkbox.attr(checked=None)
+        self.refresh()
+
+    def refresh(self):
+        """Update the checkbox in the browser after `self.checkbox` is modified by sending only the changes"""
+        patches = self.rendered.diff(self.checkbox)
+        html = self.checkbox.value()
+        if patches is None:
+            self.el.value = html
+        elif len(patches) > 0:
+            LabExt.patch("#" + self.el_id, patches)
+            # keep the value of the widget in sync without sending it to the browser, which would re-render the checkbox
+            with self.el._lock_property(value=html):
+                self.el.value = html
+        self.rendered = self.checkbox.copy()
 
     def on_change(self, callback: Callable[['Checkbox'], None]):
         """Register for on click event"""
@@ -52,4 +63,11 @@ class Checkbox(WidgetWrapper):
     def on_js_event(self, _version: int, event: dict):
         """Handle the event that the JS fire"""
         self.value = event['value']
-        self.on_change_callback(self)
\ No newline at end of file
+        # the browser already has the new state
+        self.checkbox.attr(checked="1" if self.value else None)
+        self.rendered.attr(checked="1" if self.value else None)
+        html = self.checkbox.value()
+        with self.el._lock_property(value=html):
+            self.el.value = html
+        if self.on_change_callback is not None:
+            self.on_change_callback(self)
\ No newline at end of file
@@ -1,20 +1,24 @@
+import asyncio
 import os
+import re
+import threading
 from abc import abstractmethod, ABC
+from collections import OrderedDict
 from pathlib import Path
 from string import Template
-from typing import Type, List, TYPE_CHECKING, Optional, Callable, Union
+from typing import Type, List, TYPE_CHECKING, Optional, Callable, Union, Tuple, Dict
 from uuid import uuid4
 
 import ipywidgets.widgets as widgets
 import ujson
-from IPython.core.display import Javascript, display
-from ipycallback import SlowTunnelWidget
+from IPython.core.display import Javascript
 
 if TYPE_CHECKING:
     # do this because pandas is optional
-    from pandas import DataFrame
+    from pandas import DataFrame, Series
+    from numpy import ndarray
 
-from labext.helpers import noarg_func, read_file, identity_func
+from labext.helpers import noarg_func, read_file, identity_func, on_widget_close
 from labext.widget import WidgetWrapper
 import labext.modules as M
 
@@ -37,23 +41,560 @@ class ITable(ABC):
         """Get the records from row start to end"""
         pass
 
+    def get_rows_array(self, start: int, end: int) -> Optional['ndarray']:
+        """Get the records from row start to end as a 2D numpy array, which is sent to the client as binary buffers.
+        Return None if the records are not numeric"""
+        return None
+
+    def get_columns(self, start: int, end: int) -> List[Union[list, 'ndarray']]:
+        """Get the records from row start to end column by column. Numeric columns can be numpy arrays, which are sent
+        to the client as binary buffers when they are large enough"""
+        return [list(column) for column in zip(*self.get_rows(start, end))]
+
+    def get_column(self, col: int, start: int, end: int) -> 'Series':
+        """Get the values of a column from row start to end as a series, which is passed to the formatter of the column
+        (see `DataTable.set_formatter`)"""
+        import pandas as pd
+        return pd.Series(column_to_list(self.get_columns(start, end)[col]))
+
+    def sort(self, order: List[Tuple[int, bool]]) -> Optional['ITable']:
+        """Get a view of the table that is sorted by the columns, which is used to serve the pages when users sort the
+        table. Return None if the table can't be sorted (sorting is disabled in the client)
+
+        Parameters
+        ----------
+        order: List[Tuple[int, bool]]
+            list of (index of the column, ascending), the first column is the primary key
+        """
+        return None
+
+    def filter(self, search: str, column_search: Dict[int, str],
+               columns: Optional[List[int]] = None) -> Optional['ITable']:
+        """Get a view of the records that match the search, which is used to serve the pages when users search the
+        table. Return None if the table can't be searched (searching is disabled in the client)
+
+        Parameters
+        ----------
+        search: str
+            value of the search box, a record matches if each word (or quoted phrase) is in one of its columns
+        column_search: Dict[int, str]
+            index of the column => search value of the column, a record matches if each word is in the column
+        columns: Optional[List[int]]
+            columns that the search box looks into, default is all columns
+        """
+        return None
+
+    def invalidate(self):
+        """Clear the cached data (e.g., sort indexes) of the table, called when the data is changed (see
+        `DataTable.redraw`)"""
+        pass
+
+
+class IAppendableTable(ITable):
+    """A table whose records can be appended, updated and deleted while it is displayed (see `DataTable.append_rows`).
+    Records are identified by ids, which don't change when other records are deleted"""
+
+    @abstractmethod
+    def append_rows(self, rows: List[list]) -> list:
+        """Append records to the end of the table, return their ids"""
+        pass
+
+    @abstractmethod
+    def update_rows(self, ids: list, rows: List[list]):
+        """Replace the records of the ids, ids that don't exist are ignored"""
+        pass
+
+    @abstractmethod
+    def delete_rows(self, ids: list):
+        """Delete the records of the ids, ids that don't exist are ignored"""
+        pass
+
+
+class ITableDataFrame(IAppendableTable):
+    """A table of a data frame. Ids of the records are the labels of the index of the data frame, appended records get
+    the next integers. Changes are applied to a copy of the data frame, the data frame of users is not modified"""
+
+    # maximum number of sort indexes of multiple columns, search results and views that are cached
+    max_cached_orders = 8
+    max_cached_searches = 16
+    max_cached_views = 16
 
-class ITableDataFrame(ITable):
     def __init__(self, df: 'DataFrame'):
         self.df = df
+        # changes that haven't been applied to the data frame: list of (append | update | delete, ids, rows)
+        self.changes = []
+        self.changes_lock = threading.Lock()
+        self.next_id: Optional[int] = None
+        # (column, ascending) => positions of the rows in sorted order, multiple columns are keyed by a tuple of them
+        self.sort_indexes = OrderedDict()
+        # search key (see `search_key`) => positions of the matched rows in ascending order
+        self.search_results = OrderedDict()
+        # (search key, order) => positions of the rows of the view
+        self.views = OrderedDict()
+        # column => lower-case text of the values, which is used for searching
+        self.texts: Dict[int, 'Series'] = {}
+        # columns that have token indexes (see `build_search_index`), the indexes are built on demand
+        self.indexed_columns = set()
+        self.search_indexes: Dict[int, TextIndex] = {}
+        self.lock = threading.RLock()
 
     def columns(self) -> List[str]:
         return self.df.columns
 
     def size(self) -> int:
+        self.apply_changes()
         return len(self.df.index)
 
     def get_rows(self, start: int, end: int) -> List[list]:
-        return self.df[start:end].values.tolist()
+        return columns_to_rows(self.get_columns(start, end))
+
+    def get_rows_array(self, start: int, end: int) -> Optional['ndarray']:
+        self.apply_changes()
+        if not self.is_numeric():
+            return None
+        return self.df.iloc[start:end].to_numpy()
+
+    def get_columns(self, start: int, end: int) -> List[Union[list, 'ndarray']]:
+        self.apply_changes()
+        return serialize_frame(self.df.iloc[start:end])
+
+    def get_column(self, col: int, start: int, end: int) -> 'Series':
+        self.apply_changes()
+        return self.df.iloc[start:end, col]
+
+    def append_rows(self, rows: List[list]) -> list:
+        with self.changes_lock:
+            if self.next_id is None:
+                import pandas as pd
+                index = self.df.index
+                self.next_id = int(index.max()) + 1 if pd.api.types.is_integer_dtype(index) and len(index) > 0 \
+                    else len(index)
+            ids = list(range(self.next_id, self.next_id + len(rows)))
+            self.next_id += len(rows)
+            self.changes.append(("append", ids, list(rows)))
+        return ids
+
+    def update_rows(self, ids: list, rows: List[list]):
+        assert len(ids) == len(rows)
+        with self.changes_lock:
+            self.changes.append(("update", list(ids), list(rows)))
+
+    def delete_rows(self, ids: list):
+        with self.changes_lock:
+            self.changes.append(("delete", list(ids), None))
+
+    def apply_changes(self):
+        """Apply the changes to the data frame. Changes are buffered until the table is read, so a burst of changes
+        (e.g., a record is appended every millisecond) only copies the data frame once"""
+        if len(self.changes) == 0:
+            return
+
+        import pandas as pd
+        with self.lock:
+            with self.changes_lock:
+                changes, self.changes = self.changes, []
+            if len(changes) == 0:
+                return
+
+            df = self.df
+            # the data frame is copied before it is modified in place, as it is shared with users and the views
+            copied = False
+            appended = []
+            for op, ids, rows in changes:
+                if op == "append":
+                    appended.append(pd.DataFrame(rows, columns=df.columns, index=ids))
+                    continue
+                if len(appended) > 0:
+                    df = pd.concat([df] + appended) if len(df.index) > 0 else pd.concat(appended)
+                    appended = []
+                    copied = True
+                if op == "update":
+                    exists = df.index.isin(ids)
+                    if not exists.any():
+                        continue
+                    if not copied:
+                        df = df.copy()
+                        copied = True
+                    values = pd.DataFrame(rows, columns=df.columns, index=ids)
+                    values = values[~values.index.duplicated(keep="last")]
+                    df.loc[exists] = values.loc[df.index[exists]].to_numpy()
+                else:
+                    df = df.drop(index=ids, errors="ignore")
+                    copied = True
+            if len(appended) > 0:
+                df = pd.concat([df] + appended) if len(df.index) > 0 else pd.concat(appended)
+
+            self.df = df
+            self.invalidate()
+
+    def is_numeric(self) -> bool:
+        import numpy as np
+        kinds = {dtype.kind if isinstance(dtype, np.dtype) else "O" for dtype in self.df.dtypes}
+        return len(kinds) > 0 and (kinds.issubset("iuf") or kinds == {"b"})
+
+    def sort(self, order: List[Tuple[int, bool]]) -> Optional['ITable']:
+        return self.get_view(order, None)
+
+    def filter(self, search: str, column_search: Dict[int, str],
+               columns: Optional[List[int]] = None) -> Optional['ITable']:
+        return self.get_view([], search_key(search, column_search, columns))
+
+    def get_view(self, order: List[Tuple[int, bool]], search: Optional[tuple]) -> ITable:
+        """Get the view of the rows that match the search (see `search_key`) in the sorted order"""
+        order = tuple((int(col), bool(asc)) for col, asc in order)
+        if len(order) == 0 and search is None:
+            return self
+
+        import numpy as np
+        key = (search, order)
+        self.apply_changes()
+        with self.lock:
+            index = self.views.get(key)
+            if index is not None:
+                self.views.move_to_end(key)
+            else:
+                rows = self.get_search_result(search) if search is not None else None
+                if len(order) == 0:
+                    index = rows
+                else:
+                    index = self.get_sort_index(order)
+                    if rows is not None:
+                        # keep the sorted order of the matched rows
+                        matched = np.zeros(len(self.df.index), dtype=np.bool_)
+                        matched[rows] = True
+                        index = index[matched[index]]
+                self.views[key] = index
+                if len(self.views) > self.max_cached_views:
+                    self.views.popitem(last=False)
+            return ITableDataFrameView(self, index, order, search)
+
+    def get_sort_index(self, order: List[Tuple[int, bool]]) -> 'ndarray':
+        """Get the positions of the rows in the sorted order. Indexes are computed once and reused by every page, so
+        only the first page of a new order pays for the sorting"""
+        key = tuple((int(col), bool(asc)) for col, asc in order)
+        if len(key) == 1:
+            key = key[0]
+
+        with self.lock:
+            index = self.sort_indexes.get(key)
+            if index is not None:
+                self.sort_indexes.move_to_end(key)
+                return index
+
+            # stable sort so that rows of the same values keep their order, missing values are always at the end
+            frame = self.df.iloc[:, [col for col, _ in order]]
+            frame = frame.set_axis(list(range(len(order))), axis=1).reset_index(drop=True)
+            index = frame.sort_values(by=list(range(len(order))), ascending=[asc for _, asc in order],
+                                      kind="stable", na_position="last").index.to_numpy()
+
+            self.sort_indexes[key] = index
+            # indexes of single columns are kept as there are not many of them
+            multi_columns = [k for k in self.sort_indexes.keys() if isinstance(k[0], tuple)]
+            for k in multi_columns[:max(0, len(multi_columns) - self.max_cached_orders)]:
+                del self.sort_indexes[k]
+            return index
+
+    def get_search_result(self, key: tuple) -> 'ndarray':
+        """Get the positions of the rows that match the search (see `search_key`). When users type in the search box,
+        the new search only scans the rows that match the previous one"""
+        import numpy as np
+        search, column_search, columns = key
+        with self.lock:
+            rows = self.search_results.get(key)
+            if rows is not None:
+                self.search_results.move_to_end(key)
+                return rows
+
+            rows = None
+            for prev_key, prev_rows in self.search_results.items():
+                if is_refined_search(prev_key, key) and (rows is None or len(prev_rows) < len(rows)):
+                    rows = prev_rows
+            if rows is None:
+                rows = np.arange(len(self.df.index))
+
+            if columns is None:
+                columns = range(len(self.df.columns))
+            for word in parse_search(search):
+                rows = rows[self.match(rows, word, columns)]
+            for col, value in column_search:
+                for word in parse_search(value):
+                    rows = rows[self.match(rows, word, [col])]
+
+            self.search_results[key] = rows
+            if len(self.search_results) > self.max_cached_searches:
+                self.search_results.popitem(last=False)
+            return rows
+
+    def match(self, rows: 'ndarray', word: str, columns: List[int]) -> 'ndarray':
+        """Test if any of the columns of the rows contain the word"""
+        import numpy as np
+        matched = np.zeros(len(rows), dtype=np.bool_)
+        for col in columns:
+            if len(rows) == 0:
+                break
+            index = self.get_search_index(col)
+            if index is not None and index.can_lookup(word):
+                matched |= index.lookup(word)[rows]
+                continue
+
+            texts = self.get_texts(col)
+            if len(rows) < len(texts):
+                texts = texts.iloc[rows]
+            matched |= texts.str.contains(word, regex=False).to_numpy(dtype=np.bool_)
+        return matched
+
+    def get_texts(self, col: int) -> 'Series':
+        texts = self.texts.get(col)
+        if texts is None:
+            values = self.df.iloc[:, col].reset_index(drop=True)
+            texts = values.astype(str)
+            if values.dtype.kind not in "iufb":
+                # text of numbers is already in lower case
+                texts = texts.str.lower()
+            texts[values.isna().to_numpy()] = ""
+            self.texts[col] = texts
+        return texts
+
+    def get_search_index(self, col: int) -> Optional['TextIndex']:
+        if col not in self.indexed_columns:
+            return None
+        index = self.search_indexes.get(col)
+        if index is None:
+            index = TextIndex(self.get_texts(col))
+            self.search_indexes[col] = index
+        return index
+
+    def build_search_index(self, columns: Optional[List[int]] = None):
+        """Build token indexes of text columns to search them without scanning. With an index, a word of a search
+        matches a value of the column if it is a prefix of a word of the value (instead of a substring of the value),
+        which is how most search boxes work
+
+        Parameters
+        ----------
+        columns: Optional[List[int]]
+            the columns to index, default is columns of strings (object or categorical dtypes)
+        """
+        import numpy as np
+        if columns is None:
+            columns = [i for i, dtype in enumerate(self.df.dtypes)
+                       if not isinstance(dtype, np.dtype) or dtype.kind in "OSU"]
+        with self.lock:
+            self.indexed_columns.update(columns)
+            for col in columns:
+                self.get_search_index(col)
+
+    def invalidate(self):
+        with self.lock:
+            self.sort_indexes.clear()
+            self.search_results.clear()
+            self.views.clear()
+            self.texts.clear()
+            self.search_indexes.clear()
+
+
+class ITableDataFrameView(ITable):
+    """A view of the rows of `ITableDataFrame` (e.g., the rows that match a search in a sorted order)"""
+
+    def __init__(self, table: ITableDataFrame, index: 'ndarray', order: tuple = (), search: Optional[tuple] = None):
+        self.table = table
+        # the positions are of this data frame, the data frame of the table is replaced when it is changed
+        self.df = table.df
+        # positions of the rows in the data frame
+        self.index = index
+        self.order = order
+        self.search = search
+
+    def columns(self) -> List[str]:
+        return self.table.columns()
+
+    def size(self) -> int:
+        return len(self.index)
+
+    def get_rows(self, start: int, end: int) -> List[list]:
+        return columns_to_rows(self.get_columns(start, end))
+
+    def get_rows_array(self, start: int, end: int) -> Optional['ndarray']:
+        if not self.table.is_numeric():
+            return None
+        return self.df.iloc[self.index[start:end]].to_numpy()
+
+    def get_columns(self, start: int, end: int) -> List[Union[list, 'ndarray']]:
+        return serialize_frame(self.df.iloc[self.index[start:end]])
+
+    def get_column(self, col: int, start: int, end: int) -> 'Series':
+        return self.df.iloc[self.index[start:end], col]
+
+    def sort(self, order: List[Tuple[int, bool]]) -> Optional['ITable']:
+        return self.table.get_view(order, self.search)
+
+    def filter(self, search: str, column_search: Dict[int, str],
+               columns: Optional[List[int]] = None) -> Optional['ITable']:
+        return self.table.get_view(self.order, search_key(search, column_search, columns))
+
+    def invalidate(self):
+        self.table.invalidate()
+
+
+class TextIndex:
+    """An inverted index of the words (tokens) of a text column. The rows that have a word starting with a prefix are
+    found by a binary search over the sorted words instead of scanning the column"""
+
+    def __init__(self, texts: 'Series'):
+        import numpy as np
+        import pandas as pd
+
+        # texts must have a range index as the index of a token is the position of its row
+        tokens = texts.str.findall(r"\w+").explode().dropna()
+        codes, words = pd.factorize(tokens.to_numpy(), sort=True)
+        order = np.argsort(codes, kind="stable")
+        self.words = np.asarray(words, dtype=object)
+        # rows of the i-th word are rows[offsets[i]:offsets[i + 1]]
+        self.rows = tokens.index.to_numpy()[order]
+        self.offsets = np.searchsorted(codes[order], np.arange(len(self.words) + 1))
+        self.n_rows = len(texts)
+
+    def can_lookup(self, word: str) -> bool:
+        return re.fullmatch(r"\w+", word) is not None
+
+    def lookup(self, prefix: str) -> 'ndarray':
+        """Get a mask of the rows that have a word starting with the prefix"""
+        import numpy as np
+        lo = np.searchsorted(self.words, prefix, side="left")
+        hi = np.searchsorted(self.words, prefix + "\U0010ffff", side="left")
+        mask = np.zeros(self.n_rows, dtype=np.bool_)
+        mask[self.rows[self.offsets[lo]:self.offsets[hi]]] = True
+        return mask
+
+
+def serialize_frame(frame: 'DataFrame') -> List[Union[list, 'ndarray']]:
+    """Convert the columns of a data frame to values that can be sent to the client (see `serialize_column`)"""
+    return [serialize_column(frame.iloc[:, i]) for i in range(frame.shape[1])]
+
+
+def serialize_column(column: 'Series') -> Union[list, 'ndarray']:
+    """Convert a column to a list of JSON values (or a numeric numpy array) using a fast path of its dtype, so values
+    are not boxed into numpy/pandas objects: missing values are None, datetimes and timedeltas are formatted as
+    strings, and categories are converted once and looked up by their codes"""
+    import numpy as np
+    import pandas as pd
+
+    dtype = column.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        # the last item is for missing values (code -1)
+        lookup = np.empty(len(dtype.categories) + 1, dtype=object)
+        lookup[:-1] = column_to_list(serialize_column(pd.Series(dtype.categories)))
+        lookup[-1] = None
+        return lookup[column.cat.codes.to_numpy()].tolist()
+
+    if isinstance(dtype, np.dtype) and dtype.kind in "iufb":
+        # NaN is converted to null in the client
+        return column.to_numpy()
+    if dtype.kind in "mM":
+        values = column.astype(str).to_numpy(dtype=object)
+    elif isinstance(dtype, np.dtype) or isinstance(dtype, pd.StringDtype):
+        values = column.to_numpy(dtype=object)
+    else:
+        # extension types (e.g., nullable integers) are converted to objects
+        values = column.astype(object).to_numpy()
+
+    values = values.tolist()
+    for i in np.flatnonzero(column.isna().to_numpy()):
+        values[i] = None
+    if dtype.kind == "O":
+        for i, value in enumerate(values):
+            if not isinstance(value, (str, int, float, bool, type(None))):
+                values[i] = value.item() if isinstance(value, np.generic) else str(value)
+    return values
+
+
+def column_to_list(column: Union[list, 'ndarray']) -> list:
+    if isinstance(column, list):
+        return column
+    from labext.transport import to_json
+    return to_json(column)
+
+
+def columns_to_rows(columns: List[Union[list, 'ndarray']]) -> List[list]:
+    return [list(row) for row in zip(*[column_to_list(column) for column in columns])]
+
+
+def response_rows(resp: dict) -> List[list]:
+    """Get the rows of a response of `DataTable.query` as JSON values"""
+    if 'columns' in resp:
+        return columns_to_rows(resp['columns'])
+    return column_to_list(resp['data'])
+
+
+def search_key(search: str, column_search: Dict[int, str], columns: Optional[List[int]] = None) -> Optional[tuple]:
+    """Normalize a search to a hashable key, None if it doesn't filter any row"""
+    search = search.strip().lower()
+    column_search = tuple(sorted((int(col), value.strip().lower()) for col, value in column_search.items()
+                                 if value.strip() != ""))
+    if search == "" and len(column_search) == 0:
+        return None
+    return search, column_search, tuple(columns) if columns is not None and search != "" else None
+
+
+def parse_search(search: str) -> List[str]:
+    """Split a search into words, quoted phrases are kept as single words (same as the smart search of DataTables)"""
+    return [phrase or word for phrase, word in re.findall(r'"([^"]*)"|(\S+)', search) if (phrase or word) != ""]
+
+
+def is_refined_search(prev: tuple, new: tuple) -> bool:
+    """Test if rows that match the new search also match the previous search, e.g., users type more characters"""
+    def is_prefix(a: str, b: str):
+        return b.startswith(a) and '"' not in b
+
+    if prev[2] != new[2] or not is_prefix(prev[0], new[0]):
+        return False
+    new_column_search = dict(new[1])
+    return all(col in new_column_search and is_prefix(value, new_column_search[col]) for col, value in prev[1])
+
+
+class ColumnFormat:
+    """Formats of columns that are applied by the client, so the values are sent as they are and formatting them costs
+    nothing in the server (see the `formatters` parameter of `DataTable`).
+
+    Example:
+        >>> DataTable(df, formatters={"price": ColumnFormat.number(2, prefix="$"), "progress": ColumnFormat.bar(0, 100)})
+    """
+
+    @staticmethod
+    def number(decimals: Optional[int] = None, grouping: bool = True, prefix: str = "", suffix: str = "",
+               locale: Optional[str] = None) -> dict:
+        """Format numbers with a fixed number of decimals (default is as many as needed) and thousands separators of
+        the locale (default is the locale of the browser)"""
+        return {"type": "number", "decimals": decimals, "grouping": grouping, "prefix": prefix, "suffix": suffix,
+                "locale": locale}
+
+    @staticmethod
+    def date(format: str = "YYYY-MM-DD HH:mm:ss") -> dict:
+        """Format datetimes (or milliseconds since epoch), the tokens of the format are YYYY, MM, DD, HH, mm and ss"""
+        return {"type": "date", "format": format}
+
+    @staticmethod
+    def link(href: str = "{}", text: str = "{}", new_tab: bool = True) -> dict:
+        """Show values as links, `{}` in the href and the text are replaced by the value (it is URL-encoded in the
+        href unless the href is the value itself)"""
+        return {"type": "link", "href": href, "text": text, "newTab": new_tab}
+
+    @staticmethod
+    def bar(min: float = 0.0, max: float = 1.0, color: str = "#c6dbef", decimals: Optional[int] = None) -> dict:
+        """Show numbers in bars whose widths are proportional to the values within [min, max]"""
+        return {"type": "bar", "min": min, "max": max, "color": color, "decimals": decimals}
 
 
 class DataTable(WidgetWrapper):
-    def __init__(self, tbl: Union['DataFrame', ITable], table_class: str= 'display', columns: Optional[Union[dict, List[dict]]]=None, table_id: Optional[str]=None, **kwargs):
+    # number of rows that are formatted at once by the formatters of the columns, and maximum number of those chunks
+    # that are cached (see `DataTable.format_column`)
+    format_chunk_size = 256
+    max_cached_formats = 256
+
+    def __init__(self, tbl: Union['DataFrame', ITable], table_class: str= 'display', columns: Optional[Union[dict, List[dict]]]=None, table_id: Optional[str]=None,
+                 cache_pages: int = 1, cache_size: int = 16, prefetch: bool = True, scroller: bool = False,
+                 scroll_height: int = 400, row_height: int = 26, update_interval: float = 0.2,
+                 formatters: Optional[Dict[Union[int, str], Union[Callable[['Series'], List[str]], dict]]] = None,
+                 **kwargs):
         """Show the
 
         Parameters
@@ -67,6 +608,26 @@ class DataTable(WidgetWrapper):
         table_id: Optional[str]
             id of the table, manually giving the table an id helps reducing number of instances in the client
             as we store this data table in the client side to reduce the
+        cache_pages: int
+            number of pages that the client fetches per request, the extra pages are cached so that users can flip
+            through them without going to the server
+        cache_size: int
+            maximum number of requests (of `cache_pages` pages) that the client caches, 0 to disable the cache
+        prefetch: bool
+            prepare the next request (the following pages) in the server while users are reading the current one
+        scroller: bool
+            show the rows in a scrollable viewport instead of pages. Only the rows around the viewport are requested
+            and rendered, so users can scroll through millions of rows. Options of the DataTable plugin (`kwargs`) are
+            not used in this mode except `ordering`
+        scroll_height: int
+            height of the viewport in pixels (scroller mode)
+        row_height: int
+            height of every row in pixels (scroller mode)
+        update_interval: float
+            minimum seconds between two updates of the client when the records are changed (see `append_rows`)
+        formatters: Optional[Dict[Union[int, str], Union[Callable[[Series], List[str]], dict]]]
+            formats of the columns (name or position of the column => format): a function that formats the values in the
+            server (see `set_formatter`), or a format that is applied by the client (see `ColumnFormat`)
         kwargs
             see the [examples](https://datatables.net/examples/index) and the [options](https://datatables.net/manual/options)
             the options will be passed directly to the client
@@ -77,7 +638,8 @@ class DataTable(WidgetWrapper):
         else:
             self.table = tbl
         self.table_class = table_class
-        base_defs = [{"title": name} for name in self.table.columns()]
+        # missing values (null) are shown as empty cells
+        base_defs = [{"title": name, "defaultContent": ""} for name in self.table.columns()]
         if columns is not None:
             if isinstance(columns, list):
                 assert len(columns) == len(base_defs)
@@ -89,12 +651,42 @@ class DataTable(WidgetWrapper):
                 for i in range(len(base_defs)):
                     base_defs[i].update(columns)
         self.columns = base_defs
+        # column => function that formats the values of the column in the server, see `set_formatter`
+        self.formatters: Dict[int, Callable[['Series'], List[str]]] = {}
+        # (data version, query, column, chunk) => formatted values of the chunk, see `format_column`
+        self.formatted = OrderedDict()
+        self.formatted_lock = threading.Lock()
+        for column, formatter in (formatters or {}).items():
+            if isinstance(formatter, dict):
+                self.columns[self.column_index(column)]['labextFormat'] = formatter
+            else:
+                self.formatters[self.column_index(column)] = formatter
 
         self.table_id = table_id or str(uuid4())
         self.options = kwargs
+        self.cache = {"pages": max(1, cache_pages), "size": cache_size}
+        self.prefetch = prefetch
+        self.scroller = {"height": scroll_height, "rowHeight": row_height} if scroller else None
+        # responses that are prepared in advance: JSON of the query => response, see `DataTable.prefetch_query`
+        self.prefetched = OrderedDict()
+        self.prefetched_lock = threading.Lock()
+        # incremented when the data is changed so that pages of the old data are not cached
+        self.data_version = 0
+        # the last query that is served and its response, changes of the records are sent relative to them
+        self.last_served: Optional[Tuple[dict, dict]] = None
+        self.update_interval = update_interval
+        self.update_timer: Optional[threading.Timer] = None
+        self.update_lock = threading.Lock()
+        # the rows are in their original order until users sort the table
+        self.options.setdefault("order", [])
+        if type(self.table).sort is ITable.sort:
+            self.options.setdefault("ordering", False)
+        if type(self.table).filter is ITable.filter:
+            self.options.setdefault("searching", False)
 
-        self.tunnel = SlowTunnelWidget(tunnel_id=self.table_id)
+        self.tunnel = M.Route(self.table_id)
         self.tunnel.on_receive(self.on_receive_updates)
+        self.tunnel.on_request(self.on_receive_query)
         self.el = widgets.HTML(value="")
         self.el_class_id = f"DataTable_{self.el.model_id}"
         self.el.add_class(self.el_class_id)
@@ -105,15 +697,12 @@ class DataTable(WidgetWrapper):
 
         jscode += Template("""
             require(['$JQueryId'], function (jquery) {
-                $CallUntilTrue(function () {
-                    if (window.IPyCallback === undefined || window.IPyCallback.get("$tunnelId") === undefined) {
-                        return false;
-                    }
-                    
+                let container = window.$container;
+                Promise.all([
+                    container.channel.open("$tunnelId"),
+                    container.ready.element(".$containerClassId > div.widget-html-content")
+                ]).then(([tunnel, _el]) => {
                     let el = jquery(".$containerClassId > div.widget-html-content");
-                    if (el.length === 0) {
-                        return false;
-                    }
                     
                     // fix the issue of horizontal scrolling (the size goes beyond the border as jupyter set overflow
                     // to be visible)
@@ -126,7 +715,7 @@ class DataTable(WidgetWrapper):
                     //     jp-OutputArea-child
                     //     jp-OutputArea-output *
                     let ptr = el;
-                    while (!ptr.parent().hasClass("jp-Cell-outputArea")) {
+                    while (ptr.length > 0 && !ptr.parent().hasClass("jp-Cell-outputArea")) {
                         ptr.css('overflow-x', 'auto');
                         ptr.css('margin', '0px');
                         ptr = ptr.parent();
@@ -136,31 +725,43 @@ class DataTable(WidgetWrapper):
                         window.$container.DataTable = new Map();
                     }
                     
-                    let tunnel = window.IPyCallback.get("$tunnelId");
                     let model = new LabExtDataTable(
                         jquery, el, tunnel,
-                        $columns, "$table_class", $options
+                        $columns, "$table_class", $options, $cache, $scroller
                     );
                     model.render();
                     window.$container.DataTable.set("$tableId", model);
-                    return true;
-                }, 100);
+                    // release the table when its element is removed from the page, the table in the kernel is kept
+                    // so that the widget can be displayed again
+                    model.dispose = container.registry.track(el[0], () => {
+                        model.destroy();
+                        if (container.DataTable.get("$tableId") === model) {
+                            container.DataTable.delete("$tableId");
+                        }
+                        tunnel.detach();
+                    });
+                });
             });
-        """.strip()).substitute(JQueryId=M.JQuery.id(), CallUntilTrue=M.LabExt.call_until_true,
+        """.strip()).substitute(JQueryId=M.JQuery.id(),
                                 container=M.LabExt.container,
                                 containerClassId=self.el_class_id,
                                 tableId=self.table_id,
                                 tunnelId=self.tunnel.tunnel_id,
                                 columns=ujson.dumps(self.columns),
                                 table_class=self.table_class,
-                                options=ujson.dumps(self.options))
+                                options=ujson.dumps(self.options),
+                                cache=ujson.dumps(self.cache),
+                                scroller=ujson.dumps(self.scroller))
 
-        self.el_auxiliaries = [self.tunnel, Javascript(jscode)]
+        self.el_auxiliaries = [Javascript(jscode)]
         self.init_complete = False
         self.init_complete_callback = noarg_func
         self.on_draw_complete_callback = noarg_func
         self.on_redraw_complete_callback = noarg_func
         self.transform = identity_func
+        self.transform_columns = False
+        # release the table in the kernel and the browser when the widget is closed
+        on_widget_close(self.el, self.destroy)
 
     @property
     def widget(self):
@@ -174,15 +775,14 @@ class DataTable(WidgetWrapper):
         return self.el_auxiliaries
 
     def destroy(self):
-        jscode = Template("""
-                window.IPyCallback.delete("$tunnelId");
-                window.$container.DataTable.delete("$tableId");
-                """).substitute(
-            tableId=self.table_id,
-            tunnelId=self.tunnel.tunnel_id,
-            container=M.LabExt.container,
-        )
-        display(Javascript(jscode))
+        """Remove the table in the browser and stop serving its pages. Tables whose elements are removed from the page
+        (e.g., the output of the cell is cleared) are also removed from the browser automatically"""
+        with self.update_lock:
+            if self.update_timer is not None:
+                self.update_timer.cancel()
+                self.update_timer = None
+        self.tunnel.close()
+        M.LabExt.call("datatable.destroy", self.table_id)
 
     def on_init_complete(self, callback = None):
         self.init_complete_callback = callback or noarg_func
@@ -196,22 +796,189 @@ class DataTable(WidgetWrapper):
         self.on_redraw_complete_callback = callback
         return self
 
-    def set_transform_fn(self, transform: Callable[[list], list]):
+    def set_transform_fn(self, transform: Callable[[list], list], columnwise: bool = False):
+        """Set a function that transforms the records of a page before they are sent to the client. To format the
+        values of columns, `set_formatter` and `ColumnFormat` are much faster
+
+        Parameters
+        ----------
+        transform: Callable[[list], list]
+            the function, which receives the list of rows (each row is a list of values)
+        columnwise: bool
+            the function receives the list of columns instead (each column is a list of values, or a numpy array if
+            the column is numeric, see `ITable.get_columns`), so it can transform a column at once
+        """
         self.transform = transform
+        self.transform_columns = columnwise
+        self.clear_prefetched()
         return self
 
+    def set_formatter(self, column: Union[int, str], formatter: Optional[Callable[['Series'], List[str]]]):
+        """Set a function that formats the values of a column in the server. The function receives the values of a
+        range of rows as a series and returns their texts (or HTML), so it can format them at once, e.g.,
+        `lambda s: s.map("{:,.2f}".format)`. Formatted values are cached, so pages are not formatted again when users
+        go back to them. Formats that the client can apply are set by the `formatters` parameter (see `ColumnFormat`)
+
+        Parameters
+        ----------
+        column: Union[int, str]
+            name or position of the column
+        formatter: Optional[Callable[[Series], List[str]]]
+            the function, None to remove the formatter of the column
+        """
+        col = self.column_index(column)
+        if formatter is None:
+            self.formatters.pop(col, None)
+        else:
+            self.formatters[col] = formatter
+        self.clear_prefetched()
+        return self
+
+    def column_index(self, column: Union[int, str]) -> int:
+        """Get the position of a column by its name, an integer is a position unless it is a name of the columns
+        (e.g., data frames whose columns are labelled by integers)"""
+        names = list(self.table.columns())
+        if column in names:
+            return names.index(column)
+        if isinstance(column, int) and 0 <= column < len(names):
+            return column
+        raise ValueError(f"Column {column} doesn't exist")
+
+    def on_receive_query(self, version: int, msg: str) -> dict:
+        """Handle a request of a page from the client, it runs in the thread pool if `LabExt.set_executor` is called"""
+        msg = ujson.loads(msg)['msg']
+        key = ujson.dumps(msg, sort_keys=True)
+        with self.prefetched_lock:
+            resp = self.prefetched.pop(key, None)
+        if resp is None:
+            resp = self.query(msg, lambda: self.tunnel.is_superseded(version))
+            if resp is None:
+                # users have moved to another page
+                return None
+        with self.update_lock:
+            self.last_served = (msg, resp)
+        if self.prefetch and msg['length'] > 0 and msg['start'] + msg['length'] < resp['recordsFiltered']:
+            self.prefetch_query({**msg, "start": msg['start'] + msg['length']})
+        return resp
+
+    def query(self, msg: dict, is_superseded: Optional[Callable[[], bool]] = None) -> Optional[dict]:
+        """Get the rows of a query of the client. Return None if the query is superseded by a newer one before the
+        rows are read"""
+        table = self.table
+        n_records = table.size()
+        search = msg.get('search', "")
+        column_search = {col: value for col, value in msg.get('column_search', []) if value != ""}
+        if search != "" or len(column_search) > 0:
+            table = table.filter(search, column_search, msg.get('searchable')) or table
+        order = [(col, direction == "asc") for col, direction in msg.get('order', [])]
+        if len(order) > 0:
+            table = table.sort(order) or table
+        if is_superseded is not None and is_superseded():
+            return None
+
+        start = msg['start']
+        # length is -1 when users choose to show all rows
+        end = start + msg['length'] if msg['length'] >= 0 else table.size()
+        resp = {
+            "recordsTotal": n_records,
+            "recordsFiltered": table.size(),
+        }
+        if self.transform_columns or len(self.formatters) > 0:
+            columns = table.get_columns(start, end)
+            if len(self.formatters) > 0:
+                query = ujson.dumps([msg.get(k) for k in ["order", "search", "searchable", "column_search"]])
+                # the table may be changed in the meantime, the formatted values must align with the other columns
+                n_rows = len(columns[0]) if len(columns) > 0 else 0
+                for col in list(self.formatters.keys()):
+                    values = self.format_column(table, query, col, start, start + n_rows)
+                    # rows may be deleted after the page is read, they are shown correctly in the next update
+                    columns[col] = values[:n_rows] + [None] * (n_rows - len(values))
+            if self.transform_columns:
+                resp['columns'] = self.transform(columns)
+            elif self.transform is identity_func:
+                resp['columns'] = columns
+            else:
+                resp['data'] = self.transform(columns_to_rows(columns))
+            return resp
+
+        data = table.get_rows_array(start, end) if self.transform is identity_func else None
+        if data is not None:
+            resp['data'] = data
+        elif self.transform is identity_func:
+            # the client converts the columns to rows, which is cheaper than boxing every value of the page here
+            resp['columns'] = table.get_columns(start, end)
+        else:
+            resp['data'] = self.transform(table.get_rows(start, end))
+        return resp
+
+    def format_column(self, table: ITable, query: str, col: int, start: int, end: int) -> List[str]:
+        """Format the values of a column of the table (the view of a query) from row start to end. Values are formatted
+        by chunks of `format_chunk_size` rows, which are cached until the data is changed. The last chunk is not cached
+        if it isn't full, as rows may be appended to it"""
+        size = table.size()
+        end = min(end, size)
+        if end <= start:
+            return []
+
+        data_version = self.data_version
+        formatter = self.formatters[col]
+        first = start // self.format_chunk_size
+        values = []
+        for chunk in range(first, (end - 1) // self.format_chunk_size + 1):
+            key = (data_version, query, size, col, chunk)
+            with self.formatted_lock:
+                chunk_values = self.formatted.get(key)
+                if chunk_values is not None:
+                    self.formatted.move_to_end(key)
+            if chunk_values is None:
+                chunk_start = chunk * self.format_chunk_size
+                series = table.get_column(col, chunk_start, min(chunk_start + self.format_chunk_size, table.size()))
+                chunk_values = list(formatter(series))
+                assert len(chunk_values) == len(series), "The formatter must return a value for each row"
+                if len(chunk_values) == self.format_chunk_size:
+                    with self.formatted_lock:
+                        self.formatted[key] = chunk_values
+                        if len(self.formatted) > self.max_cached_formats:
+                            self.formatted.popitem(last=False)
+            values += chunk_values
+        offset = first * self.format_chunk_size
+        return values[start - offset:end - offset]
+
+    def prefetch_query(self, msg: dict):
+        """Prepare the response of a query in the background: in the thread pool of LabExt if it is set, otherwise in
+        the event loop of the kernel after the current response is sent"""
+        key = ujson.dumps(msg, sort_keys=True)
+        data_version = self.data_version
+
+        def run():
+            if key in self.prefetched:
+                return
+            resp = self.query(msg)
+            with self.prefetched_lock:
+                # the data may be changed while the response is prepared
+                if data_version == self.data_version:
+                    self.prefetched[key] = resp
+                    # only the latest queries are kept as users usually move forward
+                    while len(self.prefetched) > 2:
+                        self.prefetched.popitem(last=False)
+
+        if M.LabExt.executor is not None:
+            M.LabExt.submit(run)
+            return
+        try:
+            asyncio.get_running_loop().call_soon(run)
+        except RuntimeError:
+            # not running in an event loop, prefetching would block the response
+            pass
+
+    def clear_prefetched(self):
+        with self.prefetched_lock:
+            self.data_version += 1
+            self.prefetched.clear()
+
     def on_receive_updates(self, version: int, msg: str):
         msg = ujson.loads(msg)
-        if msg['type'] == 'query':
-            msg = msg['msg']
-            n_records = self.table.size()
-            resp = {
-                "recordsTotal": n_records,
-                "recordsFiltered": n_records,
-                "data":  self.transform(self.table.get_rows(msg['start'], msg['start']+msg['length']))
-            }
-            self.tunnel.send_msg_with_version(version, ujson.dumps(resp))
-        elif msg['type'] == 'status':
+        if msg['type'] == 'status':
             msg = msg['msg']
             if msg == 'init_done':
                 self.init_complete = True
@@ -224,6 +991,74 @@ class DataTable(WidgetWrapper):
             #     pass
 
     def redraw(self):
-        M.LabExt.tunnel.send_msg(ujson.dumps({
-            "fn": f"window.{M.LabExt.container}.DataTable.get('{self.table_id}').draw();"
-        }))
+        """Redraw the table after its data is changed, the cached pages in the client and the server are dropped"""
+        self.table.invalidate()
+        self.clear_prefetched()
+        M.LabExt.call("datatable.draw", self.table_id)
+
+    def append_rows(self, rows: List[list]) -> list:
+        """Append records to the table (it must be an `IAppendableTable`, e.g., a data frame) and return their ids.
+
+        The client is not redrawn: changes are coalesced and sent at most once every `update_interval` seconds, and
+        only the number of records and the rows of the current page that are changed are sent.
+
+        Example:
+            >>> ids = table.append_rows([[1, "a"], [2, "b"]])
+            >>> table.update_rows(ids[:1], [[1, "c"]])
+        """
+        assert isinstance(self.table, IAppendableTable), "The table must be an IAppendableTable"
+        ids = self.table.append_rows(rows)
+        self.schedule_update()
+        return ids
+
+    def update_rows(self, ids: list, rows: List[list]):
+        """Replace the records of the ids, see `append_rows`"""
+        assert isinstance(self.table, IAppendableTable), "The table must be an IAppendableTable"
+        self.table.update_rows(ids, rows)
+        self.schedule_update()
+
+    def delete_rows(self, ids: list):
+        """Delete the records of the ids, see `append_rows`"""
+        assert isinstance(self.table, IAppendableTable), "The table must be an IAppendableTable"
+        self.table.delete_rows(ids)
+        self.schedule_update()
+
+    def schedule_update(self):
+        """Send the changes of the records to the client after `update_interval` seconds, changes that are made in the
+        meantime are sent along with them"""
+        with self.update_lock:
+            if self.update_timer is not None:
+                return
+            self.update_timer = threading.Timer(self.update_interval, self.send_update)
+            self.update_timer.daemon = True
+            self.update_timer.start()
+
+    def send_update(self):
+        """Send the number of records and the rows of the last served query that are changed to the client, the client
+        re-queries the page if the changes add (or remove) rows to its page or the page isn't of the last query"""
+        with self.update_lock:
+            self.update_timer = None
+        self.clear_prefetched()
+        served = self.last_served
+        if served is None:
+            # the client hasn't shown any page
+            return
+
+        msg, prev_resp = served
+        resp = self.query(msg)
+        with self.update_lock:
+            # a newer query may have been served in the meantime
+            if self.last_served is served:
+                self.last_served = (msg, resp)
+
+        rows = response_rows(resp)
+        prev_rows = response_rows(prev_resp)
+        M.LabExt.call("datatable.delta", self.table_id, {
+            "query": {k: msg[k] for k in ["order", "search", "searchable", "column_search"] if k in msg},
+            "start": msg['start'],
+            "length": len(rows),
+            "recordsTotal": resp['recordsTotal'],
+            "recordsFiltered": resp['recordsFiltered'],
+            # list of [position in the query, row]
+            "rows": [[i, row] for i, row in enumerate(rows) if i >= len(prev_rows) or row != prev_rows[i]],
+        })
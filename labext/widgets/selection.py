@@ -1,12 +1,13 @@
+import asyncio
 from string import Template
 from typing import List, Callable, Optional
 
 import ipywidgets.widgets as widgets
 import ujson
 from IPython.core.display import Javascript
-from ipycallback import SlowTunnelWidget
 
-from labext.modules import JQuery, Selectize, LabExt
+from labext.helpers import on_widget_close
+from labext.modules import JQuery, Selectize, LabExt, Route
 from labext.widget import WidgetWrapper
 
 
@@ -38,20 +39,29 @@ class Selection(WidgetWrapper):
         self.allow_creation = allow_creation
         self.max_items = max_items or "null"
         self.on_change_callback = self.default_on_change_cb
+        self.pending_ops = []
+        self.is_frontend_initialized = False
 
-        self.el_search_tunnel = SlowTunnelWidget(tunnel_id=f"{self.el_root_id}_search")
-        self.el_value_tunnel = SlowTunnelWidget(tunnel_id=f"{self.el_root_id}_value")
+        self.el_search_tunnel = Route(f"{self.el_root_id}_search")
+        self.el_value_tunnel = Route(f"{self.el_root_id}_value")
         self.el_value_tunnel.on_receive(self.on_receive_updates)
 
         if self.search_fn is not None:
             assert len(
                 self.records
             ) == 0, "No need to pass the list of records when search function is provided"
-            self.records = self.search_fn("")
-            self.el_search_tunnel.on_receive(self._handle_search)
-
-        self.pending_ops = []
-        self.is_frontend_initialized = False
+            if asyncio.iscoroutinefunction(self.search_fn):
+                self.el_search_tunnel.on_request(self._handle_search_async)
+                try:
+                    asyncio.get_running_loop().create_task(self._load_default_options())
+                except RuntimeError:
+                    # not running in an event loop
+                    self.records = asyncio.run(self.search_fn(""))
+            else:
+                self.records = self.search_fn("")
+                self.el_search_tunnel.on_request(self._handle_search)
+
+        on_widget_close(self.el_root, self.destroy)
 
     @property
     def widget(self):
@@ -61,9 +71,19 @@ class Selection(WidgetWrapper):
     def required_modules():
         return [JQuery, Selectize, LabExt]
 
+    def destroy(self):
+        """Stop receiving messages from the browser, called when the widget is closed"""
+        self.el_value_tunnel.close()
+        self.el_search_tunnel.close()
+
     def _handle_search(self, version: int, query: str):
-        results = self.search_fn(query)
-        self.el_search_tunnel.send_msg_with_version(version, ujson.dumps(results))
+        return ujson.dumps(self.search_fn(query))
+
+    async def _handle_search_async(self, version: int, query: str):
+        return ujson.dumps(await self.search_fn(query))
+
+    async def _load_default_options(self):
+        self.replace_options(await self.search_fn(""))
 
     def on_receive_updates(self, version: int, msg: str):
         msg = ujson.loads(msg)
@@ -138,7 +158,7 @@ class Selection(WidgetWrapper):
             maxItems: $maxItems,
             items: $items,
             onChange: function (value) {
-                window.IPyCallback.get("$valueTunnel").send_msg(JSON.stringify({
+                valueTunnel.send_msg(JSON.stringify({
                     type: "set_value",
                     value: value
                 }));
@@ -155,23 +175,14 @@ class Selection(WidgetWrapper):
         if self.search_fn is not None:
             selectize_options += """
             load: function (query, callback) {
-                // send query
-                let version = window.IPyCallback.get("$searchTunnel").send_msg(query);
-
-                // register the callback to some where
-                window.IPyCallback.get("$searchTunnel").on_receive((return_version, result) => {
-                    if (return_version < version) {
-                        // ignore the response as it's too old
-                        return;
-                    }
-                    result = JSON.parse(result);
-                    callback(result);
+                // responses of the older queries are dropped
+                searchTunnel.request(query).then((result) => {
+                    callback(JSON.parse(result));
                 });
             }"""
 
         selectize_options = Template(selectize_options.strip()) \
-            .substitute(searchTunnel=self.el_search_tunnel.tunnel_id, valueTunnel=self.el_value_tunnel.tunnel_id,
-                        valueField=self.value_field, searchFields=ujson.dumps(self.search_fields),
+            .substitute(valueField=self.value_field, searchFields=ujson.dumps(self.search_fields),
                         itemField=self.item_field, optionField=self.option_field,
                         options=ujson.dumps(self.records),
                         items=ujson.dumps(self.value if isinstance(self.value, list) else [self.value]),
@@ -180,12 +191,14 @@ class Selection(WidgetWrapper):
 
         jscode = Template("""
 require(["$JQueryId", "$SelectizeId"], function (jquery, _) {
-    $CallUntilTrue(function () {
+    let container = window.$container;
+    Promise.all([
+        container.channel.open("$valueTunnel"),
+        container.channel.open("$searchTunnel"),
+        container.ready.element(".$uniqueClassId select")
+    ]).then(([valueTunnel, searchTunnel, _el]) => {
         // get the selection container
         var $$el = jquery(".$uniqueClassId");
-        if (jquery('select', $$el).length == 0) {
-            return false;
-        }
 
         // make it looks beautiful
         jquery('select', $$el).selectize({
@@ -193,7 +206,7 @@ require(["$JQueryId", "$SelectizeId"], function (jquery, _) {
         });
 
         var selectize = jquery('select', $$el)[0].selectize;
-        window.IPyCallback.get("$valueTunnel").on_receive((version, payload) => {
+        valueTunnel.on_receive((version, payload) => {
             let msg = JSON.parse(payload);
             if (msg.type == 'set_value') {
                 if (msg.value == '') {
@@ -219,18 +232,24 @@ require(["$JQueryId", "$SelectizeId"], function (jquery, _) {
                 selectize.refreshOptions(false);
             }
         });
-        window.IPyCallback.get("$valueTunnel").send_msg(JSON.stringify({"type": "initialized"}));
-        return true;
-    }, 100);
+        // release the selectize instance when its element is removed from the page
+        container.registry.track($$el[0], () => {
+            selectize.destroy();
+            valueTunnel.detach();
+            searchTunnel.detach();
+        });
+        valueTunnel.send_msg(JSON.stringify({"type": "initialized"}));
+    });
 });
 """.strip()).substitute(JQueryId=JQuery.id(),
                         SelectizeId=Selectize.id(),
                         uniqueClassId=self.el_root_id,
                         selectizeOptions=selectize_options,
                         valueTunnel=self.el_value_tunnel.tunnel_id,
-                        CallUntilTrue=LabExt.call_until_true)
+                        searchTunnel=self.el_search_tunnel.tunnel_id,
+                        container=LabExt.container)
 
-        return [self.el_value_tunnel, self.el_search_tunnel, Javascript(jscode)]
+        return [Javascript(jscode)]
 
     def default_on_change_cb(self, value: str):
         pass
@@ -0,0 +1,360 @@
+import csv
+import io
+import os
+import sqlite3
+import tempfile
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional, Union, Tuple, TYPE_CHECKING
+
+from labext.widgets.data_table import ITable, serialize_column, columns_to_rows
+
+if TYPE_CHECKING:
+    # do this because pyarrow, numpy and pandas are optional
+    from pyarrow import Table
+    from numpy import ndarray
+    from pandas import Series
+
+
+class ITableArrow(ITable):
+    """A table of an Arrow IPC (Feather v2) file, which is memory-mapped so only the pages that are displayed are read
+    from the disk. It can also wrap an in-memory `pyarrow.Table`"""
+
+    def __init__(self, source: Union[str, Path, 'Table']):
+        import pyarrow as pa
+
+        if isinstance(source, pa.Table):
+            self.table = source
+        else:
+            # the file stays mapped as long as the table is alive
+            self.source = pa.memory_map(str(source), "r")
+            try:
+                self.table = pa.ipc.open_file(self.source).read_all()
+            except pa.ArrowInvalid:
+                self.source.seek(0)
+                self.table = pa.ipc.open_stream(self.source).read_all()
+
+    def columns(self) -> List[str]:
+        return self.table.column_names
+
+    def size(self) -> int:
+        return self.table.num_rows
+
+    def get_rows(self, start: int, end: int) -> List[list]:
+        return columns_to_rows(self.get_columns(start, end))
+
+    def get_columns(self, start: int, end: int) -> List[Union[list, 'ndarray']]:
+        # slicing is zero-copy
+        return arrow_columns(self.table.slice(start, max(0, end - start)))
+
+    def get_column(self, col: int, start: int, end: int) -> 'Series':
+        return self.table.column(col).slice(start, max(0, end - start)).to_pandas()
+
+
+class ITableParquet(ITable):
+    """A table of a Parquet file, which is read by row groups. Only the row groups of the displayed pages are read and
+    the latest ones are kept in memory"""
+
+    # maximum number of row groups that are kept in memory
+    max_cached_row_groups = 4
+
+    def __init__(self, path: Union[str, Path]):
+        import numpy as np
+        import pyarrow.parquet as pq
+
+        self.file = pq.ParquetFile(str(path), memory_map=True)
+        metadata = self.file.metadata
+        # rows of the i-th row group are from bounds[i] to bounds[i + 1]
+        self.bounds = np.cumsum([0] + [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)])
+        self.row_groups = OrderedDict()
+        self.lock = threading.Lock()
+
+    def columns(self) -> List[str]:
+        return self.file.schema_arrow.names
+
+    def size(self) -> int:
+        return int(self.bounds[-1])
+
+    def get_rows(self, start: int, end: int) -> List[list]:
+        return columns_to_rows(self.get_columns(start, end))
+
+    def get_columns(self, start: int, end: int) -> List[Union[list, 'ndarray']]:
+        import numpy as np
+        import pyarrow as pa
+
+        end = min(end, self.size())
+        if start >= end:
+            return [[] for _ in self.columns()]
+
+        first = int(np.searchsorted(self.bounds, start, side="right")) - 1
+        last = int(np.searchsorted(self.bounds, end, side="left"))
+        table = pa.concat_tables([self.get_row_group(i) for i in range(first, last)])
+        return arrow_columns(table.slice(start - int(self.bounds[first]), end - start))
+
+    def get_row_group(self, i: int) -> 'Table':
+        with self.lock:
+            table = self.row_groups.get(i)
+            if table is not None:
+                self.row_groups.move_to_end(i)
+                return table
+
+            table = self.file.read_row_group(i)
+            self.row_groups[i] = table
+            if len(self.row_groups) > self.max_cached_row_groups:
+                self.row_groups.popitem(last=False)
+            return table
+
+    def invalidate(self):
+        with self.lock:
+            self.row_groups.clear()
+
+
+class ITableSQLite(ITable):
+    """A table (or a view) of a SQLite database. Pages are queried on demand with keyset pagination (the query seeks
+    to the last row of a nearby page that has been served instead of skipping all rows before the page). The rows are
+    ordered by `rowid`, or by the sorted columns then `rowid` when the table is sorted. LIMIT/OFFSET is used when the
+    table doesn't have a `rowid`.
+
+    Each thread (see `LabExt.set_executor`) has its own read-only connection to the database, which is shared by the
+    sorted views of the table.
+
+    Example:
+        >>> DataTable(ITableSQLite("data.db", "logs"))
+    """
+    # number of sorted views and of positions of served pages (per view) that are kept
+    max_cached_orders = 8
+    max_anchors = 1024
+
+    def __init__(self, database: Union[str, Path], table: str, columns: Optional[List[str]] = None,
+                 keyset: bool = True, order: Tuple[Tuple[int, bool], ...] = (),
+                 local: Optional[threading.local] = None):
+        """
+        Parameters
+        ----------
+        database: Union[str, Path]
+            path of the database file
+        table: str
+            name of the table or the view
+        columns: Optional[List[str]]
+            columns to display, default is all columns
+        keyset: bool
+            use keyset pagination, it should be False if the table doesn't have `rowid` (e.g., views)
+        order: Tuple[Tuple[int, bool], ...]
+            list of (index of the column, ascending) that the rows are sorted by
+        local: Optional[threading.local]
+            connections of the threads, sorted views use the connections of their table
+        """
+        self.database = str(database)
+        self.table = table
+        self.keyset = keyset
+        self.order = order
+        self.local = local or threading.local()
+
+        if columns is None:
+            cursor = self.connection().execute(f"SELECT * FROM {quote(table)} LIMIT 0")
+            columns = [desc[0] for desc in cursor.description]
+        self.column_names = list(columns)
+        self.fields = ", ".join(quote(name) for name in self.column_names)
+        self.order_by = ", ".join(f"{quote(self.column_names[col])} {'ASC' if asc else 'DESC'}" for col, asc in order)
+        self.seek = seek_condition(self.column_names, order)
+
+        self.n_rows: Optional[int] = None
+        # positions (sorted) of the ends of the pages that have been served, and position => key (values of the sorted
+        # columns and rowid) of the row before it in the least recently used order
+        self.anchor_positions: List[int] = []
+        self.anchors: 'OrderedDict[int, tuple]' = OrderedDict()
+        # order => sorted view of the table
+        self.sorted_views: 'OrderedDict[tuple, ITableSQLite]' = OrderedDict()
+        self.lock = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(Path(self.database).absolute().as_uri() + "?mode=ro", uri=True)
+            self.local.conn = conn
+        return conn
+
+    def columns(self) -> List[str]:
+        return self.column_names
+
+    def size(self) -> int:
+        if self.n_rows is None:
+            self.n_rows = self.connection().execute(f"SELECT COUNT(*) FROM {quote(self.table)}").fetchone()[0]
+        return self.n_rows
+
+    def get_rows(self, start: int, end: int) -> List[list]:
+        if end <= start:
+            return []
+        conn = self.connection()
+        if not self.keyset:
+            order_by = "" if self.order_by == "" else f" ORDER BY {self.order_by}"
+            rows = conn.execute(f"SELECT {self.fields} FROM {quote(self.table)}{order_by} LIMIT ? OFFSET ?",
+                                (end - start, start)).fetchall()
+            return [list(row) for row in rows]
+
+        anchor, key = self.find_anchor(start)
+        where = "" if key is None else f" WHERE {self.seek}"
+        params = key or ()
+        order_by = "rowid" if self.order_by == "" else f"{self.order_by}, rowid"
+        rows = conn.execute(f"SELECT rowid, {self.fields} FROM {quote(self.table)}{where} ORDER BY {order_by} "
+                            f"LIMIT ?{len(params) + 1} OFFSET ?{len(params) + 2}",
+                            params + (end - start, start - anchor)).fetchall()
+        if len(rows) > 0:
+            last = rows[-1]
+            self.add_anchor(start + len(rows), tuple(last[col + 1] for col, _ in self.order) + (last[0],))
+        return [list(row[1:]) for row in rows]
+
+    def find_anchor(self, start: int) -> Tuple[int, Optional[tuple]]:
+        """Get the nearest position (and the key of the row before it) at or before start to seek to"""
+        with self.lock:
+            i = bisect_right(self.anchor_positions, start) - 1
+            if i < 0:
+                return 0, None
+            pos = self.anchor_positions[i]
+            self.anchors.move_to_end(pos)
+            return pos, self.anchors[pos]
+
+    def add_anchor(self, pos: int, key: tuple):
+        with self.lock:
+            if pos not in self.anchors:
+                insort(self.anchor_positions, pos)
+            self.anchors[pos] = key
+            self.anchors.move_to_end(pos)
+            if len(self.anchors) > self.max_anchors:
+                evicted, _ = self.anchors.popitem(last=False)
+                del self.anchor_positions[bisect_left(self.anchor_positions, evicted)]
+
+    def sort(self, order: List[Tuple[int, bool]]) -> Optional['ITable']:
+        if len(order) == 0:
+            return self
+        order = tuple((int(col), bool(asc)) for col, asc in order)
+        with self.lock:
+            table = self.sorted_views.get(order)
+            if table is not None:
+                self.sorted_views.move_to_end(order)
+                return table
+            table = ITableSQLite(self.database, self.table, self.column_names, keyset=self.keyset, order=order,
+                                 local=self.local)
+            table.n_rows = self.n_rows
+            self.sorted_views[order] = table
+            if len(self.sorted_views) > self.max_cached_orders:
+                self.sorted_views.popitem(last=False)
+            return table
+
+    def invalidate(self):
+        with self.lock:
+            self.n_rows = None
+            self.anchor_positions = []
+            self.anchors = OrderedDict()
+            self.sorted_views.clear()
+
+
+class ITableCSV(ITable):
+    """A table of a (large) CSV/TSV file. The byte offsets of the lines are indexed once and stored in a sidecar file
+    (`<file>.labext-idx`, re-built when the file changes), which is memory-mapped so that a page is read by a single
+    seek regardless of the size of the file.
+
+    Each record must be in one line (i.e., values do not contain line breaks). Values are strings.
+    """
+
+    def __init__(self, path: Union[str, Path], delimiter: str = ",", header: bool = True, encoding: str = "utf-8",
+                 index_file: Optional[Union[str, Path]] = None):
+        self.path = str(path)
+        self.delimiter = delimiter
+        self.encoding = encoding
+        self.header = header
+        self.index_file = str(index_file or self.path + ".labext-idx")
+        self.offsets = load_line_index(self.path, self.index_file)
+        self.file_size = os.path.getsize(self.path)
+        self.file = open(self.path, "rb")
+        self.lock = threading.Lock()
+
+        first_line = self.read_lines(0, 1)[0] if len(self.offsets) > 0 else []
+        self.column_names = first_line if header else [str(i) for i in range(len(first_line))]
+
+    def columns(self) -> List[str]:
+        return self.column_names
+
+    def size(self) -> int:
+        return max(0, len(self.offsets) - int(self.header))
+
+    def get_rows(self, start: int, end: int) -> List[list]:
+        return self.read_lines(start + int(self.header), min(end, self.size()) + int(self.header))
+
+    def read_lines(self, start: int, end: int) -> List[list]:
+        if end <= start:
+            return []
+        begin = int(self.offsets[start])
+        stop = int(self.offsets[end]) if end < len(self.offsets) else self.file_size
+        with self.lock:
+            self.file.seek(begin)
+            content = self.file.read(stop - begin)
+        text = io.StringIO(content.decode(self.encoding), newline="")
+        return [row for row in csv.reader(text, delimiter=self.delimiter)]
+
+
+def arrow_columns(table: 'Table') -> List[Union[list, 'ndarray']]:
+    """Convert the columns of an Arrow table to values that can be sent to the client"""
+    return [serialize_column(column.to_pandas()) for column in table.columns]
+
+
+def seek_condition(column_names: List[str], order: Tuple[Tuple[int, bool], ...]) -> str:
+    """Get the condition of the rows that come after a row in the order of the columns then rowid (NULLs are the
+    smallest values in SQLite). The parameters of the condition (`?1`, `?2`, ...) are the values of the columns and the
+    rowid of the row, e.g., `((?1 IS NULL AND "a" IS NOT NULL) OR "a" > ?1) OR ("a" IS ?1 AND rowid > ?2)` when the
+    rows are sorted by `a` ascending"""
+    equals = []
+    clauses = []
+    for i, (col, asc) in enumerate(order):
+        name, value = quote(column_names[col]), f"?{i + 1}"
+        if asc:
+            clauses.append(equals + [f"(({value} IS NULL AND {name} IS NOT NULL) OR {name} > {value})"])
+        else:
+            clauses.append(equals + [f"(({name} IS NULL AND {value} IS NOT NULL) OR {name} < {value})"])
+        equals = equals + [f"{name} IS {value}"]
+    clauses.append(equals + [f"rowid > ?{len(order) + 1}"])
+    return " OR ".join("(" + " AND ".join(clause) + ")" for clause in clauses)
+
+
+def quote(name: str) -> str:
+    """Quote an identifier of SQLite"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def load_line_index(path: str, index_file: str, chunk_size: int = 1 << 24) -> 'ndarray':
+    """Get the byte offsets of the lines of a file from its index file, the index is built if it doesn't exist or the
+    file has been changed since the index was built.
+
+    The index file contains the size and the modification time (ns) of the file followed by the offsets, all of them
+    are little-endian int64.
+    """
+    import numpy as np
+
+    stat = os.stat(path)
+    if os.path.exists(index_file):
+        index = np.memmap(index_file, dtype="<i8", mode="r")
+        if len(index) >= 2 and index[0] == stat.st_size and index[1] == stat.st_mtime_ns:
+            return index[2:]
+        del index
+
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(index_file)),
+                                    prefix=f".{os.path.basename(index_file)}")
+    try:
+        with os.fdopen(fd, "wb") as out, open(path, "rb") as f:
+            out.write(np.array([stat.st_size, stat.st_mtime_ns], dtype="<i8").tobytes())
+            if stat.st_size > 0:
+                out.write(np.array([0], dtype="<i8").tobytes())
+            position = 0
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                # a line starts after every line break, except the one at the end of the file
+                starts = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == 10) + position + 1
+                position += len(chunk)
+                out.write(starts[starts < stat.st_size].astype("<i8").tobytes())
+        os.replace(tmp_file, index_file)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    return np.memmap(index_file, dtype="<i8", mode="r")[2:]
@@ -14,7 +14,7 @@ setup(name="labext",
       author="Binh Vu",
       author_email="binh@toan2.com",
       url="https://github.com/binh-vu/labext",
-      python_requires='>3.6',
+      python_requires='>=3.7',
       license="MIT",
       install_requires=['ipywidgets', 'IPython', 'jupyter_core', 'requests', 'ipyevents', 'ipycallback>=0.2.5', 'ujson'],
       package_data={'': ['*.js', '*.ts']})
@@ -0,0 +1,48 @@
+import hashlib
+
+import ujson
+
+from labext.cache import AssetCache
+
+
+def make_bundle(path, files: dict, manifest: dict):
+    path.mkdir()
+    for relpath, content in files.items():
+        (path / relpath).parent.mkdir(exist_ok=True, parents=True)
+        (path / relpath).write_bytes(content)
+    (path / AssetCache.manifest_file).write_text(ujson.dumps(manifest))
+
+
+def entry(relpath: str, content: bytes) -> dict:
+    return {"url": f"https://example.com/{relpath}", "version": "1.0", "path": relpath,
+            "sha256": hashlib.sha256(content).hexdigest(), "size": len(content), "etag": None}
+
+
+def test_seed_rejects_paths_outside_of_the_cache(tmp_path):
+    cache = AssetCache(tmp_path / "cache")
+    outside = tmp_path / "outside.js"
+    manifest = {
+        "a": entry("../outside.js", b"evil"),
+        "b": entry(str(outside), b"evil"),
+        "c": entry("js/c.js", b"ok"),
+    }
+    make_bundle(tmp_path / "bundle", {"../outside.js": b"evil", "js/c.js": b"ok"}, manifest)
+    outside.unlink()
+
+    assert cache.seed(tmp_path / "bundle") == 1
+    assert not outside.exists()
+    assert (tmp_path / "cache" / "js" / "c.js").read_bytes() == b"ok"
+    assert set(cache.manifest.keys()) == {"c"}
+
+
+def test_seed_keeps_cached_asset_when_bundle_is_corrupted(tmp_path):
+    cache = AssetCache(tmp_path / "cache")
+    make_bundle(tmp_path / "good", {"js/a.js": b"good"}, {"a": entry("js/a.js", b"good")})
+    assert cache.seed(tmp_path / "good") == 1
+
+    # the bundle has a newer version of the asset, but the file doesn't match its hash
+    make_bundle(tmp_path / "bad", {"js/a.js": b"corrupted"}, {"a@2.0": entry("js/a.js", b"new")})
+    assert cache.seed(tmp_path / "bad") == 0
+    assert (tmp_path / "cache" / "js" / "a.js").read_bytes() == b"good"
+    assert cache.is_valid("a", tmp_path / "cache" / "js" / "a.js")
+    assert [p.name for p in (tmp_path / "cache" / "js").iterdir()] == ["a.js"]
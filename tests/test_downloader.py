@@ -0,0 +1,46 @@
+import pytest
+
+from labext.cache import AssetCache
+from labext.downloader import Downloader
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, content: bytes = b"", headers: dict = None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise IOError(f"HTTP {self.status_code}")
+
+
+class FakeSession:
+    def __init__(self, responses: list):
+        self.responses = responses
+        self.requests = []
+
+    def get(self, url, timeout=None, headers=None):
+        self.requests.append(headers)
+        return self.responses.pop(0)
+
+
+def test_not_modified_reuses_the_previous_version(tmp_path):
+    cache = AssetCache(tmp_path)
+    downloader = Downloader()
+    filepath = str(tmp_path / "a.js")
+    downloader._session = FakeSession([FakeResponse(200, b"a", {"ETag": "v1"}), FakeResponse(304)])
+    downloader.fetch_file(cache, "https://example.com/a.js", filepath, "1.0")
+    downloader.fetch_file(cache, "https://example.com/a.js", filepath, "2.0")
+
+    assert downloader._session.requests[1] == {"If-None-Match": "v1"}
+    assert cache.is_valid(AssetCache.get_key("https://example.com/a.js", "2.0"), filepath)
+
+
+def test_unconditional_not_modified_is_an_error(tmp_path):
+    cache = AssetCache(tmp_path)
+    downloader = Downloader()
+    downloader._session = FakeSession([FakeResponse(304)])
+    with pytest.raises(IOError):
+        downloader.fetch_file(cache, "https://example.com/a.js", str(tmp_path / "a.js"), "1.0")
+    assert cache.manifest == {}
@@ -0,0 +1,21 @@
+import subprocess
+import sys
+from pathlib import Path
+
+CHECK_PRELUDE = """
+import sys, time
+start = time.perf_counter()
+import labext.prelude
+elapsed = time.perf_counter() - start
+heavy = [name for name in ("ipywidgets", "ipycallback", "pandas", "requests") if name in sys.modules]
+print(repr((elapsed, heavy)))
+"""
+
+
+def test_prelude_is_imported_lazily():
+    output = subprocess.run([sys.executable, "-c", CHECK_PRELUDE], cwd=Path(__file__).parent.parent, check=True,
+                            capture_output=True, text=True).stdout
+    elapsed, heavy = eval(output.strip().splitlines()[-1])
+    assert heavy == []
+    # the widget stack and pandas take around a second to import
+    assert elapsed < 0.5
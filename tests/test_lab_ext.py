@@ -0,0 +1,69 @@
+import ipywidgets.widgets as widgets
+import ujson
+
+from labext.modules import LabExt
+from labext.tag import Tag
+from labext.widgets.button import HTMLButton
+from labext.widgets.checkbox import Checkbox
+
+
+class FakeTunnel:
+    def __init__(self):
+        self.messages = []
+
+    def send_msg(self, msg: str):
+        self.messages.append(msg)
+
+
+def test_batch_refreshes_without_syncing_widgets(monkeypatch):
+    tunnel = FakeTunnel()
+    synced = []
+    monkeypatch.setattr(LabExt, "tunnel", tunnel)
+    monkeypatch.setattr(widgets.Widget, "_send", lambda self, msg, buffers=None: synced.append(msg))
+
+    checkboxes = [Checkbox() for _ in range(10)]
+    buttons = [HTMLButton(Tag.button("save")) for _ in range(10)]
+    synced.clear()
+    with LabExt.batch():
+        for checkbox in checkboxes:
+            checkbox.check()
+        for btn in buttons:
+            btn.btn.attr(title="saved")
+            btn.refresh_button()
+
+    assert synced == []
+    assert len(tunnel.messages) == 1
+    msgs = ujson.loads(tunnel.messages[0])
+    assert len(msgs) == 20 and all(msg["op"] == "dom.patch" for msg in msgs)
+    assert all('checked="1"' in checkbox.el.value for checkbox in checkboxes)
+    assert all('title="saved"' in btn.el_btn.value for btn in buttons)
+
+
+def test_checkbox_click_is_not_synced_back(monkeypatch):
+    tunnel = FakeTunnel()
+    synced = []
+    monkeypatch.setattr(LabExt, "tunnel", tunnel)
+    monkeypatch.setattr(widgets.Widget, "_send", lambda self, msg, buffers=None: synced.append(msg))
+
+    checkbox = Checkbox()
+    synced.clear()
+    checkbox.on_js_event(0, {"value": True})
+    assert checkbox.value and 'checked="1"' in checkbox.el.value
+    assert synced == [] and tunnel.messages == []
+
+
+def test_user_ops_are_replayed_when_the_tunnel_connects(monkeypatch):
+    tunnel = FakeTunnel()
+    monkeypatch.setattr(LabExt, "tunnel", tunnel)
+    monkeypatch.setattr(LabExt, "ops", {})
+
+    LabExt.register_op("text.set", "(id, text) => { document.getElementById(id).textContent = text; }")
+    LabExt.register_op("text.clear", "(id) => { document.getElementById(id).textContent = ''; }")
+    assert '"text.set"' in LabExt.init_code()
+
+    tunnel.messages.clear()
+    LabExt.on_receive_tunnel_msg(1, ujson.dumps({"receiver": LabExt.tunnel_id, "connect": True}))
+    assert len(tunnel.messages) == 1
+    assert ujson.loads(tunnel.messages[0]) == [
+        {"op": "op.register", "args": [name, jscode]} for name, jscode in LabExt.ops.items()
+    ]
@@ -0,0 +1,101 @@
+import threading
+import time
+
+import pytest
+import ujson
+
+from labext import metrics
+from labext.modules import LabExt, Route
+from labext.modules.lab_ext import ROUTE_PREFIX
+
+
+class FakeTunnel:
+    def __init__(self):
+        self.messages = []
+
+    def send_msg(self, msg: str):
+        self.messages.append(msg)
+
+
+@pytest.fixture
+def tunnel(monkeypatch):
+    tunnel = FakeTunnel()
+    monkeypatch.setattr(LabExt, "tunnel", tunnel)
+    yield tunnel
+    LabExt.set_executor(None)
+
+
+def route_responses(tunnel: FakeTunnel, route: Route) -> list:
+    responses = []
+    for msg in tunnel.messages:
+        if msg.startswith(ROUTE_PREFIX):
+            header, payload = msg[len(ROUTE_PREFIX):].split("\n", 1)
+            header = ujson.loads(header)
+            if header['route'] == route.tunnel_id and header['response']:
+                responses.append((header['version'], payload))
+    return responses
+
+
+def test_page_flips_drop_superseded_requests(tunnel):
+    LabExt.set_executor(4)
+    route = Route()
+
+    def handler(version: int, msg: str):
+        if route.is_superseded(version):
+            return None
+        time.sleep(0.0001)
+        return msg
+
+    route.on_request(handler)
+    n_flips = 10000
+    for version in range(1, n_flips + 1):
+        route._on_request(version, f"page {version}")
+        if version % 1000 == 500:
+            # the client answers the next page from its cache
+            route._on_cancel(version)
+
+    deadline = time.time() + 30
+    while (LabExt.jobs_queued > 0 or LabExt.jobs_running > 0 or route.inflight is not None) and time.time() < deadline:
+        time.sleep(0.01)
+
+    responses = route_responses(tunnel, route)
+    versions = [version for version, _ in responses]
+    assert versions == sorted(set(versions))
+    assert responses[-1] == (n_flips, f"page {n_flips}")
+    assert all(payload == f"page {version}" for version, payload in responses)
+    # most of the requests are dropped before their handlers run
+    assert len(responses) < n_flips // 10
+
+    stats = route.metrics.to_dict()
+    assert stats['requests'] == n_flips and stats['inflight'] == 0 and stats['errors'] == 0
+    assert route.request_times == {}
+    assert LabExt.jobs_queued == 0 and LabExt.jobs_running == 0
+    route.close()
+
+
+def test_client_close_releases_the_route(tunnel):
+    LabExt.set_executor(1)
+    route = Route()
+    started, release = threading.Event(), threading.Event()
+
+    def handler(version: int, msg: str):
+        started.set()
+        release.wait(5)
+        return msg
+
+    route.on_request(handler)
+    LabExt.on_receive_tunnel_msg(0, ujson.dumps({"receiver": route.tunnel_id, "version": 1, "request": True,
+                                                 "content": "page 1"}))
+    started.wait(5)
+    # the second request waits for the thread and is cancelled when the route is closed
+    LabExt.on_receive_tunnel_msg(0, ujson.dumps({"receiver": route.tunnel_id, "version": 2, "request": True,
+                                                 "content": "page 2"}))
+    LabExt.on_receive_tunnel_msg(0, ujson.dumps({"receiver": route.tunnel_id, "close": True}))
+    release.set()
+    LabExt.executor.shutdown(wait=True)
+
+    assert route.tunnel_id not in LabExt.routes
+    assert route.tunnel_id not in metrics.routes
+    assert route.inflight is None and route.request_times == {}
+    # neither the responses nor a close notice are sent back to the client
+    assert tunnel.messages == []
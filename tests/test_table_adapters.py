@@ -0,0 +1,42 @@
+import random
+import sqlite3
+
+import pytest
+
+from labext.widgets.table_adapters import ITableSQLite
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / "data.db")
+    rng = random.Random(1)
+    rows = [(rng.choice([None, *range(20)]), rng.choice([None, "x", "y", "z"]), rng.random()) for _ in range(2000)]
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE t (a INTEGER, b TEXT, c REAL)")
+    conn.executemany("INSERT INTO t VALUES (?, ?, ?)", rows)
+    conn.commit()
+    yield path, conn
+    conn.close()
+
+
+@pytest.mark.parametrize("order", [[(0, True)], [(0, False), (1, True)], [(1, False), (0, True), (2, False)]])
+def test_sqlite_sorted_pages(database, order, monkeypatch):
+    path, conn = database
+    expected = [list(row) for row in conn.execute("SELECT a, b, c FROM t ORDER BY " + ", ".join(
+        f"{'abc'[col]} {'ASC' if asc else 'DESC'}" for col, asc in order) + ", rowid")]
+    monkeypatch.setattr(ITableSQLite, "max_anchors", 16)
+    table = ITableSQLite(path, "t")
+    view = table.sort(order)
+    assert view is table.sort(order) and view.local is table.local
+
+    rows = []
+    for start in range(0, 2000, 50):
+        rows += view.get_rows(start, start + 50)
+    assert rows == expected
+
+    rng = random.Random(2)
+    for _ in range(100):
+        start = rng.randrange(0, 2000)
+        end = start + rng.randrange(1, 60)
+        assert view.get_rows(start, end) == expected[start:end]
+    assert len(view.anchors) <= 16 and view.anchor_positions == sorted(view.anchors)
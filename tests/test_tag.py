@@ -0,0 +1,47 @@
+import io
+import time
+
+from labext.tag import Tag
+
+
+def make_table(n_rows: int, cell=lambda i, j: f"<{i}> & {j}") -> Tag:
+    """A table of n_rows * 4 cells (5 nodes per row)"""
+    rows = []
+    for i in range(n_rows):
+        rows.append(Tag.tr([Tag.td(cell(i, j)).attr(title=f'"{i}"').css(width="10px") for j in range(4)])
+                    .data(row=i))
+    return Tag.table(Tag.tbody(rows)).attr(htmlClass="dataTable")
+
+
+def test_serialize_and_diff_10k_nodes():
+    tree = make_table(2000)
+    start = time.perf_counter()
+    html = tree.value()
+    elapsed = time.perf_counter() - start
+    assert html.count("<td") == 8000 and "&lt;0&gt; &amp; 0" in html and 'title="&quot;0&quot;"' in html
+    buffer = io.StringIO()
+    tree.write(buffer, buffer_size=100)
+    assert buffer.getvalue() == html
+
+    new = tree.copy()
+    new.children[0].children[5].attr(title="changed")
+    start = time.perf_counter()
+    patches = tree.diff(new)
+    elapsed += time.perf_counter() - start
+    assert patches == [{"attrs": {"title": "changed"}, "path": [0, 5]}]
+    assert elapsed < 1.0
+
+
+def test_compiled_template_matches_value():
+    record = {"name": "a < b & c", "title": '"quoted"', "url": "https://example.com/?a=1&b=2"}
+    template = Tag.tr([
+        Tag.td(Tag.slot("name")).attr(title=Tag.slot("title")),
+        Tag.td(Tag.a(Tag.slot("name")).attr(href=Tag.slot("url"))),
+    ]).compile()
+    expected = Tag.tr([
+        Tag.td(record["name"]).attr(title=record["title"]),
+        Tag.td(Tag.a(record["name"]).attr(href=record["url"])),
+    ]).value()
+    assert template.render(record) == expected
+    assert template.render_many([record, record]) == [expected, expected]
+    assert template.render_columns({name: [value] for name, value in record.items()}) == [expected]
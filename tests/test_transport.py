@@ -0,0 +1,43 @@
+import numpy as np
+import ujson
+
+from labext import transport
+
+
+class FakeTunnel:
+    def __init__(self):
+        self.js_endpoint = (0, "")
+        self.messages = []
+
+    def send_msg(self, msg: str):
+        self.messages.append(msg)
+
+    def send_msg_with_version(self, version: int, msg: str):
+        self.messages.append(msg)
+
+    def send(self, content: dict, buffers: list):
+        self.messages.append((content, buffers))
+
+
+def test_send_large_integers_as_json():
+    tunnel = FakeTunnel()
+    ids = np.arange(5, dtype=np.int64) + 2 ** 60
+    transport.send(tunnel, {"columns": [ids]}, version=1)
+    assert ujson.loads(tunnel.messages[0]) == {"columns": [ids.tolist()]}
+
+
+def test_send_object_arrays_as_json():
+    tunnel = FakeTunnel()
+    values = np.array(["a", None, 1], dtype=object)
+    transport.send(tunnel, {"columns": [values]})
+    assert ujson.loads(tunnel.messages[0]) == {"columns": [["a", None, 1]]}
+
+
+def test_send_numeric_arrays_as_binary():
+    tunnel = FakeTunnel()
+    values = np.arange(2048, dtype=np.float64)
+    transport.send(tunnel, {"columns": [values, np.array(["a"], dtype=object)]}, version=1)
+    content, buffers = tunnel.messages[0]
+    assert content['header']['columns'][0]['dtype'] == "float64"
+    assert content['header']['columns'][1] == ["a"]
+    assert len(buffers) == 1